@@ -1,16 +1,22 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, current_app
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, session, current_app, stream_with_context
 import json
 import os
 import requests
 from datetime import datetime
 import sqlite3
-from supabase_service import SupabaseService
+from supabase_service import supabase_service, parse_timestamp
 from auth_routes import require_auth
-from werkzeug.utils import secure_filename
-
-# Crear instancia de SupabaseService
-supabase_service = SupabaseService()
+from cache_utils import StaleWhileRevalidateCache, compute_etag
+from http_client import env_int
+from duffel_service import duffel_service, normalize_search, compact_offer, DuffelError, DUFFEL_MAX_OFFERS
+from airport_index import airport_index
+from charter_registry import charter_registry, parse_routes as parse_charter_routes
+from charter_search import charter_search
+from flight_search_jobs import flight_search_jobs, STATUS_PARTIAL
+from push_fanout import broadcast_engine, get_target_user_ids
+from image_pipeline import image_pipeline, register_target as register_image_target
+from upload_validation import upload_limit, detected_extension, MB, UPLOAD_MAX_IMAGE_SIZE, LOGO_TYPES
 
 # Funciones de compatibilidad para local_db
 class LocalDB:
@@ -22,25 +28,90 @@ class LocalDB:
     
     def update_product(self, product_id, data):
         return supabase_service.update_product(product_id, data)
-
-# Función de compatibilidad para storage_service
-class StorageService:
-    def upload_image(self, file, bucket_name='product-images', folder='products'):
-        # Función simple para subir imágenes
-        return f"/static/uploads/{file.filename}"
+    
+    def get_vehicles(self):
+        return supabase_service.get_vehicles()
+    
+    def delete_vehicle(self, vehicle_id):
+        return supabase_service.delete_vehicle(vehicle_id)
 
 # Crear instancias
 local_db = LocalDB()
-storage_service = StorageService()
 
 admin = Blueprint('admin', __name__, url_prefix='/admin')
 
 # Configuración para subida de archivos
 UPLOAD_FOLDER = 'static/uploads'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+# Límites de subida por ruta (el tipo se valida por contenido en upload_validation.py)
+LOGO_MAX_SIZE = env_int('LOGO_MAX_SIZE', 2 * MB)
+VEHICLE_MAX_PHOTOS = env_int('VEHICLE_MAX_PHOTOS', 10)
+SINGLE_IMAGE_REQUEST_MAX = UPLOAD_MAX_IMAGE_SIZE + MB
+
+# Al terminar las variantes de una imagen se actualiza el registro dueño (ver image_pipeline.py)
+register_image_target('products', lambda record_id, url: supabase_service.update_product(record_id, {'image_url': url}))
+register_image_target('banners', lambda record_id, url: supabase_service.update_banner(record_id, {'image_url': url}))
+register_image_target('vehicles', lambda record_id, urls: supabase_service.update_vehicle(record_id, {'photos': urls}),
+                      multiple=True)
+
+def get_record_id(result):
+    """Id del registro recién creado (Supabase retorna una lista con la fila)"""
+    if isinstance(result, list):
+        result = result[0] if result else None
+    if isinstance(result, dict):
+        return result.get('id')
+    return result
+
+# Paginación de listados del panel
+DEFAULT_PAGE_SIZE = env_int('ADMIN_DEFAULT_PAGE_SIZE', 100)
+
+def get_page_args(default_order='id.asc'):
+    """Leer page/limit/cursor/select/order de la query string"""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        raise ValueError('page y limit deben ser enteros')
+    if limit < 1 or page < 1:
+        raise ValueError('page y limit deben ser mayores que 0')
+    return {
+        'select': request.args.get('select'),
+        'order': request.args.get('order', default_order),
+        'limit': limit,
+        'offset': (page - 1) * limit,
+        'cursor': request.args.get('cursor')
+    }
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def paged_response(page):
+    """Responder la lista de la página con Content-Range y cursor en headers"""
+    rows = page['data']
+    total = page['total']
+    response = jsonify(rows)
+    total_label = total if total is not None else '*'
+    if rows:
+        start = page['offset']
+        response.headers['Content-Range'] = '{}-{}/{}'.format(start, start + len(rows) - 1, total_label)
+    else:
+        response.headers['Content-Range'] = '*/{}'.format(total_label)
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    if page['next_cursor'] is not None:
+        response.headers['X-Next-Cursor'] = str(page['next_cursor'])
+    response.headers['Access-Control-Expose-Headers'] = 'Content-Range, X-Total-Count, X-Next-Cursor'
+    return response
+
+# Caché de banners activos (endpoint público consultado en cada arranque de la app)
+BANNERS_CACHE_TTL = env_int('BANNERS_CACHE_TTL', 60)
+BANNERS_CACHE_STALE_TTL = env_int('BANNERS_CACHE_STALE_TTL', 300)
+active_banners_cache = StaleWhileRevalidateCache(
+    supabase_service.get_active_banners,
+    ttl=BANNERS_CACHE_TTL,
+    stale_ttl=BANNERS_CACHE_STALE_TTL,
+    name='active_banners'
+)
+
+# El índice local de aeropuertos arranca con el dataset incluido y se refresca desde Duffel
+if duffel_service.is_configured() and airport_index.needs_refresh():
+    airport_index.refresh_in_background(duffel_service)
 
 # Configuración del panel
 ADMIN_CONFIG = {
@@ -109,13 +180,19 @@ def products():
 @admin.route('/api/products')
 @require_auth
 def get_products():
-    """Obtener productos desde base de datos local"""
+    """Obtener productos paginados desde Supabase (fallback a base de datos local)"""
+    try:
+        page_args = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
         # Intentar obtener desde Supabase primero
         try:
-            products = supabase_service.get_products()
-            if products:
-                return jsonify(products)
+            page = supabase_service.get_page('products', **page_args)
+            if page['data'] or page['total'] is not None:
+                return paged_response(page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except:
             pass
         
@@ -127,45 +204,30 @@ def get_products():
 
 @admin.route('/api/products', methods=['POST'])
 @require_auth
+@upload_limit(SINGLE_IMAGE_REQUEST_MAX)
 def add_product():
     """Agregar nuevo producto con imagen"""
     try:
         data = request.form.to_dict()
         
-        # Manejar subida de imagen
+        # Manejar subida de imagen: se guarda el original y las variantes se generan en segundo plano
+        upload = None
         if 'image' in request.files:
             file = request.files['image']
-            if file and allowed_file(file.filename):
-                # Subir imagen a Supabase Storage
-                image_url = storage_service.upload_image(file, bucket_name='product-images', folder='products')
-                if image_url:
-                    data['image_url'] = image_url
-                else:
-                    # Fallback: guardar localmente si falla Supabase
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = "{}_{}".format(timestamp, filename)
-                    
-                    # Crear directorio si no existe
-                    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    
-                    # URL de la imagen local
-                    data['image_url'] = '/static/uploads/{}'.format(filename)
+            if file and file.filename:
+                upload = image_pipeline.save_upload(file, ext=detected_extension(file))
+                data['image_url'] = upload['url']
         
         # Validar datos requeridos
         if not data.get('name') or not data.get('price'):
             return jsonify({'error': 'Nombre y precio son requeridos'}), 400
         
-        # Intentar agregar a Supabase primero
-        try:
-            product = supabase_service.add_product(data)
-            return jsonify(product)
-        except:
-            # Si falla Supabase, usar base de datos local
-            product = local_db.add_product(data)
-            return jsonify(product)
+        product = supabase_service.create_product(data)
+        if product is None:
+            return jsonify({'error': 'No se pudo guardar el producto'}), 500
+        if upload:
+            image_pipeline.submit(upload, kind='products', record_id=get_record_id(product))
+        return jsonify(product)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -248,47 +310,43 @@ def get_banners():
 
 @admin.route('/api/banners/active')
 def get_active_banners():
-    """Obtener solo banners activos (público)"""
+    """Obtener solo banners activos (público, cacheado con ETag)"""
     try:
-        # Intentar obtener desde Supabase primero
-        try:
-            banners = supabase_service.get_active_banners()
-            if banners:
-                return jsonify(banners)
-        except:
-            pass
+        banners, etag = active_banners_cache.get()
         
-        # Si falla Supabase, usar base de datos local
-        banners = local_db.get_active_banners()
-        return jsonify(banners)
+        # El cliente ya tiene esta versión: 304 sin cuerpo
+        if request.if_none_match.contains_weak(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify(banners)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age={}, stale-while-revalidate={}'.format(
+            BANNERS_CACHE_TTL, BANNERS_CACHE_STALE_TTL)
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @admin.route('/api/banners', methods=['POST'])
 @require_auth
+@upload_limit(SINGLE_IMAGE_REQUEST_MAX)
 def add_banner():
     """Agregar nuevo banner con imagen"""
     try:
         data = request.form.to_dict()
         
-        # Manejar subida de imagen
+        # Manejar subida de imagen: se guarda el original y las variantes se generan en segundo plano
+        upload = None
         if 'image' in request.files:
             file = request.files['image']
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = "banner_{}_{}".format(timestamp, filename)
-                
-                # Crear directorio si no existe
-                os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(file_path)
-                
-                # URL de la imagen
-                data['image_url'] = '/static/uploads/{}'.format(filename)
+            if file and file.filename:
+                upload = image_pipeline.save_upload(file, ext=detected_extension(file))
+                data['image_url'] = upload['url']
         
         # Agregar banner a Supabase
-        banner = supabase_service.add_banner(data)
+        banner = supabase_service.create_banner(data)
+        if upload:
+            image_pipeline.submit(upload, kind='banners', record_id=get_record_id(banner))
+        active_banners_cache.invalidate()
         return jsonify(banner)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -300,6 +358,7 @@ def update_banner(banner_id):
     try:
         data = request.json
         banner = supabase_service.update_banner(banner_id, data)
+        active_banners_cache.invalidate()
         return jsonify(banner)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -310,6 +369,7 @@ def delete_banner(banner_id):
     """Eliminar banner"""
     try:
         supabase_service.delete_banner(banner_id)
+        active_banners_cache.invalidate()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -324,6 +384,7 @@ def toggle_banner(banner_id):
         
         # Actualizar el estado del banner en Supabase
         result = supabase_service.update_banner(banner_id, {'is_active': active})
+        active_banners_cache.invalidate()
         
         if result.get('success'):
             return jsonify({'success': True, 'active': active})
@@ -342,13 +403,19 @@ def users():
 @admin.route('/api/users', methods=['GET'])
 @require_auth
 def get_users():
-    """Obtener usuarios desde base de datos local"""
+    """Obtener usuarios paginados desde Supabase (fallback a base de datos local)"""
+    try:
+        page_args = get_page_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
         # Intentar obtener desde Supabase primero
         try:
-            users = supabase_service.get_users()
-            if users:
-                return jsonify(users)
+            page = supabase_service.get_page('users', **page_args)
+            if page['data'] or page['total'] is not None:
+                return paged_response(page)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except:
             pass
         
@@ -461,10 +528,12 @@ def orders():
 @admin.route('/api/orders')
 @require_auth
 def get_orders():
-    """Obtener órdenes desde Supabase"""
+    """Obtener órdenes paginadas desde Supabase (más recientes primero)"""
     try:
-        orders = supabase_service.get_orders()
-        return jsonify(orders)
+        page = supabase_service.get_page('orders', **get_page_args(default_order='id.desc'))
+        return paged_response(page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -549,119 +618,191 @@ def get_flights():
 
 # ===== ENDPOINTS PARA APP FLUTTER =====
 
+# Máximo de ofertas que se envían a la app Flutter por búsqueda
+FLUTTER_MAX_OFFERS = 20
+
+def offer_to_flutter(offer, origin=None, destination=None):
+    """Transformar una oferta de Duffel al formato de la app Flutter (None si no tiene segmentos)"""
+    offer = compact_offer(offer)
+    if not offer.get('slices'):
+        return None
+    slice_data = offer['slices'][0]
+    if not slice_data.get('segments'):
+        return None
+    first_segment = slice_data['segments'][0]
+    
+    # Obtener información de aerolínea
+    airline_name = 'Aerolínea'
+    airline_code = ''
+    airline_logo = ''
+    
+    if first_segment.get('marketing_carrier'):
+        carrier = first_segment['marketing_carrier']
+        airline_name = carrier['name'] or 'Aerolínea'
+        airline_code = carrier['iata_code'] or ''
+        if carrier.get('logo_symbol_url'):
+            # Convertir SVG a PNG para compatibilidad con Android
+            svg_url = carrier['logo_symbol_url']
+            airline_logo = svg_url.replace('.svg', '.png')
+    
+    return {
+        'id': offer['id'],
+        'airline': airline_name,
+        'airline_code': airline_code,
+        'airline_logo': airline_logo,
+        'departureTime': first_segment['departing_at'] or '',
+        'arrivalTime': first_segment['arriving_at'] or '',
+        'duration': slice_data['duration'] or '',
+        'stops': len(slice_data['segments']) - 1,
+        'price': float(offer['total_amount'] or '0'),
+        'currency': offer['total_currency'] or 'USD',
+        'origin_airport': first_segment['origin']['iata_code'] or origin,
+        'destination_airport': first_segment['destination']['iata_code'] or destination
+    }
+
+def iter_flutter_flights(offer_pages, origin=None, destination=None):
+    """Generador de vuelos en formato Flutter a partir de páginas de ofertas de Duffel"""
+    for page in offer_pages:
+        for offer in page:
+            flight_data = offer_to_flutter(offer, origin, destination)
+            if flight_data:
+                yield flight_data
+
+def collect_flights(search, airline_type, origin=None, destination=None, limit=FLUTTER_MAX_OFFERS, on_progress=None):
+    """Obtener los vuelos de una búsqueda normalizada en formato Flutter
+
+    on_progress(flights) se llama tras cada página de Duffel con los vuelos acumulados.
+    Los scrapers charter corren en paralelo con Duffel: 'ambos' tarda lo que el más lento.
+    """
+    flights = []
+    
+    # Lanzar primero los charter para que avancen mientras se consulta Duffel
+    charter = charter_search.start(search) if airline_type in ['charter', 'ambos'] else None
+    
+    if airline_type in ['comerciales', 'ambos']:
+        # Ofertas desde caché o Duffel siguiendo el cursor (errores de Duffel = sin resultados, como antes)
+        try:
+            for page in duffel_service.iter_offer_pages(search, limit):
+                flights.extend(iter_flutter_flights([page], origin, destination))
+                if on_progress:
+                    on_progress(flights)
+        except DuffelError as e:
+            print(f"⚠️ Duffel respondió {e.status_code}: {e.message}")
+        
+        print(f"✈️ Vuelos Duffel encontrados: {len(flights)}")
+    
+    if charter is not None:
+        flights.extend(charter.result())
+        flights.sort(key=lambda flight: flight['price'])
+        flights = flights[:limit]
+        if on_progress:
+            on_progress(flights)
+    
+    print(f"🎯 Total vuelos encontrados: {len(flights)}")
+    return flights
+
+def stream_flights(search, airline_type, origin=None, destination=None, limit=FLUTTER_MAX_OFFERS):
+    """Generador NDJSON: una línea {"flight": ...} por vuelo y una final {"done": true, "total": n}
+
+    Como mucho 'limit' vuelos en total. A diferencia de collect_flights no se
+    ordena por precio: los vuelos de Duffel salen según llegan y después los
+    charter (del más barato al más caro) hasta completar el límite.
+    """
+    total = 0
+    error = None
+    charter = charter_search.start(search) if airline_type in ['charter', 'ambos'] else None
+    if airline_type in ['comerciales', 'ambos']:
+        try:
+            offer_pages = duffel_service.iter_offer_pages(search, limit)
+            for flight_data in iter_flutter_flights(offer_pages, origin, destination):
+                total += 1
+                yield json.dumps({'flight': flight_data}) + '\n'
+        except DuffelError as e:
+            print(f"⚠️ Duffel respondió {e.status_code}: {e.message}")
+            error = e.message
+    if charter is not None:
+        charter_flights = sorted(charter.result(), key=lambda flight: flight['price'])
+        for flight_data in charter_flights[:max(0, limit - total)]:
+            total += 1
+            yield json.dumps({'flight': flight_data}) + '\n'
+    summary = {'done': True, 'total': total}
+    if error:
+        summary['error'] = error
+    yield json.dumps(summary) + '\n'
+
+def wants_ndjson():
+    """El cliente pide resultados en streaming con ?stream=ndjson o Accept: application/x-ndjson"""
+    return request.args.get('stream') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+def get_results_limit(data):
+    """Cantidad de vuelos a devolver (por defecto FLUTTER_MAX_OFFERS, máximo DUFFEL_MAX_OFFERS)"""
+    try:
+        limit = int(data.get('limit', FLUTTER_MAX_OFFERS))
+    except (TypeError, ValueError):
+        limit = FLUTTER_MAX_OFFERS
+    return max(1, min(limit, DUFFEL_MAX_OFFERS))
+
+def is_async_search(data):
+    """La búsqueda se pide en modo asíncrono con {"async": true} o ?mode=async"""
+    return bool(data.get('async')) or request.args.get('mode') == 'async'
+
 @admin.route('/api/flights/search', methods=['POST'])
 def search_flights():
-    """🔍 Búsqueda de vuelos - Endpoint para app Flutter (SOLO DUFFEL)"""
+    """🔍 Búsqueda de vuelos - Endpoint para app Flutter (Duffel y/o charter)"""
     try:
         data = request.get_json()
         
         # Extraer parámetros
         origin = data.get('origin')
         destination = data.get('destination') 
-        departure_date = data.get('departure_date')
-        passengers = data.get('passengers', 1)
         airline_type = data.get('airline_type', 'comerciales')
         
-        print(f"🔍 Búsqueda DUFFEL: {origin} → {destination} | Tipo: {airline_type}")
+        print(f"🔍 Búsqueda de vuelos: {origin} → {destination} | Tipo: {airline_type}")
         
-        flights = []
-        
-        # API KEY REAL de Duffel desde variables de entorno
-        api_token = os.environ.get('DUFFEL_API_KEY')
-        if not api_token:
+        if airline_type != 'charter' and not duffel_service.is_configured():
             return jsonify({
                 'success': False,
                 'error': 'DUFFEL_API_KEY no configurada en variables de entorno',
                 'data': []
             }), 500
         
-        # SOLO usar Duffel API (evitar charter que necesita bs4)
-        if airline_type in ['comerciales', 'ambos']:
-            # Búsqueda directa con Duffel API
-            headers = {
-                'Accept': 'application/json',
-                'Authorization': f'Bearer {api_token}',
-                'Duffel-Version': 'v2',
-                'Content-Type': 'application/json'
-            }
-            
-            # Crear request de ofertas
-            offer_request_data = {
-                'data': {
-                    'slices': [{
-                        'origin': origin,
-                        'destination': destination,
-                        'departure_date': departure_date
-                    }],
-                    'passengers': [{'type': 'adult'}] * passengers,
-                    'cabin_class': 'economy'
-                }
-            }
-            
-            # Crear offer request
-            response = requests.post(
-                'https://api.duffel.com/air/offer_requests',
-                headers=headers,
-                json=offer_request_data
+        try:
+            search = normalize_search(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e), 'data': []}), 400
+        
+        limit = get_results_limit(data)
+        
+        # Modo streaming: la app pinta las primeras ofertas mientras llegan las demás
+        if wants_ndjson():
+            response = current_app.response_class(
+                stream_with_context(stream_flights(search, airline_type, origin, destination, limit)),
+                mimetype='application/x-ndjson'
             )
-            
-            if response.status_code == 201:
-                offer_request = response.json()['data']
-                
-                # Obtener ofertas
-                offers_response = requests.get(
-                    f"https://api.duffel.com/air/offers?offer_request_id={offer_request['id']}&limit=20",
-                    headers=headers
-                )
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
+        
+        # Modo asíncrono: responder de inmediato con un id para consultar el resultado
+        if is_async_search(data):
+            def run_search(job_id):
+                def publish_partial(flights):
+                    flight_search_jobs.update(job_id, STATUS_PARTIAL,
+                                              result={'data': flights, 'total': len(flights)})
                 
-                if offers_response.status_code == 200:
-                    offers_data = offers_response.json()
-                    offers = offers_data.get('data', [])
-                    
-                    # Transformar a formato Flutter
-                    for offer in offers:
-                        if offer.get('slices') and len(offer['slices']) > 0:
-                            slice_data = offer['slices'][0]
-                            if slice_data.get('segments') and len(slice_data['segments']) > 0:
-                                first_segment = slice_data['segments'][0]
-                                
-                                # Obtener información de aerolínea
-                                airline_name = 'Aerolínea'
-                                airline_code = ''
-                                airline_logo = ''
-                                
-                                if first_segment.get('marketing_carrier'):
-                                    carrier = first_segment['marketing_carrier']
-                                    airline_name = carrier.get('name', 'Aerolínea')
-                                    airline_code = carrier.get('iata_code', '')
-                                    if carrier.get('logo_symbol_url'):
-                                        # Convertir SVG a PNG para compatibilidad con Android
-                                        svg_url = carrier['logo_symbol_url']
-                                        airline_logo = svg_url.replace('.svg', '.png')
-                                
-                                flight_data = {
-                                    'id': offer['id'],
-                                    'airline': airline_name,
-                                    'airline_code': airline_code,
-                                    'airline_logo': airline_logo,
-                                    'departureTime': first_segment.get('departing_at', ''),
-                                    'arrivalTime': first_segment.get('arriving_at', ''),
-                                    'duration': slice_data.get('duration', ''),
-                                    'stops': len(slice_data['segments']) - 1,
-                                    'price': float(offer.get('total_amount', '0')),
-                                    'currency': offer.get('total_currency', 'USD'),
-                                    'origin_airport': first_segment.get('origin', {}).get('iata_code', origin),
-                                    'destination_airport': first_segment.get('destination', {}).get('iata_code', destination)
-                                }
-                                flights.append(flight_data)
+                flights = collect_flights(search, airline_type, origin, destination, limit,
+                                          on_progress=publish_partial)
+                return {'data': flights, 'total': len(flights)}
             
-            print(f"✈️ Vuelos Duffel encontrados: {len(flights)}")
-        
-        # TODO: Charter flights require bs4 - disabled until dependency fixed
-        if airline_type == 'charter':
-            print("⚠️ Vuelos charter temporalmente deshabilitados")
+            search_id = flight_search_jobs.submit(run_search)
+            return jsonify({
+                'success': True,
+                'search_id': search_id,
+                'status': 'pending',
+                'poll_url': url_for('admin.get_flight_search', search_id=search_id)
+            }), 202
         
-        print(f"🎯 Total vuelos encontrados: {len(flights)}")
+        flights = collect_flights(search, airline_type, origin, destination, limit)
         
         return jsonify({
             'success': True,
@@ -677,81 +818,59 @@ def search_flights():
             'data': []
         }), 500
 
+@admin.route('/api/flights/search/<search_id>')
+def get_flight_search(search_id):
+    """⏳ Estado y resultados (parciales o completos) de una búsqueda asíncrona"""
+    job = flight_search_jobs.get(search_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Búsqueda no encontrada o expirada'}), 404
+    
+    response = {
+        'success': job['status'] != 'error',
+        'search_id': job['search_id'],
+        'status': job['status']
+    }
+    if job['result']:
+        response.update(job['result'])
+    if job['error']:
+        response['error'] = job['error']
+    return jsonify(response)
+
 @admin.route('/api/flights/airports')
 def search_airports():
-    print("🔍 DEBUG: FUNCIÓN INICIADA")
-    print("🔍 DEBUG: FUNCIÓN EJECUTÁNDOSE")
-    """🏢 Búsqueda de aeropuertos - Endpoint para app Flutter"""
+    """🏢 Búsqueda de aeropuertos - Endpoint para app Flutter (índice local, sin llamadas a Duffel)"""
     try:
         query = request.args.get('q', '')
-        print("🔍 DEBUG: QUERY OBTENIDA"); print(f"Query: {query}")
-        
         if not query:
             return jsonify([])
         
-        # API KEY REAL de Duffel desde variables de entorno
-        api_token = os.environ.get('DUFFEL_API_KEY')
-        if not api_token:
-            print("❌ DUFFEL_API_KEY no configurada")
-            return jsonify([])
-        
-        # Búsqueda directa con Duffel API
-        headers = {
-            'Accept': 'application/json',
-            'Authorization': f'Bearer {api_token}',
-            'Duffel-Version': 'v2'
-        }
-        
-        # Usar Place Suggestion API según documentación oficial
-        url = f'https://api.duffel.com/air/airports?search={query}&limit=20'
-        print(f"🔍 URL Duffel Place Suggestion API: {url}")
-        
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            airports = data.get('data', [])
-            print(f"🔍 Total aeropuertos obtenidos: {len(airports)}")
-            
-            # FILTRADO MANUAL: Solo aeropuertos que coincidan con búsqueda
-            filtered_airports = []
-            query_lower = query.lower()
-            
-            for airport in airports:
-                # Verificar si coincide con IATA, nombre, ciudad
-                iata_code = airport.get('iata_code', '').lower()
-                name = airport.get('name', '').lower()
-                city = airport.get('city_name', '').lower()
-                
-                if (query_lower in iata_code or 
-                    query_lower in name or 
-                    query_lower in city or
-                    iata_code.startswith(query_lower)):
-                    filtered_airports.append(airport)
-            
-            print(f"🔍 Filtrados {len(filtered_airports)} de {len(airports)} aeropuertos")
-            
-            # Transformar a formato Flutter
-            formatted_airports = []
-            for airport in filtered_airports:
-                formatted_airports.append({
-                    'iata_code': airport.get('iata_code', ''),
-                    'name': airport.get('name', ''),
-                    'city': airport.get('city_name', ''),
-                    'country': airport.get('iata_country_code', ''),
-                    'time_zone': airport.get('time_zone', '')
-                })
-            
-            print(f"✈️ Aeropuertos encontrados: {len(formatted_airports)}")
-            return jsonify(formatted_airports)
-        else:
-            print("❌ No se encontraron aeropuertos en Duffel API")
-            return jsonify([])
+        try:
+            limit = max(1, min(int(request.args.get('limit', 20)), 50))
+        except ValueError:
+            return jsonify({'error': 'limit debe ser un entero'}), 400
+        return jsonify(airport_index.search(query, limit=limit))
         
     except Exception as e:
         print(f"❌ Error en búsqueda de aeropuertos: {str(e)}")
         return jsonify([])
 
+@admin.route('/api/flights/airports/refresh', methods=['POST'])
+@require_auth
+def refresh_airports():
+    """🔄 Refrescar el índice local de aeropuertos desde Duffel (en segundo plano)"""
+    if not duffel_service.is_configured():
+        return jsonify({'success': False, 'error': 'DUFFEL_API_KEY no configurada'}), 500
+    started = airport_index.refresh_in_background(duffel_service)
+    return jsonify({'success': True, 'started': started, 'index': airport_index.stats()})
+
+@admin.route('/api/flights/cache-stats')
+@require_auth
+def flight_cache_stats():
+    """📊 Contadores de la caché de ofertas de Duffel y de resultados charter"""
+    stats = duffel_service.cache_stats()
+    stats['charter'] = charter_search.stats()
+    return jsonify(stats)
+
 @admin.route('/api/flights/airlines')
 def get_airlines():
     """🏢 Obtener aerolíneas disponibles - Endpoint para app Flutter"""
@@ -1408,6 +1527,7 @@ def contact_info():
 
 @admin.route('/api/upload-logo', methods=['POST'])
 @require_auth
+@upload_limit(LOGO_MAX_SIZE + 64 * 1024, LOGO_TYPES, LOGO_MAX_SIZE)
 def upload_logo():
     """API para subir y actualizar el logo de la empresa"""
     try:
@@ -1418,77 +1538,63 @@ def upload_logo():
         if file.filename == '':
             return jsonify({'success': False, 'message': 'No se seleccionó ningún archivo'})
         
-        # Validar tipo de archivo
-        allowed_extensions = {'svg', 'png', 'jpg', 'jpeg'}
-        if not file.filename.lower().endswith(tuple('.' + ext for ext in allowed_extensions)):
-            return jsonify({'success': False, 'message': 'Formato de archivo no soportado'})
-        
-        # Validar tamaño (2MB máximo)
-        if len(file.read()) > 2 * 1024 * 1024:
-            file.seek(0)  # Reset file pointer
-            return jsonify({'success': False, 'message': 'El archivo es demasiado grande'})
-        
-        file.seek(0)  # Reset file pointer
+        # Tamaño (LOGO_MAX_SIZE) y formato (svg/png/jpeg por contenido) ya validados por upload_limit
+        upload = image_pipeline.save_upload(file, ext=detected_extension(file))
+        image_pipeline.submit(upload)
+        image_pipeline.set_alias('company-logo', upload)
         
-        # Guardar el archivo
-        filename = 'company-logo' + os.path.splitext(file.filename)[1]
-        filepath = os.path.join('static', 'img', filename)
-        
-        # Asegurar que el directorio existe
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        
-        file.save(filepath)
+        # Copia con el nombre fijo para las plantillas y versiones viejas de la app
+        filename = 'company-logo.' + detected_extension(file)
+        image_pipeline.link_to(upload, os.path.join('static', 'img', filename))
         
         return jsonify({
             'success': True, 
             'message': 'Logo actualizado correctamente',
-            'filename': filename
+            'filename': filename,
+            'url': upload['url']
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error al subir el logo: {str(e)}'})
 
+# Campos del formulario de banners de la app: (campo, nombre de archivo, etiqueta)
+APP_BANNER_SLOTS = [
+    ('main_banner', 'main-banner', 'Banner Principal'),
+    ('secondary_banner', 'secondary-banner', 'Banner Secundario'),
+    ('promo_banner', 'promo-banner', 'Banner de Promociones')
+]
+
 @admin.route('/api/upload-banners', methods=['POST'])
 @require_auth
+@upload_limit(len(APP_BANNER_SLOTS) * UPLOAD_MAX_IMAGE_SIZE + MB)
 def upload_banners():
     """API para subir banners de la app"""
     try:
         banners_uploaded = []
-        
-        # Procesar banner principal
-        if 'main_banner' in request.files:
-            file = request.files['main_banner']
-            if file.filename != '':
-                filename = 'main-banner' + os.path.splitext(file.filename)[1]
-                filepath = os.path.join('static', 'img', 'banners', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                banners_uploaded.append('Banner Principal')
-        
-        # Procesar banner secundario
-        if 'secondary_banner' in request.files:
-            file = request.files['secondary_banner']
-            if file.filename != '':
-                filename = 'secondary-banner' + os.path.splitext(file.filename)[1]
-                filepath = os.path.join('static', 'img', 'banners', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                banners_uploaded.append('Banner Secundario')
-        
-        # Procesar banner de promociones
-        if 'promo_banner' in request.files:
-            file = request.files['promo_banner']
-            if file.filename != '':
-                filename = 'promo-banner' + os.path.splitext(file.filename)[1]
-                filepath = os.path.join('static', 'img', 'banners', filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                file.save(filepath)
-                banners_uploaded.append('Banner de Promociones')
+        images = {}
+        
+        # Banner principal, secundario y de promociones: URL por contenido (ver /api/app-assets),
+        # copia con su nombre fijo para versiones viejas de la app y variantes en segundo plano
+        for field, basename, label in APP_BANNER_SLOTS:
+            file = request.files.get(field)
+            if file is None or file.filename == '':
+                continue
+            upload = image_pipeline.save_upload(file, ext=detected_extension(file))
+            filename = '{}.{}'.format(basename, detected_extension(file))
+            image_pipeline.link_to(upload, os.path.join('static', 'img', 'banners', filename))
+            image_pipeline.set_alias(basename, upload)
+            images[field] = {
+                'digest': upload['digest'],
+                'image_url': upload['url'],
+                'job_id': image_pipeline.submit(upload)
+            }
+            banners_uploaded.append(label)
         
         if banners_uploaded:
             return jsonify({
                 'success': True,
-                'message': f'Banners actualizados: {", ".join(banners_uploaded)}'
+                'message': f'Banners actualizados: {", ".join(banners_uploaded)}',
+                'images': images
             })
         else:
             return jsonify({'success': False, 'message': 'No se seleccionaron archivos'})
@@ -1496,6 +1602,58 @@ def upload_banners():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error al subir banners: {str(e)}'})
 
+@admin.route('/api/app-assets')
+def get_app_assets():
+    """Logo y banners de la app con URLs por contenido (público, con ETag)
+
+    Las URLs /assets/<hash>/... se cachean un año como immutable: mientras el
+    ETag de este listado no cambie, la app no vuelve a descargar ninguna imagen.
+    """
+    try:
+        payload = {'success': True, 'assets': image_pipeline.get_aliases()}
+        response = jsonify(payload)
+        response.set_etag(compute_etag(payload))
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin.route('/api/images/<digest>')
+def get_image(digest):
+    """Variantes de una imagen subida (público)
+
+    Con ?w=<ancho> redirige a la variante más pequeña que lo cubre (WebP si el
+    cliente lo acepta), para que la app descargue miniaturas y no originales.
+    """
+    try:
+        image = image_pipeline.get_image(digest)
+        if image is None:
+            return jsonify({'success': False, 'error': 'Imagen no encontrada'}), 404
+        
+        width = request.args.get('w', type=int)
+        if width:
+            url = image_pipeline.best_url(digest, width, webp='image/webp' in request.accept_mimetypes)
+            response = redirect(url)
+            response.headers['Vary'] = 'Accept'
+            # Mientras las variantes se generan el destino puede cambiar
+            response.headers['Cache-Control'] = 'public, max-age={}'.format(
+                86400 if image['status'] != 'pending' else 10)
+            return response
+        
+        image.pop('original_file')
+        return jsonify({'success': True, 'image': image})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@admin.route('/api/images/jobs/<job_id>')
+@require_auth
+def get_image_job(job_id):
+    """Estado de un trabajo de procesamiento de imagen"""
+    job = image_pipeline.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': job, 'image': image_pipeline.get_image(job['digest'])})
+
 @admin.route('/api/send-push-notification', methods=['POST'])
 @require_auth
 def send_push_notification():
@@ -1503,7 +1661,6 @@ def send_push_notification():
     try:
         data = request.get_json()
         
-        # Aquí se integraría con Firebase Cloud Messaging o similar
         notification_data = {
             'title': data.get('title'),
             'message': data.get('message'),
@@ -1515,45 +1672,83 @@ def send_push_notification():
         # Guardar en base de datos
         # save_notification_to_db(notification_data)
         
-        # Enviar notificación push real
-        # send_push_to_devices(notification_data)
+        try:
+            user_ids = get_target_user_ids(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        # Fan-out a los dispositivos en segundo plano (por lotes, ver push_fanout.py)
+        broadcast_id = broadcast_engine.start({
+            'title': notification_data['title'],
+            'message': notification_data['message'],
+            'type': notification_data['type'],
+            'is_urgent': notification_data['urgent'],
+            'read': False,
+            'created_at': notification_data['timestamp']
+        }, user_ids=user_ids)
         
         return jsonify({
             'success': True,
-            'message': 'Notificación enviada correctamente'
+            'message': 'Notificación enviada correctamente',
+            'broadcast_id': broadcast_id,
+            'status_url': f'/admin/api/push-broadcasts/{broadcast_id}'
         })
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error al enviar notificación: {str(e)}'})
 
+@admin.route('/api/push-broadcasts/<broadcast_id>')
+@require_auth
+def get_push_broadcast(broadcast_id):
+    """API para consultar el progreso de un envío push"""
+    broadcast = broadcast_engine.get(broadcast_id, include_chunks=request.args.get('chunks') == 'true')
+    if broadcast is None:
+        return jsonify({'success': False, 'message': 'Envío no encontrado'}), 404
+    return jsonify({'success': True, 'broadcast': broadcast})
+
+NOTIFICATION_STATUS_LABELS = {'sent': 'Enviada', 'pending': 'Pendiente', 'failed': 'Fallida'}
+
 @admin.route('/api/notification-history')
 @require_auth
 def notification_history():
-    """API para obtener historial de notificaciones"""
-    try:
-        # Aquí se obtendría de la base de datos
-        notifications = [
-            {
-                'date': '2024-01-15 10:30:00',
-                'title': 'Nueva Promoción',
-                'message': '¡Descuento del 20% en todos los productos!',
-                'type': 'all',
-                'status': 'Enviada'
-            },
-            {
-                'date': '2024-01-14 15:45:00',
-                'title': 'Mantenimiento Programado',
-                'message': 'El sistema estará en mantenimiento mañana de 2:00 AM a 4:00 AM',
-                'type': 'all',
-                'status': 'Enviada'
-            }
-        ]
+    """API para obtener historial de notificaciones (incremental con ?since=<id|cursor|timestamp>, páginas con ?cursor=)"""
+    try:
+        limit = min(max(1, request.args.get('limit', 50, type=int)), 200)
+        history = supabase_service.get_notification_history(since=request.args.get('since'), limit=limit,
+                                                               cursor=request.args.get('cursor'))
+        
+        notifications = []
+        for row in history['data']:
+            extra = row.get('data') if isinstance(row.get('data'), dict) else {}
+            status = row.get('status') or extra.get('status') or 'sent'
+            notifications.append({
+                'id': row.get('id'),
+                'date': (row.get('created_at') or '')[:19].replace('T', ' '),
+                'title': row.get('title'),
+                'message': row.get('message'),
+                'type': row.get('type', 'all'),
+                'status': NOTIFICATION_STATUS_LABELS.get(status, status)
+            })
         
-        return jsonify({
+        payload = {
             'success': True,
-            'notifications': notifications
-        })
-        
+            'notifications': notifications,
+            'next_since': history['next_since'],
+            'has_more': history['has_more'],
+            'next_cursor': history['next_cursor']
+        }
+        response = jsonify(payload)
+        response.set_etag(compute_etag(payload))
+        if history['last_modified']:
+            try:
+                response.last_modified = parse_timestamp(history['last_modified'])
+            except ValueError:
+                pass
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+        
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error al cargar historial: {str(e)}'})
 
@@ -1564,23 +1759,25 @@ def notification_history():
 def get_charter_airlines():
     """Obtener lista de aerolíneas charter"""
     try:
-        from charter_routes import CHARTER_AIRLINES
+        snapshot = charter_registry.snapshot()
         
         airlines = []
-        for key, airline in CHARTER_AIRLINES.items():
+        for key, airline in snapshot.airlines.items():
             airlines.append({
                 'id': key,
                 'name': airline['name'],
                 'url': airline['url'],
                 'markup': airline['markup'],
                 'active': airline['active'],
-                'routes': airline['routes'],
+                'description': airline['description'],
+                'routes': list(airline['routes']),
                 'check_frequency': airline['check_frequency']
             })
         
         return jsonify({
             'success': True,
-            'airlines': airlines
+            'airlines': airlines,
+            'version': snapshot.version
         })
         
     except Exception as e:
@@ -1594,27 +1791,32 @@ def get_charter_airlines():
 def save_charter_airline():
     """Guardar o actualizar aerolínea charter"""
     try:
-        data = request.get_json()
-        from charter_routes import CHARTER_AIRLINES
-        
-        # En producción, esto se guardaría en la base de datos
-        # Por ahora, actualizamos la configuración en memoria
-        airline_id = data.get('id')
-        if airline_id and airline_id in CHARTER_AIRLINES:
-            CHARTER_AIRLINES[airline_id].update({
-                'name': data.get('name'),
-                'url': data.get('url'),
-                'markup': float(data.get('markup', 0)),
-                'active': data.get('status') == 'active',
-                'routes': data.get('routes', '').split(','),
-                'check_frequency': int(data.get('check_frequency', 30))
-            })
+        data = request.get_json() or {}
+        
+        check_frequency = data.get('check_frequency', data.get('checkFrequency'))
+        fields = {
+            'name': data.get('name'),
+            'url': data.get('url'),
+            'markup': float(data['markup']) if data.get('markup') is not None else None,
+            'active': data['status'] == 'active' if 'status' in data else data.get('active'),
+            'description': data.get('description'),
+            'routes': parse_charter_routes(data['routes']) if data.get('routes') is not None else None,
+            'check_frequency': int(check_frequency) if check_frequency is not None else None
+        }
+        
+        airline = charter_registry.save(data.get('id'), fields)
         
         return jsonify({
             'success': True,
-            'message': 'Aerolínea guardada correctamente'
+            'message': 'Aerolínea guardada correctamente',
+            'airline': {**airline, 'routes': list(airline['routes'])}
         })
         
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'message': f'Datos inválidos: {str(e)}'
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -1626,14 +1828,13 @@ def save_charter_airline():
 def toggle_charter_airline(airline_id):
     """Activar/desactivar aerolínea charter"""
     try:
-        from charter_routes import CHARTER_AIRLINES
+        active = charter_registry.toggle(airline_id)
         
-        if airline_id in CHARTER_AIRLINES:
-            CHARTER_AIRLINES[airline_id]['active'] = not CHARTER_AIRLINES[airline_id]['active']
-            
+        if active is not None:
             return jsonify({
                 'success': True,
-                'message': f"Aerolínea {'activada' if CHARTER_AIRLINES[airline_id]['active'] else 'desactivada'} correctamente"
+                'active': active,
+                'message': f"Aerolínea {'activada' if active else 'desactivada'} correctamente"
             })
         else:
             return jsonify({
@@ -1652,32 +1853,29 @@ def toggle_charter_airline(airline_id):
 def test_charter_airline(airline_id):
     """Probar conexión con aerolínea charter"""
     try:
-        from charter_routes import CHARTER_AIRLINES, charter_scraper
         from datetime import datetime, timedelta
         
-        if airline_id not in CHARTER_AIRLINES:
+        airline = charter_registry.get(airline_id)
+        if airline is None:
             return jsonify({
                 'success': False,
                 'message': 'Aerolínea no encontrada'
             }), 404
         
-        airline = CHARTER_AIRLINES[airline_id]
-        
-        # Simular prueba de conexión
-        test_data = {
-            'origin': 'Miami',
-            'destination': 'Havana',
-            'departure_date': (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+        # Búsqueda de prueba sin caché, con el mismo timeout que la búsqueda real
+        test_search = {
+            'origin': 'MIA',
+            'destination': 'HAV',
+            'departure_date': (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d'),
+            'return_date': None
         }
         
-        if airline_id == 'xael':
-            flights = charter_scraper.scrape_xael_charter(test_data)
-        elif airline_id == 'cubazul':
-            flights = charter_scraper.scrape_cubazul_charter(test_data)
-        elif airline_id == 'havana_air':
-            flights = charter_scraper.scrape_havana_air_charter(test_data)
-        else:
-            flights = []
+        flights = charter_search.test_airline(airline, test_search)
+        if flights is None:
+            return jsonify({
+                'success': False,
+                'message': 'Scraper no disponible para esta aerolínea'
+            }), 501
         
         if flights:
             return jsonify({
@@ -1929,6 +2127,7 @@ def get_cuba_transtur_statistics():
 
 @admin.route('/api/vehicles/add', methods=['POST'])
 @require_auth
+@upload_limit(VEHICLE_MAX_PHOTOS * UPLOAD_MAX_IMAGE_SIZE + MB)
 def add_vehicle():
     """Agregar nuevo vehículo con fotos"""
     try:
@@ -1971,32 +2170,21 @@ def add_vehicle():
         if not vehicle_data['name'] or not vehicle_data['category'] or vehicle_data['daily_price'] <= 0:
             return jsonify({'success': False, 'error': 'Datos incompletos o inválidos'}), 400
         
-        # Crear directorio para fotos si no existe
-        vehicle_photos_dir = os.path.join(current_app.static_folder, 'uploads', 'vehicles')
-        os.makedirs(vehicle_photos_dir, exist_ok=True)
+        if len(files) > VEHICLE_MAX_PHOTOS:
+            return jsonify({'success': False, 'error': f'Máximo {VEHICLE_MAX_PHOTOS} fotos por vehículo'}), 400
         
-        # Guardar fotos
-        photo_paths = []
-        for i, file in enumerate(files):
-            if file and allowed_file(file.filename):
-                filename = secure_filename(vehicle_data['name'] + "_" + str(i) + "_" + datetime.now().strftime('%Y%m%d_%H%M%S') + ".jpg")
-                filepath = os.path.join(vehicle_photos_dir, filename)
-                file.save(filepath)
-                photo_paths.append("/static/uploads/vehicles/" + filename)
+        # Crear el registro antes de escribir fotos: si Supabase falla no quedan archivos huérfanos
+        vehicle_id = get_record_id(supabase_service.add_vehicle(dict(vehicle_data, photos=[])))
+        if vehicle_id is None:
+            return jsonify({'success': False, 'error': 'No se pudo guardar el vehículo'}), 502
         
-        if not photo_paths:
-            return jsonify({'success': False, 'error': 'No se pudieron guardar las fotos'}), 400
+        # Guardar fotos (solo el original; las variantes se generan en segundo plano)
+        uploads = [image_pipeline.save_upload(file, ext=detected_extension(file)) for file in files if file and file.filename]
+        vehicle_data['photos'] = [upload['url'] for upload in uploads]
+        supabase_service.update_vehicle(vehicle_id, {'photos': vehicle_data['photos']})
         
-        # Agregar rutas de fotos a los datos del vehículo
-        vehicle_data['photos'] = photo_paths
-        
-        # Guardar en base de datos
-        try:
-            # Intentar guardar en Supabase primero
-            vehicle_id = supabase_service.add_vehicle(vehicle_data)
-        except:
-            # Si falla Supabase, usar base de datos local
-            vehicle_id = local_db.add_vehicle(vehicle_data)
+        for slot, upload in enumerate(uploads):
+            image_pipeline.submit(upload, kind='vehicles', record_id=vehicle_id, slot=slot)
         
         return jsonify({
             'success': True,
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🌍 AIRPORT INDEX - AUTOCOMPLETADO LOCAL DE AEROPUERTOS
+🔎 Índice en memoria (prefijos + trigramas) sobre código IATA, nombre y ciudad
+"""
+
+import json
+import os
+import threading
+import time
+import unicodedata
+
+from http_client import env_int
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dataset incluido en el repo y copia local refrescada desde Duffel
+AIRPORTS_BUNDLED_FILE = os.path.join(BASE_DIR, 'data', 'airports.json')
+AIRPORTS_CACHE_FILE = os.environ.get('AIRPORTS_CACHE_FILE', os.path.join(BASE_DIR, 'data', 'airports_duffel.json'))
+# Refrescar desde Duffel cuando la copia local tenga más de este tiempo (segundos)
+AIRPORTS_REFRESH_INTERVAL = env_int('AIRPORTS_REFRESH_INTERVAL', 7 * 24 * 3600)
+
+MAX_PREFIX_LENGTH = 12
+
+# Orden de relevancia de las coincidencias
+RANK_IATA_EXACT = 0
+RANK_IATA_PREFIX = 1
+RANK_CITY_PREFIX = 2
+RANK_NAME_PREFIX = 3
+RANK_SUBSTRING = 4
+
+
+def normalize_text(value):
+    """Minúsculas y sin acentos, para comparar 'Camagüey' con 'camaguey'"""
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in value if not unicodedata.combining(c)).lower().strip()
+
+
+def _trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def format_airport(airport):
+    """Formato de aeropuerto que devuelven los endpoints de autocompletado"""
+    return {
+        'iata_code': airport.get('iata_code', ''),
+        'name': airport.get('name', ''),
+        'city': airport.get('city_name') or airport.get('city', ''),
+        'country': airport.get('iata_country_code') or airport.get('country', ''),
+        'time_zone': airport.get('time_zone', '')
+    }
+
+
+class _Snapshot:
+    """Índice inmutable; se reemplaza completo en cada recarga"""
+
+    def __init__(self, airports):
+        self.airports = []
+        self.by_iata = {}
+        self.prefixes = {}
+        self.trigrams = {}
+        self.search_fields = []
+
+        for airport in airports:
+            iata = (airport.get('iata_code') or '').upper()
+            if len(iata) != 3 or iata in self.by_iata:
+                continue
+            formatted = format_airport(airport)
+            idx = len(self.airports)
+            self.airports.append(formatted)
+            self.by_iata[iata] = idx
+
+            iata_norm = iata.lower()
+            city = normalize_text(formatted['city'])
+            name = normalize_text(formatted['name'])
+            self.search_fields.append((iata_norm, city, name, ' '.join([iata_norm, city, name])))
+
+            tokens = {iata_norm, city, name}
+            tokens.update(city.split())
+            tokens.update(name.split())
+            for token in tokens:
+                for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1):
+                    self.prefixes.setdefault(token[:length], set()).add(idx)
+            for trigram in _trigrams(self.search_fields[idx][3]):
+                self.trigrams.setdefault(trigram, set()).add(idx)
+
+    def rank(self, idx, query):
+        iata, city, name, haystack = self.search_fields[idx]
+        if iata == query:
+            return RANK_IATA_EXACT
+        if iata.startswith(query):
+            return RANK_IATA_PREFIX
+        if city.startswith(query) or any(w.startswith(query) for w in city.split()):
+            return RANK_CITY_PREFIX
+        if name.startswith(query) or any(w.startswith(query) for w in name.split()):
+            return RANK_NAME_PREFIX
+        if query in haystack:
+            return RANK_SUBSTRING
+        return None
+
+    def candidates(self, query):
+        candidates = set(self.prefixes.get(query[:MAX_PREFIX_LENGTH], ()))
+        # Coincidencias en medio de palabras: intersección de trigramas
+        if len(query) >= 3:
+            sets = [self.trigrams.get(t) for t in _trigrams(query)]
+            if all(sets):
+                candidates |= set.intersection(*sets)
+        return candidates
+
+
+class AirportIndex:
+    def __init__(self):
+        self._snapshot = _Snapshot([])
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.source = None
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._snapshot.airports)
+
+    def load(self, airports, source='memory'):
+        """Reemplazar el índice de forma atómica; los lectores nunca ven un índice a medias"""
+        snapshot = _Snapshot(airports)
+        self._snapshot = snapshot
+        self.source = source
+        self.loaded_at = time.time()
+        print(f"🌍 Índice de aeropuertos cargado ({source}): {len(snapshot.airports)} aeropuertos")
+
+    def load_file(self, path):
+        with open(path, encoding='utf-8') as f:
+            self.load(json.load(f), source=os.path.basename(path))
+
+    def load_default(self):
+        """Cargar la copia refrescada desde Duffel si existe, si no el dataset incluido"""
+        for path in (AIRPORTS_CACHE_FILE, AIRPORTS_BUNDLED_FILE):
+            if os.path.exists(path):
+                try:
+                    self.load_file(path)
+                    return
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ No se pudo cargar {path}: {e}")
+
+    def needs_refresh(self):
+        try:
+            return time.time() - os.path.getmtime(AIRPORTS_CACHE_FILE) > AIRPORTS_REFRESH_INTERVAL
+        except OSError:
+            return True
+
+    def refresh_from_duffel(self, duffel_service):
+        """Descargar el listado completo de Duffel, guardarlo en disco y recargar el índice"""
+        airports = [a for a in duffel_service.iter_airports() if len(a.get('iata_code') or '') == 3]
+        # Una respuesta vacía o inválida nunca reemplaza al índice actual
+        if not airports:
+            print("⚠️ Duffel no devolvió aeropuertos válidos; se mantiene el índice actual")
+            return 0
+        tmp_path = '{}.{}.tmp'.format(AIRPORTS_CACHE_FILE, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(airports, f, ensure_ascii=False)
+        os.replace(tmp_path, AIRPORTS_CACHE_FILE)
+        self.load(airports, source='duffel')
+        return len(airports)
+
+    def refresh_in_background(self, duffel_service):
+        """Lanzar un refresco desde Duffel en un hilo; False si ya hay uno en curso"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh_from_duffel(duffel_service)
+            except Exception as e:
+                print(f"❌ Error refrescando aeropuertos desde Duffel: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def search(self, query, limit=20):
+        """Autocompletado: IATA exacto primero, luego prefijos de IATA/ciudad/nombre y subcadenas"""
+        query = normalize_text(query)
+        if not query:
+            return []
+        snapshot = self._snapshot
+        ranked = []
+        for idx in snapshot.candidates(query):
+            rank = snapshot.rank(idx, query)
+            if rank is not None:
+                ranked.append((rank, snapshot.airports[idx]['name'], idx))
+        ranked.sort()
+        return [snapshot.airports[idx] for _, _, idx in ranked[:limit]]
+
+    def stats(self):
+        return {
+            'airports': len(self),
+            'source': self.source,
+            'loaded_at': self.loaded_at,
+            'refreshing': self._refreshing
+        }
+
+
+# Índice compartido del proceso, cargado al importar
+airport_index = AirportIndex()
+airport_index.load_default()
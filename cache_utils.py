@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🗄️ CACHE UTILS - CACHÉS EN PROCESO
+⚡ Utilidades de caché compartidas por los blueprints del backend
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def compute_etag(value):
+    """Calcular un ETag estable a partir de un valor serializable a JSON"""
+    payload = json.dumps(value, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class StaleWhileRevalidateCache:
+    """Caché de un único valor con TTL y refresco en segundo plano (stale-while-revalidate)
+
+    - Dentro del TTL se sirve el valor en memoria sin tocar el origen.
+    - Entre el TTL y TTL + stale_ttl se sirve el valor viejo y se lanza un
+      único refresco en segundo plano.
+    - Sin valor (o demasiado viejo) se carga de forma síncrona; las peticiones
+      concurrentes esperan esa misma carga en lugar de ir al origen.
+
+    El loader debe retornar None si falla, para no cachear errores.
+    """
+
+    def __init__(self, loader, ttl=60, stale_ttl=300, name='cache'):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.name = name
+        self._value = None
+        self._etag = None
+        self._loaded_at = 0
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self):
+        """Obtener (valor, etag); lanza RuntimeError si no hay valor disponible"""
+        now = time.monotonic()
+        with self._lock:
+            has_value = self._etag is not None
+            age = now - self._loaded_at
+            if has_value and age < self.ttl:
+                return self._value, self._etag
+            if has_value and age < self.ttl + self.stale_ttl:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._background_refresh, daemon=True).start()
+                return self._value, self._etag
+
+        # Carga síncrona: una sola petición al origen por ventana
+        with self._load_lock:
+            with self._lock:
+                if self._etag is not None and time.monotonic() - self._loaded_at < self.ttl:
+                    return self._value, self._etag
+            value, etag = self._load()
+            if value is not None:
+                return value, etag
+            with self._lock:
+                if self._etag is not None:
+                    print(f"⚠️ {self.name}: origen no disponible, sirviendo valor viejo")
+                    return self._value, self._etag
+            raise RuntimeError(f'{self.name}: no se pudo cargar el valor')
+
+    def invalidate(self):
+        """Descartar el valor actual; la siguiente lectura recarga desde el origen"""
+        with self._lock:
+            self._value = None
+            self._etag = None
+            self._loaded_at = 0
+            self._generation += 1
+
+    def _load(self):
+        with self._lock:
+            generation = self._generation
+        try:
+            value = self.loader()
+        except Exception as e:
+            print(f"❌ {self.name}: error cargando valor: {e}")
+            value = None
+        if value is None:
+            return None, None
+        etag = compute_etag(value)
+        with self._lock:
+            # Si hubo una invalidación durante la carga el resultado no se guarda
+            if generation == self._generation:
+                self._value = value
+                self._etag = etag
+                self._loaded_at = time.monotonic()
+        return value, etag
+
+    def _background_refresh(self):
+        try:
+            with self._load_lock:
+                self._load()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+
+class TTLCache:
+    """Caché clave/valor con expiración por entrada, tamaño máximo (LRU) y contadores"""
+
+    def __init__(self, max_entries=256, default_ttl=300, name='cache'):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.name = name
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, count=True):
+        """Obtener el valor vigente o None (cuenta hit/miss salvo count=False)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._data[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if count:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Guardar un valor; ttl en segundos (<= 0 no se guarda)"""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Eliminar una clave o vaciar toda la caché"""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        """Contadores de uso de la caché"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución
+
+    La primera llamada (originadora) ejecuta la función; las que llegan
+    mientras está en curso esperan y reciben el mismo resultado o excepción.
+    """
+
+    def __init__(self, name='single_flight'):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.originated = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Ejecutar fn una sola vez por clave entre llamadas concurrentes"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'event': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+                self.originated += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(*args, **kwargs)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['event'].set()
+
+    def stream(self, key, fn, *args, **kwargs):
+        """Como do() pero para generadores: fn(...) se recorre una sola vez por clave
+
+        Las llamadas que llegan mientras está en curso reciben todos los
+        elementos, los ya emitidos y los siguientes a medida que llegan. No
+        mezclar do() y stream() con la misma clave.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = {'cond': threading.Condition(), 'items': [], 'done': False, 'error': None, 'followers': 0}
+                self._calls[key] = call
+                self.originated += 1
+                leader = True
+            else:
+                call['followers'] += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            yield from self._follow(call)
+            return
+
+        def publish(item=None, error=None, done=False):
+            with call['cond']:
+                if done:
+                    call['error'] = error
+                    call['done'] = True
+                else:
+                    call['items'].append(item)
+                call['cond'].notify_all()
+
+        def release():
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                return call['followers']
+
+        source = fn(*args, **kwargs)
+        error = None
+        try:
+            for item in source:
+                publish(item)
+                yield item
+        except GeneratorExit:
+            # El consumidor originador dejó de leer: si otros esperan, terminar por ellos
+            if release():
+                try:
+                    for item in source:
+                        publish(item)
+                except Exception as e:
+                    error = e
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            release()
+            source.close()
+            publish(error=error, done=True)
+
+    def _follow(self, call):
+        position = 0
+        while True:
+            with call['cond']:
+                while position >= len(call['items']) and not call['done']:
+                    call['cond'].wait()
+                items = call['items'][position:]
+                done, error = call['done'], call['error']
+            position += len(items)
+            yield from items
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+    def stats(self):
+        """Contadores de llamadas originadas y agrupadas"""
+        with self._lock:
+            return {
+                'name': self.name,
+                'in_flight': len(self._calls),
+                'originated': self.originated,
+                'coalesced': self.coalesced
+            }
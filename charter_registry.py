@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🛩️ CHARTER REGISTRY - AEROLÍNEAS CHARTER PERSISTENTES Y COMPARTIDAS
+📸 SQLite con número de versión; cada proceso lee una instantánea inmutable
+   (copy-on-write) que se reemplaza entera cuando cambia la versión
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from http_client import env_float
+
+CHARTER_REGISTRY_DB = os.environ.get('CHARTER_REGISTRY_DB', 'charter_registry.db')
+# Cada cuánto un proceso comprueba si otro worker cambió el registro (segundos)
+CHARTER_REGISTRY_REFRESH = env_float('CHARTER_REGISTRY_REFRESH', 2.0)
+
+# Configuración inicial si charter_routes no está disponible
+DEFAULT_CHARTER_AIRLINES = {
+    'xael': {
+        'name': 'Xael Charter',
+        'url': 'https://www.xaelcharter.com',
+        'markup': 50.0,
+        'active': True,
+        'description': 'Aerolínea charter especializada en vuelos a Cuba',
+        'routes': ['Miami-Havana', 'Tampa-Havana'],
+        'check_frequency': 30
+    },
+    'cubazul': {
+        'name': 'Cubazul Air Charter',
+        'url': 'https://cubazulaircharter.com',
+        'markup': 45.0,
+        'active': True,
+        'description': 'Servicios de vuelos charter a Cuba',
+        'routes': ['Miami-Havana', 'Fort Lauderdale-Havana'],
+        'check_frequency': 30
+    },
+    'havana_air': {
+        'name': 'Havana Air Charter',
+        'url': 'https://havanaair.com',
+        'markup': 55.0,
+        'active': True,
+        'description': 'Vuelos charter directos a La Habana',
+        'routes': ['Miami-Havana', 'Orlando-Havana'],
+        'check_frequency': 30
+    }
+}
+
+CharterSnapshot = namedtuple('CharterSnapshot', ['version', 'airlines'])
+
+
+def parse_routes(routes):
+    """'Miami-Havana, Tampa-Havana' o lista -> lista limpia"""
+    if isinstance(routes, str):
+        routes = routes.split(',')
+    return [route.strip() for route in (routes or []) if route and route.strip()]
+
+
+def _freeze(airline):
+    frozen = dict(airline)
+    frozen['routes'] = tuple(frozen.get('routes') or ())
+    return MappingProxyType(frozen)
+
+
+def _initial_airlines():
+    try:
+        from charter_routes import CHARTER_AIRLINES
+        return CHARTER_AIRLINES
+    except ImportError:
+        return DEFAULT_CHARTER_AIRLINES
+
+
+class CharterRegistry:
+    """Registro de aerolíneas charter compartido por todos los workers
+
+    - Lecturas sin locks: snapshot() retorna la instantánea actual (un
+      MappingProxyType de solo lectura); nunca se modifica, se reemplaza.
+    - Cada CHARTER_REGISTRY_REFRESH segundos un solo hilo compara la versión
+      guardada en SQLite y, si cambió, carga una instantánea nueva.
+    - Las escrituras son transacciones BEGIN IMMEDIATE que suben la versión.
+    """
+
+    def __init__(self, db_path=CHARTER_REGISTRY_DB, refresh_interval=CHARTER_REGISTRY_REFRESH):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+        self._checked_at = 0
+        self._init_db()
+        self._snapshot = self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS charter_airlines
+                            (id TEXT PRIMARY KEY, name TEXT NOT NULL, url TEXT, markup REAL NOT NULL DEFAULT 0,
+                             active INTEGER NOT NULL DEFAULT 1, description TEXT, routes TEXT NOT NULL DEFAULT '[]',
+                             check_frequency INTEGER NOT NULL DEFAULT 30, updated_at REAL NOT NULL)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS charter_registry_version
+                            (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)''')
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT version FROM charter_registry_version').fetchone() is None:
+                # Primer arranque: sembrar con la configuración existente
+                for airline_id, airline in _initial_airlines().items():
+                    self._upsert(conn, airline_id, airline)
+                conn.execute('INSERT INTO charter_registry_version (id, version) VALUES (1, 1)')
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _upsert(self, conn, airline_id, airline):
+        conn.execute('''INSERT OR REPLACE INTO charter_airlines
+                        (id, name, url, markup, active, description, routes, check_frequency, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (airline_id, airline['name'], airline.get('url'), float(airline.get('markup') or 0),
+                      1 if airline.get('active', True) else 0, airline.get('description'),
+                      json.dumps(parse_routes(airline.get('routes'))), int(airline.get('check_frequency') or 30),
+                      time.time()))
+
+    def _load(self):
+        conn = self._connect()
+        try:
+            # Versión y filas en la misma transacción de lectura: instantánea coherente
+            conn.execute('BEGIN')
+            version = conn.execute('SELECT version FROM charter_registry_version').fetchone()['version']
+            rows = conn.execute('SELECT * FROM charter_airlines ORDER BY id').fetchall()
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        airlines = {}
+        for row in rows:
+            airlines[row['id']] = _freeze({
+                'id': row['id'],
+                'name': row['name'],
+                'url': row['url'],
+                'markup': row['markup'],
+                'active': bool(row['active']),
+                'description': row['description'],
+                'routes': json.loads(row['routes']),
+                'check_frequency': row['check_frequency'],
+                'updated_at': row['updated_at']
+            })
+        return CharterSnapshot(version, MappingProxyType(airlines))
+
+    def _stored_version(self):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT version FROM charter_registry_version').fetchone()['version']
+        finally:
+            conn.close()
+
+    # ===== LECTURA =====
+
+    def snapshot(self):
+        """Instantánea actual (versión + aerolíneas de solo lectura)"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.refresh_interval and self._refresh_lock.acquire(blocking=False):
+            # Un solo hilo comprueba; los demás siguen leyendo la instantánea vigente
+            try:
+                self._checked_at = now
+                if self._stored_version() != self._snapshot.version:
+                    self._snapshot = self._load()
+            except sqlite3.Error as e:
+                print(f"⚠️ Charter registry: no se pudo refrescar: {e}")
+            finally:
+                self._refresh_lock.release()
+        return self._snapshot
+
+    def get(self, airline_id):
+        return self.snapshot().airlines.get(airline_id)
+
+    def active_airlines(self):
+        return [airline for airline in self.snapshot().airlines.values() if airline['active']]
+
+    # ===== ESCRITURA =====
+
+    def _write(self, apply):
+        """Ejecutar apply(conn) en una transacción que sube la versión; recarga la instantánea local
+
+        Si apply retorna None no hubo cambios y la versión se mantiene.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = apply(conn)
+            if result is None:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute('UPDATE charter_registry_version SET version = version + 1')
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        with self._refresh_lock:
+            self._snapshot = self._load()
+            self._checked_at = time.monotonic()
+        return result
+
+    def save(self, airline_id, data):
+        """Crear o actualizar una aerolínea; los campos ausentes conservan su valor"""
+        if not airline_id:
+            airline_id = re.sub(r'[^a-z0-9]+', '_', (data.get('name') or '').lower()).strip('_')
+        if not airline_id:
+            raise ValueError('Se requiere id o nombre de la aerolínea')
+
+        def apply(conn):
+            row = conn.execute('SELECT * FROM charter_airlines WHERE id = ?', (airline_id,)).fetchone()
+            airline = dict(row) if row else {}
+            if row:
+                airline['routes'] = json.loads(row['routes'])
+                airline['active'] = bool(row['active'])
+            airline.update({key: value for key, value in data.items() if value is not None})
+            if not airline.get('name'):
+                raise ValueError('El nombre de la aerolínea es requerido')
+            self._upsert(conn, airline_id, airline)
+            return True
+
+        self._write(apply)
+        return self.get(airline_id)
+
+    def toggle(self, airline_id):
+        """Activar/desactivar; retorna el nuevo estado o None si no existe"""
+        def apply(conn):
+            cursor = conn.execute('UPDATE charter_airlines SET active = 1 - active, updated_at = ? WHERE id = ?',
+                                  (time.time(), airline_id))
+            if cursor.rowcount == 0:
+                return None
+            return bool(conn.execute('SELECT active FROM charter_airlines WHERE id = ?',
+                                     (airline_id,)).fetchone()['active'])
+
+        return self._write(apply)
+
+
+# Registro compartido del proceso
+charter_registry = CharterRegistry()
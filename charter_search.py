@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🛩️ CHARTER SEARCH - BÚSQUEDA CONCURRENTE EN AEROLÍNEAS CHARTER
+🧵 Los scrapers de todas las aerolíneas activas corren a la vez, cada uno con su
+   timeout; los resultados se cachean por (aerolínea, ruta, fecha) según su check_frequency
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from cache_utils import TTLCache
+from charter_registry import charter_registry
+from http_client import env_int, env_float
+
+CHARTER_SEARCH_WORKERS = env_int('CHARTER_SEARCH_WORKERS', 8)
+# Tiempo máximo que se espera a cada aerolínea (segundos)
+CHARTER_SCRAPE_TIMEOUT = env_float('CHARTER_SCRAPE_TIMEOUT', 15)
+CHARTER_CACHE_MAX_ENTRIES = env_int('CHARTER_CACHE_MAX_ENTRIES', 512)
+
+# Método de charter_routes.charter_scraper para cada aerolínea
+CHARTER_SCRAPER_METHODS = {
+    'xael': 'scrape_xael_charter',
+    'cubazul': 'scrape_cubazul_charter',
+    'havana_air': 'scrape_havana_air_charter'
+}
+
+# Los scrapers y las rutas del registro usan nombres de ciudad, no códigos IATA
+CHARTER_CITY_NAMES = {
+    'MIA': 'Miami',
+    'FLL': 'Fort Lauderdale',
+    'TPA': 'Tampa',
+    'MCO': 'Orlando',
+    'HAV': 'Havana',
+    'SNU': 'Santa Clara',
+    'HOG': 'Holguin',
+    'CMW': 'Camaguey',
+    'SCU': 'Santiago de Cuba',
+    'VRA': 'Varadero',
+    'CFG': 'Cienfuegos'
+}
+
+_scrapers = {}
+_missing_scrapers = set()
+
+
+def register_scraper(airline_id, scraper):
+    """Registrar scraper(search_data) -> lista de vuelos para una aerolínea"""
+    _scrapers[airline_id] = scraper
+
+
+def get_scraper(airline_id):
+    """Scraper registrado, o el método correspondiente de charter_routes.charter_scraper"""
+    scraper = _scrapers.get(airline_id)
+    if scraper is not None:
+        return scraper
+    method = CHARTER_SCRAPER_METHODS.get(airline_id)
+    if method is None:
+        return None
+    try:
+        from charter_routes import charter_scraper
+    except ImportError:
+        return None
+    return getattr(charter_scraper, method, None)
+
+
+def city_name(code):
+    return CHARTER_CITY_NAMES.get(code, code)
+
+
+def serves_route(airline, origin, destination):
+    """La aerolínea opera la ruta (sin rutas configuradas se consulta siempre)"""
+    routes = airline.get('routes') or ()
+    if not routes:
+        return True
+    route = f'{city_name(origin)}-{city_name(destination)}'.lower()
+    return any(r.lower().replace(' - ', '-') == route for r in routes)
+
+
+def charter_key(airline_id, search):
+    """Clave de caché: aerolínea, ruta y fechas"""
+    return (airline_id, search['origin'], search['destination'], search['departure_date'], search.get('return_date'))
+
+
+def charter_to_flutter(flight, airline, search, index=0):
+    """Vuelo devuelto por un scraper charter al formato de la app Flutter"""
+    return {
+        'id': flight.get('id') or f"charter_{airline['id']}_{search['departure_date']}_{index}",
+        'airline': flight.get('airline') or airline['name'],
+        'airline_code': flight.get('airline_code') or '',
+        'airline_logo': flight.get('airline_logo') or '',
+        'departureTime': flight.get('departureTime') or flight.get('departure_time') or '',
+        'arrivalTime': flight.get('arrivalTime') or flight.get('arrival_time') or '',
+        'duration': flight.get('duration') or '',
+        'stops': int(flight.get('stops') or 0),
+        'price': float(flight.get('price') or 0),
+        'currency': flight.get('currency') or 'USD',
+        'origin_airport': search['origin'],
+        'destination_airport': search['destination'],
+        'is_charter': True,
+        'charter_airline_id': airline['id']
+    }
+
+
+class PendingCharterSearch:
+    """Scrapers lanzados para una búsqueda; result() espera como máximo el timeout"""
+
+    def __init__(self, search, tasks, timeout):
+        self.search = search
+        self.tasks = tasks
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+
+    def result(self):
+        """Vuelos de las aerolíneas que respondieron antes de su timeout"""
+        flights = []
+        for airline, future in self.tasks:
+            try:
+                raw = future.result(timeout=max(0, self.deadline - time.monotonic()))
+            except FutureTimeoutError:
+                print(f"⏱️ Charter {airline['name']}: sin respuesta en {self.timeout}s")
+                continue
+            except Exception as e:
+                print(f"⚠️ Charter {airline['name']}: {e}")
+                continue
+            for i, flight in enumerate(raw or []):
+                try:
+                    flights.append(charter_to_flutter(flight, airline, self.search, i))
+                except (AttributeError, TypeError, ValueError) as e:
+                    print(f"⚠️ Charter {airline['name']}: vuelo inválido ({e})")
+        print(f"🛩️ Vuelos charter encontrados: {len(flights)}")
+        return flights
+
+
+class CharterSearchEngine:
+    def __init__(self, registry=charter_registry, max_workers=CHARTER_SEARCH_WORKERS, timeout=CHARTER_SCRAPE_TIMEOUT):
+        self.registry = registry
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = TTLCache(max_entries=CHARTER_CACHE_MAX_ENTRIES, name='charter_results')
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # Scrapes en curso por clave: búsquedas iguales esperan el mismo future
+        self._in_flight = {}
+
+    @property
+    def executor(self):
+        # Cada proceso (worker WSGI) necesita su propio pool de hilos
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='charter-search')
+                    self._executor_pid = pid
+                    self._in_flight = {}
+        return self._executor
+
+    def _scrape(self, scraper, airline, search, key):
+        search_data = {
+            'origin': city_name(search['origin']),
+            'destination': city_name(search['destination']),
+            'origin_code': search['origin'],
+            'destination_code': search['destination'],
+            'departure_date': search['departure_date'],
+            'return_date': search.get('return_date'),
+            'passengers': search.get('passengers')
+        }
+        try:
+            flights = scraper(search_data) or []
+            # Lo que respondió una aerolínea vale hasta su próxima revisión
+            self.cache.set(key, flights, ttl=int(airline['check_frequency'] or 0) * 60)
+            return flights
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def scrape(self, airline, search, use_cache=True):
+        """Future con los vuelos crudos de una aerolínea (None si no tiene scraper)"""
+        key = charter_key(airline['id'], search)
+        if use_cache:
+            flights = self.cache.get(key)
+            if flights is not None:
+                future = Future()
+                future.set_result(flights)
+                return future
+        scraper = get_scraper(airline['id'])
+        if scraper is None:
+            if airline['id'] not in _missing_scrapers:
+                _missing_scrapers.add(airline['id'])
+                print(f"⚠️ Charter {airline['name']}: scraper no disponible")
+            return None
+        executor = self.executor
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = executor.submit(self._scrape, scraper, airline, search, key)
+                self._in_flight[key] = future
+        return future
+
+    def start(self, search, airline_ids=None, use_cache=True):
+        """Lanzar en paralelo los scrapers de las aerolíneas activas que operan la ruta"""
+        tasks = []
+        for airline in self.registry.active_airlines():
+            if airline_ids is not None and airline['id'] not in airline_ids:
+                continue
+            if airline_ids is None and not serves_route(airline, search['origin'], search['destination']):
+                continue
+            future = self.scrape(airline, search, use_cache=use_cache)
+            if future is not None:
+                tasks.append((airline, future))
+        return PendingCharterSearch(search, tasks, self.timeout)
+
+    def test_airline(self, airline, search):
+        """Consultar una sola aerolínea sin caché (None si no tiene scraper)"""
+        future = self.scrape(airline, search, use_cache=False)
+        if future is None:
+            return None
+        return PendingCharterSearch(search, [(airline, future)], self.timeout).result()
+
+    def search(self, search):
+        """Vuelos charter en formato Flutter; tarda lo que la aerolínea más lenta (hasta el timeout)"""
+        return self.start(search).result()
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._lock:
+            stats['in_flight'] = len(self._in_flight)
+        return stats
+
+
+charter_search = CharterSearchEngine()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🗜️ COMPRESSION - COMPRESIÓN DE RESPUESTAS HTTP
+📶 gzip/brotli para respuestas de texto por encima de un umbral de tamaño
+"""
+
+import gzip
+import os
+import zlib
+
+from flask import request
+
+from http_client import env_int
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 1024)
+COMPRESS_GZIP_LEVEL = env_int('COMPRESS_GZIP_LEVEL', 6)
+COMPRESS_BROTLI_QUALITY = env_int('COMPRESS_BROTLI_QUALITY', 5)
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') != '0'
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/event-stream',
+    'image/svg+xml'
+}
+
+
+def choose_encoding(accept_encodings, streamed=False):
+    """Elegir 'br' o 'gzip' según el Accept-Encoding del cliente (werkzeug Accept)"""
+    # El streaming incremental solo se implementa con gzip
+    if not streamed and brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+
+
+def _gzip_stream(chunks):
+    """Comprimir un cuerpo en streaming, vaciando el buffer tras cada fragmento"""
+    compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _weaken_etag(response):
+    # El cuerpo comprimido ya no es byte a byte el mismo que el ETag fuerte describía
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+
+
+def init_compression(app):
+    """Registrar la compresión de respuestas en la app Flask"""
+
+    @app.after_request
+    def compress_response(response):
+        if not COMPRESS_ENABLED:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings, streamed=response.is_streamed)
+        if encoding is None:
+            return response
+
+        # Respuestas en streaming (NDJSON, SSE): gzip incremental para no retrasar cada línea
+        if response.is_streamed:
+            response.response = _gzip_stream(response.response)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers.pop('Content-Length', None)
+            _weaken_etag(response)
+            return response
+
+        if response.direct_passthrough:
+            return response
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress_body(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        _weaken_etag(response)
+        return response
+
+    return app
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧾 DEDUPE INDEX - ÍNDICE DE EVENTOS YA VISTOS
+⚡ LRU en memoria respaldado por SQLite, con ventana de retención
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache_utils import TTLCache
+from http_client import env_int
+
+DEDUPE_DB = os.environ.get('DEDUPE_DB', 'dedupe_index.db')
+# Ids recordados en memoria por proceso
+DEDUPE_MEMORY_ENTRIES = env_int('DEDUPE_MEMORY_ENTRIES', 10000)
+# Cuánto tiempo se recuerda un id (Square reintenta durante días)
+DEDUPE_RETENTION = env_int('DEDUPE_RETENTION', 7 * 24 * 3600)
+
+# event_id de Square sin parsear el JSON completo
+_EVENT_ID_RE = re.compile(rb'"event_id"\s*:\s*"([^"\\]{1,128})"')
+
+
+def extract_event_id(raw_body):
+    """Extraer el event_id del body crudo (bytes) o None"""
+    if isinstance(raw_body, str):
+        raw_body = raw_body.encode('utf-8')
+    match = _EVENT_ID_RE.search(raw_body or b'')
+    return match.group(1).decode('utf-8') if match else None
+
+
+class DedupeIndex:
+    """Conjunto acotado de ids vistos: primero la LRU del proceso, luego SQLite
+
+    SQLite hace que todos los workers compartan el índice y que sobreviva a
+    reinicios; la LRU evita tocar disco en las tormentas de reentregas.
+    """
+
+    def __init__(self, scope, db_path=DEDUPE_DB, max_entries=DEDUPE_MEMORY_ENTRIES, retention=DEDUPE_RETENTION):
+        self.scope = scope
+        self.db_path = db_path
+        self.retention = retention
+        self.memory = TTLCache(max_entries=max_entries, default_ttl=retention, name=f'{scope}_dedupe')
+        self._lock = threading.Lock()
+        self._last_purge = 0
+        self.checks = 0
+        self.duplicates = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.recorded = 0
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS dedupe_index
+                        (scope TEXT NOT NULL, key TEXT NOT NULL, seen_at REAL NOT NULL,
+                         PRIMARY KEY (scope, key))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_dedupe_seen ON dedupe_index (seen_at)')
+        conn.close()
+
+    def seen(self, key):
+        """¿Ya se registró este id dentro de la ventana de retención?"""
+        with self._lock:
+            self.checks += 1
+        if self.memory.get(key, count=False) is not None:
+            with self._lock:
+                self.duplicates += 1
+                self.memory_hits += 1
+            return True
+
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT seen_at FROM dedupe_index WHERE scope = ? AND key = ? AND seen_at >= ?',
+                               (self.scope, key, time.time() - self.retention)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return False
+        self.memory.set(key, True, ttl=row['seen_at'] + self.retention - time.time())
+        with self._lock:
+            self.duplicates += 1
+            self.db_hits += 1
+        return True
+
+    def add(self, key):
+        """Registrar un id como visto"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO dedupe_index (scope, key, seen_at) VALUES (?, ?, ?)',
+                         (self.scope, key, now))
+            if now - self._last_purge > 3600:
+                self._last_purge = now
+                conn.execute('DELETE FROM dedupe_index WHERE scope = ? AND seen_at < ?',
+                             (self.scope, now - self.retention))
+        finally:
+            conn.close()
+        self.memory.set(key, True)
+        with self._lock:
+            self.recorded += 1
+
+    def stats(self):
+        memory = self.memory.stats()
+        with self._lock:
+            return {
+                'scope': self.scope,
+                'checks': self.checks,
+                'duplicates': self.duplicates,
+                'memory_hits': self.memory_hits,
+                'db_hits': self.db_hits,
+                'recorded': self.recorded,
+                'memory_entries': memory['entries'],
+                'memory_evictions': memory['evictions'],
+                'retention_seconds': self.retention
+            }
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+✈️ DUFFEL SERVICE - BÚSQUEDA DE VUELOS
+🔍 Cliente compartido de Duffel API con caché de ofertas por búsqueda normalizada
+"""
+
+import os
+import re
+import time
+from datetime import datetime
+
+from cache_utils import TTLCache, SingleFlight
+from http_client import create_pooled_session, env_int, env_float, SharedSession
+
+DUFFEL_API_URL = 'https://api.duffel.com'
+
+# Caché de ofertas
+DUFFEL_CACHE_TTL = env_int('DUFFEL_CACHE_TTL', 300)
+DUFFEL_CACHE_MAX_ENTRIES = env_int('DUFFEL_CACHE_MAX_ENTRIES', 256)
+# Margen antes del expires_at de Duffel en el que ya no se sirve una oferta cacheada
+DUFFEL_OFFER_EXPIRY_MARGIN = env_int('DUFFEL_OFFER_EXPIRY_MARGIN', 60)
+# TTL por ruta, ej: "MIA-HAV:600,HAV-MIA:600"
+DUFFEL_CACHE_ROUTE_TTLS = os.environ.get('DUFFEL_CACHE_ROUTE_TTLS', '')
+
+DUFFEL_OFFERS_PAGE_SIZE = env_int('DUFFEL_OFFERS_PAGE_SIZE', 50)
+# Tope de ofertas por búsqueda al seguir el cursor de Duffel
+DUFFEL_MAX_OFFERS = env_int('DUFFEL_MAX_OFFERS', 200)
+
+CABIN_CLASSES = {'economy', 'premium_economy', 'business', 'first'}
+PASSENGER_TYPES = {'adult', 'child', 'infant_without_seat'}
+
+_IATA_RE = re.compile(r'^[A-Z]{3}$')
+
+_shared_session = SharedSession(lambda: create_pooled_session(
+    pool_connections=env_int('DUFFEL_POOL_CONNECTIONS', 4),
+    pool_maxsize=env_int('DUFFEL_POOL_MAXSIZE', 20),
+    connect_timeout=env_float('DUFFEL_CONNECT_TIMEOUT', 5),
+    read_timeout=env_float('DUFFEL_READ_TIMEOUT', 30)
+))
+
+
+class DuffelError(Exception):
+    """Error devuelto por Duffel API"""
+
+    def __init__(self, message, status_code=None, response_text='', stage='offer_request'):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.response_text = response_text
+        self.stage = stage
+
+
+def parse_route_ttls(value):
+    """Convertir 'MIA-HAV:600,HAV-MIA:600' en {('MIA', 'HAV'): 600, ...}"""
+    ttls = {}
+    for item in (value or '').split(','):
+        if ':' not in item or '-' not in item:
+            continue
+        route, ttl = item.strip().rsplit(':', 1)
+        origin, destination = route.split('-', 1)
+        try:
+            ttls[(origin.strip().upper(), destination.strip().upper())] = int(ttl)
+        except ValueError:
+            print(f"⚠️ TTL inválido para ruta {route}: {ttl}")
+    return ttls
+
+
+def _normalize_passengers(passengers):
+    """Normalizar 'passengers' (entero o lista de dicts) a una tupla ordenada"""
+    if passengers is None:
+        passengers = 1
+    if isinstance(passengers, (int, str)):
+        count = int(passengers)
+        if count < 1 or count > 9:
+            raise ValueError('passengers must be between 1 and 9')
+        return tuple(('adult', None) for _ in range(count))
+
+    normalized = []
+    for passenger in passengers:
+        passenger_type = passenger.get('type')
+        age = passenger.get('age')
+        if passenger_type and passenger_type not in PASSENGER_TYPES:
+            raise ValueError(f'Invalid passenger type: {passenger_type}')
+        if not passenger_type and age is None:
+            passenger_type = 'adult'
+        # Los adultos se agrupan por tipo; la edad solo importa para menores
+        if passenger_type == 'adult':
+            age = None
+        normalized.append((passenger_type or '', int(age) if age is not None else None))
+    if not normalized:
+        raise ValueError('At least one passenger is required')
+    return tuple(sorted(normalized, key=lambda p: (p[0], p[1] if p[1] is not None else -1)))
+
+
+def normalize_search(data):
+    """Validar y normalizar los parámetros de búsqueda del cliente"""
+    if not data:
+        raise ValueError('Missing required parameters: origin, destination, departure_date')
+
+    origin = (data.get('origin') or '').strip().upper()
+    destination = (data.get('destination') or '').strip().upper()
+    departure_date = (data.get('departure_date') or '').strip()
+    return_date = (data.get('return_date') or '').strip() or None
+
+    if not all([origin, destination, departure_date]):
+        raise ValueError('Missing required parameters: origin, destination, departure_date')
+    if not _IATA_RE.match(origin) or not _IATA_RE.match(destination):
+        raise ValueError('Airport codes must be 3 letters (IATA format)')
+    if origin == destination:
+        raise ValueError('Origin and destination cannot be the same')
+    for value in filter(None, [departure_date, return_date]):
+        try:
+            datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f'Invalid date (expected YYYY-MM-DD): {value}')
+
+    cabin_class = (data.get('cabin_class') or 'economy').strip().lower()
+    if cabin_class not in CABIN_CLASSES:
+        cabin_class = 'economy'
+
+    return {
+        'origin': origin,
+        'destination': destination,
+        'departure_date': departure_date,
+        'return_date': return_date,
+        'passengers': _normalize_passengers(data.get('passengers', 1)),
+        'cabin_class': cabin_class
+    }
+
+
+def search_key(search):
+    """Clave de caché para una búsqueda normalizada"""
+    return (
+        search['origin'],
+        search['destination'],
+        search['departure_date'],
+        search['return_date'],
+        search['passengers'],
+        search['cabin_class']
+    )
+
+
+def build_offer_request(search):
+    """Construir el payload de offer request de Duffel"""
+    slices = [{
+        'origin': search['origin'],
+        'destination': search['destination'],
+        'departure_date': search['departure_date']
+    }]
+    if search['return_date']:
+        slices.append({
+            'origin': search['destination'],
+            'destination': search['origin'],
+            'departure_date': search['return_date']
+        })
+
+    passengers = []
+    for passenger_type, age in search['passengers']:
+        passenger = {}
+        if passenger_type:
+            passenger['type'] = passenger_type
+        if age is not None:
+            passenger['age'] = age
+        passengers.append(passenger)
+
+    return {
+        'data': {
+            'slices': slices,
+            'passengers': passengers,
+            'cabin_class': search['cabin_class']
+        }
+    }
+
+
+def _parse_expires_at(value):
+    """Convertir el expires_at ISO de Duffel a epoch (None si no se puede)"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _compact_place(place):
+    place = place or {}
+    return {
+        'iata_code': place.get('iata_code'),
+        'name': place.get('name'),
+        'city_name': place.get('city_name')
+    }
+
+
+def _compact_carrier(carrier):
+    carrier = carrier or {}
+    return {
+        'name': carrier.get('name'),
+        'iata_code': carrier.get('iata_code'),
+        'logo_symbol_url': carrier.get('logo_symbol_url')
+    }
+
+
+def compact_offer(offer):
+    """Proyección de una oferta de Duffel con solo los campos que pinta la app
+
+    Descarta condiciones, documentos de pasajeros, logos del owner, emisiones,
+    etc. La usa el modo format=compact y la transformación a formato Flutter.
+    """
+    return {
+        'id': offer.get('id'),
+        'expires_at': offer.get('expires_at'),
+        'total_amount': offer.get('total_amount'),
+        'total_currency': offer.get('total_currency'),
+        'owner': {
+            'name': (offer.get('owner') or {}).get('name'),
+            'iata_code': (offer.get('owner') or {}).get('iata_code')
+        },
+        'passengers': [{'id': p.get('id'), 'type': p.get('type')} for p in offer.get('passengers', [])],
+        'slices': [
+            {
+                'origin': _compact_place(slice_data.get('origin')),
+                'destination': _compact_place(slice_data.get('destination')),
+                'duration': slice_data.get('duration'),
+                'segments': [
+                    {
+                        'departing_at': segment.get('departing_at'),
+                        'arriving_at': segment.get('arriving_at'),
+                        'origin': _compact_place(segment.get('origin')),
+                        'destination': _compact_place(segment.get('destination')),
+                        'marketing_carrier': _compact_carrier(segment.get('marketing_carrier')),
+                        'marketing_carrier_flight_number': segment.get('marketing_carrier_flight_number'),
+                        'duration': segment.get('duration')
+                    }
+                    for segment in slice_data.get('segments', [])
+                ]
+            }
+            for slice_data in offer.get('slices', [])
+        ]
+    }
+
+
+class DuffelService:
+    def __init__(self):
+        self.api_key = os.environ.get('DUFFEL_API_KEY')
+        self.headers = {
+            'Accept': 'application/json',
+            'Authorization': f'Bearer {self.api_key}',
+            'Duffel-Version': 'v2',
+            'Content-Type': 'application/json'
+        }
+        self.route_ttls = parse_route_ttls(DUFFEL_CACHE_ROUTE_TTLS)
+        self.offer_cache = TTLCache(
+            max_entries=DUFFEL_CACHE_MAX_ENTRIES,
+            default_ttl=DUFFEL_CACHE_TTL,
+            name='duffel_offers'
+        )
+        # Búsquedas idénticas concurrentes comparten una sola petición a Duffel
+        self.in_flight = SingleFlight(name='duffel_offer_requests')
+
+    @property
+    def session(self):
+        """Sesión HTTP con keep-alive compartida por todo el proceso"""
+        return _shared_session.get()
+
+    def is_configured(self):
+        return bool(self.api_key)
+
+    def search_offers(self, search, limit=None):
+        """Obtener hasta 'limit' ofertas (o todas hasta DUFFEL_MAX_OFFERS), usando la caché si es posible"""
+        offers = self._cached_offers(search, limit)
+        if offers is not None:
+            return offers
+        offers = []
+        for page in self._shared_offer_pages(search, limit):
+            offers.extend(page)
+        return offers
+
+    def iter_offer_pages(self, search, limit=None):
+        """Generador de páginas de ofertas: desde la caché, o desde Duffel siguiendo el cursor
+
+        Permite transformar y enviar las primeras ofertas mientras llegan las
+        siguientes. Solo se cachea si se recorren todas las páginas.
+        """
+        offers = self._cached_offers(search, limit)
+        if offers is not None:
+            for i in range(0, len(offers), DUFFEL_OFFERS_PAGE_SIZE):
+                yield offers[i:i + DUFFEL_OFFERS_PAGE_SIZE]
+            return
+        yield from self._shared_offer_pages(search, limit)
+
+    def iter_airports(self, page_size=200):
+        """Recorrer el listado completo de aeropuertos de Duffel siguiendo el cursor 'after'"""
+        params = {'limit': page_size}
+        while True:
+            response = self.session.get(f'{DUFFEL_API_URL}/air/airports', headers=self.headers, params=params)
+            if response.status_code != 200:
+                raise DuffelError('Error listing airports', response.status_code, response.text, stage='airports')
+            payload = response.json()
+            for airport in payload.get('data', []):
+                yield airport
+            after = (payload.get('meta') or {}).get('after')
+            if not after:
+                break
+            params = {'limit': page_size, 'after': after}
+
+    def cache_stats(self):
+        stats = self.offer_cache.stats()
+        stats['single_flight'] = self.in_flight.stats()
+        return stats
+
+    def _cached_offers(self, search, limit=None, count=True):
+        """Ofertas cacheadas si alcanzan para 'limit' (None si hay que ir a Duffel)"""
+        entry = self.offer_cache.get(search_key(search), count=count)
+        if entry is None:
+            return None
+        offers = entry['offers']
+        if entry['complete'] or (limit is not None and len(offers) >= limit):
+            if count:
+                print(f"⚡ Caché Duffel HIT: {search['origin']} → {search['destination']} {search['departure_date']}")
+            return offers[:limit] if limit is not None else offers
+        return None
+
+    def _store(self, search, offers, complete):
+        key = search_key(search)
+        # No reemplazar un resultado completo por uno recortado
+        current = self.offer_cache.get(key, count=False)
+        if current is not None and current['complete'] and not complete:
+            return
+        self.offer_cache.set(key, {'offers': offers, 'complete': complete},
+                             ttl=self._cache_ttl(search, offers))
+
+    def _shared_offer_pages(self, search, limit):
+        """Páginas de Duffel compartidas: búsquedas idénticas concurrentes (síncronas,
+        asíncronas o en streaming) reciben las páginas de una sola petición"""
+        key = (search_key(search), limit)
+        return self.in_flight.stream(key, self._fetch_and_cache_pages, search, limit)
+
+    def _fetch_and_cache_pages(self, search, limit):
+        # Otra petición pudo llenar la caché mientras esta esperaba turno
+        offers = self._cached_offers(search, limit, count=False)
+        if offers is not None:
+            for i in range(0, len(offers), DUFFEL_OFFERS_PAGE_SIZE):
+                yield offers[i:i + DUFFEL_OFFERS_PAGE_SIZE]
+            return
+        collected = []
+        for page, complete in self._fetch_offer_pages(search, limit):
+            collected.extend(page)
+            yield page
+        self._store(search, collected, complete)
+
+    def _cache_ttl(self, search, offers):
+        """TTL de la ruta, acotado por la oferta que expira primero"""
+        ttl = self.route_ttls.get((search['origin'], search['destination']), DUFFEL_CACHE_TTL)
+        expirations = [_parse_expires_at(offer.get('expires_at')) for offer in offers]
+        expirations = [e for e in expirations if e is not None]
+        if expirations:
+            ttl = min(ttl, min(expirations) - time.time() - DUFFEL_OFFER_EXPIRY_MARGIN)
+        return ttl
+
+    def _create_offer_request(self, search):
+        """Crear el offer request en Duffel y retornar su id"""
+        offer_request_data = build_offer_request(search)
+        print("🚀 Payload para Duffel: {}".format(offer_request_data))
+
+        # return_offers=false: las ofertas se leen paginadas desde /air/offers
+        offer_response = self.session.post(
+            f'{DUFFEL_API_URL}/air/offer_requests',
+            headers=self.headers,
+            params={'return_offers': 'false'},
+            json=offer_request_data
+        )
+        print("📡 DUFFEL RESPONSE STATUS: {}".format(offer_response.status_code))
+
+        if offer_response.status_code != 201:
+            message = 'Duffel API Error'
+            try:
+                errors = offer_response.json().get('errors')
+                if errors:
+                    message = 'Duffel API Error: {}'.format(errors[0].get('message', 'Error desconocido de Duffel'))
+            except ValueError:
+                pass
+            raise DuffelError(message, offer_response.status_code, offer_response.text, stage='offer_request')
+
+        return offer_response.json()['data']['id']
+
+    def _fetch_offer_pages(self, search, limit=None):
+        """Generador de (página, completo) siguiendo el cursor 'after' de Duffel
+
+        'completo' es True en la última página si se agotó el cursor o se llegó a
+        DUFFEL_MAX_OFFERS; es False si se cortó antes por 'limit'.
+        """
+        offer_request_id = self._create_offer_request(search)
+        max_offers = min(limit, DUFFEL_MAX_OFFERS) if limit is not None else DUFFEL_MAX_OFFERS
+        params = {'offer_request_id': offer_request_id, 'limit': min(DUFFEL_OFFERS_PAGE_SIZE, max_offers)}
+        fetched = 0
+        while True:
+            offers_response = self.session.get(
+                f'{DUFFEL_API_URL}/air/offers',
+                headers=self.headers,
+                params=params
+            )
+            if offers_response.status_code != 200:
+                raise DuffelError('Error getting offers', offers_response.status_code,
+                                  offers_response.text, stage='offers')
+            payload = offers_response.json()
+            page = payload.get('data', [])[:max_offers - fetched]
+            fetched += len(page)
+            after = (payload.get('meta') or {}).get('after')
+            if not after or not page:
+                yield page, True
+                return
+            if fetched >= max_offers:
+                # Llegar a DUFFEL_MAX_OFFERS cuenta como completo: nunca se pide más que eso
+                yield page, max_offers >= DUFFEL_MAX_OFFERS
+                return
+            yield page, False
+            params = dict(params, after=after, limit=min(DUFFEL_OFFERS_PAGE_SIZE, max_offers - fetched))
+
+
+# Instancia compartida por admin_server y admin_routes
+duffel_service = DuffelService()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+⏳ FLIGHT SEARCH JOBS - BÚSQUEDA DE VUELOS ASÍNCRONA
+🧵 Ejecuta las búsquedas en un pool de hilos y guarda el estado en SQLite para consultarlo por id
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import env_int
+
+FLIGHT_SEARCH_DB = os.environ.get('FLIGHT_SEARCH_DB', 'flight_search_jobs.db')
+FLIGHT_SEARCH_WORKERS = env_int('FLIGHT_SEARCH_WORKERS', 8)
+# Tiempo que se conserva un resultado para ser consultado (segundos)
+FLIGHT_SEARCH_JOB_TTL = env_int('FLIGHT_SEARCH_JOB_TTL', 900)
+# Un job 'running' más viejo que esto se da por perdido (p.ej. el worker se reinició)
+FLIGHT_SEARCH_JOB_TIMEOUT = env_int('FLIGHT_SEARCH_JOB_TIMEOUT', 120)
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_PARTIAL = 'partial'
+STATUS_COMPLETE = 'complete'
+STATUS_ERROR = 'error'
+
+
+class FlightSearchJobs:
+    def __init__(self, db_path=FLIGHT_SEARCH_DB, max_workers=FLIGHT_SEARCH_WORKERS):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS flight_search_jobs
+                        (id TEXT PRIMARY KEY, status TEXT NOT NULL, result TEXT,
+                         error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)''')
+        conn.commit()
+        conn.close()
+
+    @property
+    def executor(self):
+        # Cada proceso (worker WSGI) necesita su propio pool de hilos
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='flight-search')
+                    self._executor_pid = pid
+        return self._executor
+
+    def submit(self, fn):
+        """Registrar un job y ejecutar fn(job_id) en segundo plano; fn retorna el resultado (dict)"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute('DELETE FROM flight_search_jobs WHERE created_at < ?', (now - FLIGHT_SEARCH_JOB_TTL,))
+        conn.execute('INSERT INTO flight_search_jobs (id, status, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                     (job_id, STATUS_PENDING, now, now))
+        conn.commit()
+        conn.close()
+        self.executor.submit(self._run, job_id, fn)
+        return job_id
+
+    def update(self, job_id, status, result=None, error=None):
+        """Actualizar estado y (opcionalmente) resultados parciales o finales"""
+        conn = self._connect()
+        if result is None:
+            conn.execute('UPDATE flight_search_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                         (status, error, time.time(), job_id))
+        else:
+            conn.execute('UPDATE flight_search_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+                         (status, json.dumps(result), error, time.time(), job_id))
+        conn.commit()
+        conn.close()
+
+    def get(self, job_id):
+        """Obtener el estado de un job (None si no existe o expiró)"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM flight_search_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        if row is None or row['created_at'] < time.time() - FLIGHT_SEARCH_JOB_TTL:
+            return None
+
+        status = row['status']
+        error = row['error']
+        if status in (STATUS_PENDING, STATUS_RUNNING, STATUS_PARTIAL) and \
+                row['updated_at'] < time.time() - FLIGHT_SEARCH_JOB_TIMEOUT:
+            status, error = STATUS_ERROR, 'La búsqueda no terminó a tiempo'
+        return {
+            'search_id': row['id'],
+            'status': status,
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': error,
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    def _run(self, job_id, fn):
+        try:
+            self.update(job_id, STATUS_RUNNING)
+            result = fn(job_id)
+            self.update(job_id, STATUS_COMPLETE, result=result)
+        except Exception as e:
+            print(f"❌ Error en búsqueda asíncrona {job_id}: {e}")
+            self.update(job_id, STATUS_ERROR, error=str(e))
+
+
+# Instancia compartida por admin_server y admin_routes
+flight_search_jobs = FlightSearchJobs()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+⚙️ GUNICORN - CONFIGURACIÓN DEL SERVIDOR DE PRODUCCIÓN
+🧵 Varios procesos (uno por núcleo) con varios hilos cada uno
+"""
+
+import multiprocessing
+import os
+
+from http_client import env_int
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '10000'))
+
+# Procesos y hilos: WEB_CONCURRENCY es la variable estándar en Render/Heroku
+workers = env_int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = env_int('GUNICORN_THREADS', 4)
+
+# Capacidad de conexiones en espera: cada cliente SSE (/api/notifications/stream,
+# hasta NOTIFICATION_SSE_MAX_DURATION s) o long-poll (?wait=, hasta
+# NOTIFICATION_LONG_POLL_MAX s) ocupa un hilo mientras espera. Por worker se
+# admiten NOTIFICATION_MAX_WAITERS (por defecto threads // 2), en total
+# workers * NOTIFICATION_MAX_WAITERS; pasado el cupo el SSE responde 503 con
+# Retry-After y el long-poll responde al instante sin esperar. Para más clientes
+# en espera subir GUNICORN_THREADS (los hilos en espera casi no consumen CPU).
+
+# Las búsquedas de vuelos y los streams NDJSON pueden tardar; gthread no mata
+# al worker por una petición lenta, solo si deja de responder al master
+timeout = env_int('GUNICORN_TIMEOUT', 120)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+# Reciclar workers periódicamente (con jitter para que no se reinicien todos a la vez)
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', 100)
+
+# Cada worker importa la app por su cuenta: sesiones HTTP, pools de hilos y
+# conexiones SQLite se crean después del fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    print("🚀 Gunicorn: {} workers x {} hilos en {}".format(workers, threads, bind))
+    print("📡 Conexiones en espera (SSE/long-poll): {} por worker".format(
+        env_int('NOTIFICATION_MAX_WAITERS', max(1, threads // 2))))
+
+
+def worker_exit(server, worker):
+    print("🔄 Worker {} finalizado".format(worker.pid))
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔌 HTTP CLIENT - SESIONES HTTP COMPARTIDAS
+♻️ Sesiones requests con pool de conexiones, keep-alive y timeouts por defecto
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def env_int(name, default):
+    """Leer un entero desde variables de entorno con valor por defecto"""
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def env_float(name, default):
+    """Leer un float desde variables de entorno con valor por defecto"""
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class PooledSession(requests.Session):
+    """Sesión requests que aplica un timeout (connect, read) por defecto"""
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.default_timeout
+        return super().request(method, url, **kwargs)
+
+
+def create_pooled_session(pool_connections=10, pool_maxsize=20, connect_timeout=5.0,
+                          read_timeout=30.0, retries=0, headers=None):
+    """Crear una sesión con pool de conexiones keep-alive y timeouts por defecto"""
+    session = PooledSession(timeout=(connect_timeout, read_timeout))
+
+    # Solo reintentar fallos de conexión en métodos idempotentes
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        backoff_factor=0.2,
+        allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS', 'DELETE']),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+        pool_block=False
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'Connection': 'keep-alive'})
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class SharedSession:
+    """Sesión perezosa compartida entre hilos, creada una sola vez por proceso"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        # Tras un fork (workers WSGI) cada proceso necesita su propio pool
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._factory()
+                    self._pid = pid
+        return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._pid = None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔁 IDEMPOTENCY - REINTENTOS SEGUROS EN ENDPOINTS DE PAGO
+🗃️ Guarda la respuesta de cada operación por clave y la repite ante reintentos del cliente
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from functools import wraps
+
+from flask import current_app, g, jsonify, make_response, request, session
+
+from http_client import env_int, env_float
+
+IDEMPOTENCY_DB = os.environ.get('IDEMPOTENCY_DB', 'idempotency.db')
+# Tiempo que se conserva la respuesta de una clave enviada por el cliente (segundos)
+IDEMPOTENCY_TTL = env_int('IDEMPOTENCY_TTL', 24 * 3600)
+# Claves derivadas (identidad + body): solo cubren la ventana de reintentos, no pagos repetidos a propósito
+IDEMPOTENCY_DERIVED_TTL = env_int('IDEMPOTENCY_DERIVED_TTL', 600)
+# Una operación 'in_progress' más vieja que esto se considera abandonada
+IDEMPOTENCY_LOCK_TIMEOUT = env_int('IDEMPOTENCY_LOCK_TIMEOUT', 60)
+# Cuánto espera un reintento concurrente a que termine la operación original
+IDEMPOTENCY_WAIT = env_float('IDEMPOTENCY_WAIT', 10)
+
+MAX_KEY_LENGTH = 255
+
+BEGIN_NEW = 'new'
+BEGIN_REPLAY = 'replay'
+BEGIN_IN_PROGRESS = 'in_progress'
+BEGIN_MISMATCH = 'mismatch'
+
+
+def hash_payload(data):
+    """Hash estable del body (sin la propia clave de idempotencia)"""
+    if isinstance(data, dict):
+        data = {k: v for k, v in data.items() if k != 'idempotency_key'}
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def upstream_key(scope, key, max_length=45):
+    """Clave determinista para la API externa (Square acepta hasta 45 caracteres en pagos)"""
+    return hashlib.sha256(f'{scope}:{key}'.encode('utf-8')).hexdigest()[:max_length]
+
+
+class IdempotencyStore:
+    """Registro de operaciones por (scope, clave) en SQLite, compartido por los workers"""
+
+    def __init__(self, db_path=IDEMPOTENCY_DB):
+        self.db_path = db_path
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS idempotency_keys
+                        (scope TEXT NOT NULL, key TEXT NOT NULL, request_hash TEXT NOT NULL,
+                         status TEXT NOT NULL, status_code INTEGER, body TEXT, mimetype TEXT,
+                         created_at REAL NOT NULL, expires_at REAL NOT NULL,
+                         PRIMARY KEY (scope, key))''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys (expires_at)')
+        conn.close()
+
+    def begin(self, scope, key, request_hash, ttl=IDEMPOTENCY_TTL):
+        """Reclamar una clave; retorna (estado, respuesta guardada o None)
+
+        - new: la clave es nuestra, ejecutar la operación y llamar a complete/release.
+        - replay: ya se ejecutó; se retorna (status_code, body, mimetype).
+        - in_progress: otra petición la está ejecutando ahora mismo.
+        - mismatch: la clave ya se usó con otro body.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM idempotency_keys WHERE expires_at < ?', (now,))
+            conn.execute('''DELETE FROM idempotency_keys WHERE status = 'in_progress' AND created_at < ?''',
+                         (now - IDEMPOTENCY_LOCK_TIMEOUT,))
+            row = conn.execute('SELECT * FROM idempotency_keys WHERE scope = ? AND key = ?',
+                               (scope, key)).fetchone()
+            if row is None:
+                conn.execute('''INSERT INTO idempotency_keys (scope, key, request_hash, status, created_at, expires_at)
+                                VALUES (?, ?, ?, 'in_progress', ?, ?)''', (scope, key, request_hash, now, now + ttl))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if row is None:
+            return BEGIN_NEW, None
+        if row['request_hash'] != request_hash:
+            return BEGIN_MISMATCH, None
+        if row['status'] == 'in_progress':
+            return BEGIN_IN_PROGRESS, None
+        return BEGIN_REPLAY, (row['status_code'], row['body'], row['mimetype'])
+
+    def complete(self, scope, key, status_code, body, mimetype='application/json'):
+        """Guardar la respuesta final para repetirla en los reintentos"""
+        conn = self._connect()
+        conn.execute('''UPDATE idempotency_keys SET status = 'done', status_code = ?, body = ?, mimetype = ?
+                        WHERE scope = ? AND key = ?''', (status_code, body, mimetype, scope, key))
+        conn.close()
+
+    def release(self, scope, key):
+        """Liberar la clave (la operación falló de forma transitoria y se puede reintentar)"""
+        conn = self._connect()
+        conn.execute("DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND status = 'in_progress'",
+                     (scope, key))
+        conn.close()
+
+    def wait(self, scope, key, request_hash, timeout=IDEMPOTENCY_WAIT):
+        """Esperar a que termine la operación concurrente con la misma clave"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            state, saved = self.begin(scope, key, request_hash)
+            if state != BEGIN_IN_PROGRESS:
+                return state, saved
+        return BEGIN_IN_PROGRESS, None
+
+
+idempotency_store = IdempotencyStore()
+
+
+# Campos del body que identifican a quien paga (el nonce de Square es de un solo cliente)
+IDENTITY_FIELDS = ('user_id', 'email', 'nonce')
+
+
+def get_request_identity(data):
+    """Quién hace la petición: usuario de la sesión o user_id/email/nonce del body (None si no se sabe)"""
+    if session.get('logged_in') and session.get('username'):
+        return f"session:{session['username']}"
+    if isinstance(data, dict):
+        for field in IDENTITY_FIELDS:
+            if data.get(field):
+                return f'{field}:{data[field]}'
+    return None
+
+
+def get_request_idempotency_key(data):
+    """Clave del header Idempotency-Key o del campo idempotency_key; (clave, derivada)
+
+    Sin clave del cliente se deriva de la identidad y el body, así el reintento
+    de un cliente viejo tras un timeout no crea un segundo pago. Sin identidad
+    no se deriva (None): dos usuarios con el mismo body no deben compartir clave.
+    """
+    key = request.headers.get('Idempotency-Key') or (data or {}).get('idempotency_key')
+    if key:
+        return str(key)[:MAX_KEY_LENGTH], False
+    identity = get_request_identity(data)
+    if identity is None:
+        return None, True
+    return 'body:' + hash_payload({'identity': identity, 'body': data}), True
+
+
+def idempotent(scope):
+    """Decorador: ejecuta la vista una sola vez por clave y repite su respuesta en los reintentos
+
+    La vista recibe la clave en g.idempotency_key (para usarla como clave de la
+    API externa; None si no hay clave). Las respuestas 5xx liberan la clave
+    para permitir reintentar.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            data = request.get_json(silent=True)
+            key, derived = get_request_idempotency_key(data)
+            if key is None:
+                # Sin clave ni identidad: se procesa sin protección ante reintentos
+                g.idempotency_key = None
+                return f(*args, **kwargs)
+            request_hash = hash_payload(data)
+            ttl = IDEMPOTENCY_DERIVED_TTL if derived else IDEMPOTENCY_TTL
+
+            state, saved = idempotency_store.begin(scope, key, request_hash, ttl=ttl)
+            if state == BEGIN_IN_PROGRESS:
+                state, saved = idempotency_store.wait(scope, key, request_hash)
+            if state == BEGIN_MISMATCH:
+                return jsonify({
+                    'success': False,
+                    'error': 'La clave de idempotencia ya se usó con otros datos'
+                }), 422
+            if state == BEGIN_IN_PROGRESS:
+                response = jsonify({
+                    'success': False,
+                    'error': 'Hay un pago en curso con la misma clave; reintente en unos segundos'
+                })
+                response.status_code = 409
+                response.headers['Retry-After'] = '2'
+                return response
+            if state == BEGIN_REPLAY:
+                status_code, body, mimetype = saved
+                response = current_app.response_class(body, status=status_code, mimetype=mimetype)
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+
+            g.idempotency_key = upstream_key(scope, key)
+            try:
+                response = make_response(f(*args, **kwargs))
+            except Exception:
+                idempotency_store.release(scope, key)
+                raise
+            if response.status_code >= 500 or response.is_streamed:
+                idempotency_store.release(scope, key)
+            else:
+                idempotency_store.complete(scope, key, response.status_code,
+                                           response.get_data(as_text=True), response.mimetype)
+            return response
+        return decorated_function
+    return decorator
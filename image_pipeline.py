@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🖼️ IMAGE PIPELINE - PROCESAMIENTO DE IMÁGENES SUBIDAS
+⚙️ La subida se guarda una vez (direccionada por contenido) y un pool de procesos
+   genera variantes WebP/JPEG a varios anchos fuera del request
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from http_client import env_int
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGE_PIPELINE_DB = os.environ.get('IMAGE_PIPELINE_DB', 'image_pipeline.db')
+IMAGE_UPLOAD_DIR = os.environ.get('IMAGE_UPLOAD_DIR', os.path.join('static', 'uploads', 'images'))
+# Servido por static_assets.py con caché immutable (la URL incluye el hash del contenido)
+IMAGE_URL_PREFIX = os.environ.get('IMAGE_URL_PREFIX', '/assets')
+# Anchos generados (px); nunca se amplía por encima del original
+IMAGE_WIDTHS = [int(w) for w in os.environ.get('IMAGE_WIDTHS', '320,640,1280').split(',') if w.strip()]
+# Variante que se registra como image_url del producto/banner/vehículo
+IMAGE_DEFAULT_WIDTH = env_int('IMAGE_DEFAULT_WIDTH', 640)
+IMAGE_QUALITY = env_int('IMAGE_QUALITY', 80)
+IMAGE_WORKERS = env_int('IMAGE_WORKERS', min(4, os.cpu_count() or 1))
+
+STATUS_PENDING = 'pending'
+STATUS_DONE = 'done'
+STATUS_ERROR = 'error'
+STATUS_SKIPPED = 'skipped'
+
+CHUNK_SIZE = 64 * 1024
+
+# kind -> (función que actualiza el registro, admite varias imágenes)
+IMAGE_TARGETS = {}
+
+
+def register_target(kind, updater, multiple=False):
+    """Registrar cómo se actualiza un registro al terminar sus imágenes
+
+    updater(record_id, url) o, con multiple=True, updater(record_id, [urls por slot]).
+    """
+    IMAGE_TARGETS[kind] = (updater, multiple)
+
+
+def render_variants(original_path, output_dir, widths, quality):
+    """Generar las variantes de una imagen (se ejecuta en un proceso del pool)"""
+    variants = []
+    with Image.open(original_path) as source:
+        image = ImageOps.exif_transpose(source)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        for width in sorted({min(w, image.width) for w in widths}):
+            if width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.LANCZOS)
+            else:
+                resized = image
+            if has_alpha:
+                # JPEG no tiene transparencia: fondo blanco
+                flat = Image.new('RGB', resized.size, (255, 255, 255))
+                flat.paste(resized, mask=resized.getchannel('A'))
+            else:
+                flat = resized
+
+            for fmt, ext, img, options in (('WEBP', 'webp', resized, {'method': 4}),
+                                           ('JPEG', 'jpg', flat, {'optimize': True, 'progressive': True})):
+                filename = f'{width}.{ext}'
+                path = os.path.join(output_dir, filename)
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                img.save(tmp_path, fmt, quality=quality, **options)
+                os.replace(tmp_path, path)
+                variants.append({
+                    'width': resized.width,
+                    'height': resized.height,
+                    'format': ext,
+                    'file': filename,
+                    'bytes': os.path.getsize(path)
+                })
+    return variants
+
+
+class ImagePipeline:
+    """Subidas direccionadas por contenido + variantes generadas en segundo plano
+
+    - save_upload() copia el stream a disco una sola vez calculando el sha256;
+      la misma imagen subida dos veces ocupa un solo directorio.
+    - submit() registra el trabajo y retorna enseguida; un pool de procesos
+      redimensiona y recodifica y, al terminar, se actualiza el registro
+      (producto, banner, vehículo) con la URL de la variante por defecto.
+    - Sin Pillow las imágenes se sirven tal cual (trabajos 'skipped').
+    """
+
+    def __init__(self, db_path=IMAGE_PIPELINE_DB, upload_dir=IMAGE_UPLOAD_DIR, url_prefix=IMAGE_URL_PREFIX,
+                 widths=IMAGE_WIDTHS, quality=IMAGE_QUALITY, max_workers=IMAGE_WORKERS):
+        self.db_path = db_path
+        self.upload_dir = upload_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self.widths = widths
+        self.quality = quality
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._init_db()
+        if Image is None:
+            print("⚠️ Pillow no instalado: las imágenes se guardan sin variantes")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS images
+                        (digest TEXT PRIMARY KEY, original TEXT NOT NULL, status TEXT NOT NULL,
+                         variants TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS image_jobs
+                        (id TEXT PRIMARY KEY, digest TEXT NOT NULL, kind TEXT, record_id TEXT,
+                         slot INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL, created_at REAL NOT NULL,
+                         finished_at REAL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_image_jobs_record ON image_jobs (kind, record_id, slot)')
+        # Assets de la app con nombre fijo (logo, banners) -> versión actual por contenido
+        conn.execute('''CREATE TABLE IF NOT EXISTS image_aliases
+                        (name TEXT PRIMARY KEY, digest TEXT NOT NULL, updated_at REAL NOT NULL)''')
+        conn.close()
+
+    @property
+    def executor(self):
+        # Cada proceso (worker WSGI) necesita su propio pool
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                    self._executor_pid = pid
+        return self._executor
+
+    # ===== SUBIDA =====
+
+    def save_upload(self, file, ext=None):
+        """Guardar un FileStorage en disco (una sola copia, por contenido); retorna su info
+
+        ext: extensión según el contenido validado; por defecto la del nombre del archivo.
+        """
+        ext = ext or os.path.splitext(file.filename or '')[1].lower().lstrip('.') or 'bin'
+        if ext == 'jpeg':
+            ext = 'jpg'
+        os.makedirs(self.upload_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_dir, suffix='.upload')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    out.write(chunk)
+            digest = digest.hexdigest()[:32]
+            now = time.time()
+            conn = self._connect()
+            try:
+                conn.execute('''INSERT OR IGNORE INTO images (digest, original, status, created_at, updated_at)
+                                VALUES (?, ?, ?, ?, ?)''', (digest, f'original.{ext}', STATUS_PENDING, now, now))
+                # Misma imagen ya subida (quizá con otra extensión): se reutiliza su nombre
+                original = conn.execute('SELECT original FROM images WHERE digest = ?', (digest,)).fetchone()[0]
+            finally:
+                conn.close()
+            image_dir = os.path.join(self.upload_dir, digest)
+            os.makedirs(image_dir, exist_ok=True)
+            os.replace(tmp_path, os.path.join(image_dir, original))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return {'digest': digest, 'path': os.path.join(image_dir, original), 'url': self.url_for(digest, original)}
+
+    def link_to(self, upload, path):
+        """Publicar además la subida en una ruta fija (enlace duro; copia si no se puede)"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.link(upload['path'], tmp_path)
+        except OSError:
+            shutil.copyfile(upload['path'], tmp_path)
+        os.replace(tmp_path, path)
+
+    def url_for(self, digest, filename):
+        return f'{self.url_prefix}/{digest}/{filename}'
+
+    # ===== PROCESAMIENTO =====
+
+    def submit(self, upload, kind=None, record_id=None, slot=0):
+        """Encolar la generación de variantes de una subida; retorna el id del trabajo"""
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        conn.execute('''INSERT INTO image_jobs (id, digest, kind, record_id, slot, status, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (job_id, upload['digest'], kind, None if record_id is None else str(record_id), slot,
+                      STATUS_PENDING, time.time()))
+        conn.close()
+        threading.Thread(target=self._run, args=(job_id, upload['digest']),
+                         name=f'image-job-{job_id[:8]}', daemon=True).start()
+        return job_id
+
+    def _run(self, job_id, digest):
+        image = self.get_image(digest)
+        if image['status'] == STATUS_PENDING:
+            if Image is None or image['original_file'].endswith('.svg'):
+                # Sin Pillow, o vectorial: se sirve el original
+                self._set_image(digest, STATUS_SKIPPED)
+            else:
+                try:
+                    variants = self.executor.submit(
+                        render_variants, os.path.join(self.upload_dir, digest, image['original_file']),
+                        os.path.join(self.upload_dir, digest), self.widths, self.quality).result()
+                    self._set_image(digest, STATUS_DONE, variants=variants)
+                    print(f"🖼️ Imagen {digest}: {len(variants)} variantes generadas")
+                except Exception as e:
+                    print(f"❌ Imagen {digest}: error generando variantes: {e}")
+                    self._set_image(digest, STATUS_ERROR, error=str(e))
+
+        conn = self._connect()
+        conn.execute('UPDATE image_jobs SET status = ?, finished_at = ? WHERE id = ?',
+                     (STATUS_DONE, time.time(), job_id))
+        job = conn.execute('SELECT * FROM image_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        try:
+            self._register(job)
+        except Exception as e:
+            print(f"⚠️ Imagen {digest}: no se pudo actualizar {job['kind']} {job['record_id']}: {e}")
+
+    def _set_image(self, digest, status, variants=None, error=None):
+        conn = self._connect()
+        conn.execute('UPDATE images SET status = ?, variants = ?, error = ?, updated_at = ? WHERE digest = ?',
+                     (status, json.dumps(variants) if variants is not None else None, error, time.time(), digest))
+        conn.close()
+
+    def _register(self, job):
+        """Apuntar el registro dueño de la imagen a la variante por defecto"""
+        if job['kind'] not in IMAGE_TARGETS or job['record_id'] is None:
+            return
+        updater, multiple = IMAGE_TARGETS[job['kind']]
+        if not multiple:
+            updater(job['record_id'], self.get_image(job['digest'])['default_url'])
+            return
+        # Varias imágenes por registro (fotos de vehículo): se reescribe la lista completa en orden
+        conn = self._connect()
+        rows = conn.execute('''SELECT digest, slot FROM image_jobs WHERE kind = ? AND record_id = ?
+                               ORDER BY slot, created_at DESC''', (job['kind'], job['record_id'])).fetchall()
+        conn.close()
+        urls, seen_slots = [], set()
+        for row in rows:
+            if row['slot'] not in seen_slots:
+                seen_slots.add(row['slot'])
+                urls.append(self.get_image(row['digest'])['default_url'])
+        updater(job['record_id'], urls)
+
+    # ===== CONSULTA =====
+
+    def get_image(self, digest):
+        """Estado y variantes de una imagen; None si no existe"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM images WHERE digest = ?', (digest,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        variants = [dict(v, url=self.url_for(digest, v['file'])) for v in json.loads(row['variants'] or '[]')]
+        original_url = self.url_for(digest, row['original'])
+        return {
+            'digest': digest,
+            'status': row['status'],
+            'error': row['error'],
+            'original_file': row['original'],
+            'original_url': original_url,
+            'variants': variants,
+            'default_url': self._pick(variants, IMAGE_DEFAULT_WIDTH, 'jpg') or original_url
+        }
+
+    def set_alias(self, name, upload):
+        """Apuntar un asset con nombre fijo (p.ej. 'logo') a una subida"""
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO image_aliases (name, digest, updated_at) VALUES (?, ?, ?)',
+                     (name, upload['digest'], time.time()))
+        conn.close()
+
+    def get_aliases(self):
+        """{nombre: imagen} de los assets con nombre fijo"""
+        conn = self._connect()
+        rows = conn.execute('SELECT name, digest FROM image_aliases ORDER BY name').fetchall()
+        conn.close()
+        aliases = {}
+        for row in rows:
+            image = self.get_image(row['digest'])
+            if image is not None:
+                image.pop('original_file')
+                aliases[row['name']] = image
+        return aliases
+
+    def get_job(self, job_id):
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM image_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def best_url(self, digest, width=None, webp=False):
+        """URL de la variante más pequeña que cubre el ancho pedido (o el original)"""
+        image = self.get_image(digest)
+        if image is None:
+            return None
+        return (self._pick(image['variants'], width, 'webp' if webp else 'jpg')
+                or self._pick(image['variants'], width, 'jpg')
+                or image['original_url'])
+
+    def _pick(self, variants, width, fmt):
+        candidates = sorted((v for v in variants if v['format'] == fmt), key=lambda v: v['width'])
+        if not candidates:
+            return None
+        if width:
+            for variant in candidates:
+                if variant['width'] >= width:
+                    return variant['url']
+        return candidates[-1]['url']
+
+
+# Pipeline compartido del proceso
+image_pipeline = ImagePipeline()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🔔 NOTIFICATION QUEUE - COLA DE NOTIFICACIONES PARA LA APP
+🗃️ Cola persistente por usuario con reservas (visibility timeout) y confirmaciones (ack)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from http_client import env_int, env_float
+
+NOTIFICATION_QUEUE_BACKEND = os.environ.get('NOTIFICATION_QUEUE_BACKEND', 'sqlite')
+NOTIFICATION_QUEUE_DB = os.environ.get('NOTIFICATION_QUEUE_DB', 'notification_queue.db')
+# Segundos que una notificación reservada queda oculta esperando su ack
+NOTIFICATION_VISIBILITY_TIMEOUT = env_int('NOTIFICATION_VISIBILITY_TIMEOUT', 60)
+# Entregas sin ack antes de descartar la notificación
+NOTIFICATION_MAX_ATTEMPTS = env_int('NOTIFICATION_MAX_ATTEMPTS', 5)
+# Notificaciones más viejas que esto se eliminan aunque nadie las haya leído
+NOTIFICATION_QUEUE_TTL = env_int('NOTIFICATION_QUEUE_TTL', 7 * 24 * 3600)
+# Long-poll: espera máxima permitida y cada cuánto se revisa la cola de otros workers
+NOTIFICATION_LONG_POLL_MAX = env_int('NOTIFICATION_LONG_POLL_MAX', 30)
+NOTIFICATION_POLL_INTERVAL = env_float('NOTIFICATION_POLL_INTERVAL', 1.0)
+# Máximo de notificaciones por petición en ?max=N
+NOTIFICATION_BATCH_MAX = env_int('NOTIFICATION_BATCH_MAX', 100)
+# Limpieza de notificaciones vencidas como mucho cada N segundos por proceso
+NOTIFICATION_PURGE_INTERVAL = env_int('NOTIFICATION_PURGE_INTERVAL', 60)
+# Conexiones en espera (SSE, long-poll ?wait=) por worker: cada una ocupa un hilo de gunicorn.
+# Por defecto la mitad de GUNICORN_THREADS, el resto queda para búsquedas, admin y pagos
+NOTIFICATION_MAX_WAITERS = env_int('NOTIFICATION_MAX_WAITERS', max(1, env_int('GUNICORN_THREADS', 4) // 2))
+# Retry-After (segundos) del 503 cuando no hay cupo para un stream SSE
+NOTIFICATION_WAITERS_RETRY_AFTER = env_int('NOTIFICATION_WAITERS_RETRY_AFTER', 30)
+
+DEFAULT_USER_ID = 'admin'
+
+
+class NotificationQueueBackend:
+    """Interfaz de los backends de la cola
+
+    - enqueue: agrega una notificación para un usuario y asigna su id.
+    - reserve: entrega hasta `max_items` notificaciones visibles del usuario.
+      Con visibility_timeout=None se confirman en el acto (entrega única, como
+      la cola original); con un timeout quedan ocultas hasta que llegue su ack
+      y, si no llega, se vuelven a entregar.
+    - ack: confirma notificaciones por id o todas hasta un id (cursor).
+    - has_pending: consulta barata (solo lectura) usada por wait().
+
+    wait() implementa el long-poll sobre estas operaciones: los enqueue del
+    mismo proceso despiertan a los que esperan al instante y los de otros
+    workers se detectan revisando la cola cada NOTIFICATION_POLL_INTERVAL.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._sequence = 0
+
+    def _notify(self):
+        with self._condition:
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def wait(self, user_id, timeout, max_items=1, visibility_timeout=None):
+        """Reservar notificaciones esperando hasta `timeout` segundos a que lleguen"""
+        deadline = time.monotonic() + max(0, timeout)
+        while True:
+            with self._condition:
+                sequence = self._sequence
+            if self.has_pending(user_id):
+                items = self.reserve(user_id, max_items, visibility_timeout)
+                if items:
+                    return items
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            with self._condition:
+                self._condition.wait_for(lambda: self._sequence != sequence,
+                                         min(remaining, NOTIFICATION_POLL_INTERVAL))
+
+    def has_pending(self, user_id):
+        return True
+
+    def enqueue(self, notification, user_id=None):
+        raise NotImplementedError
+
+    def enqueue_many(self, notification, user_ids):
+        """Encolar la misma notificación para varios usuarios; retorna cuántas se encolaron"""
+        for user_id in user_ids:
+            self.enqueue(notification, user_id=user_id)
+        return len(user_ids)
+
+    def reserve(self, user_id, max_items=1, visibility_timeout=None):
+        raise NotImplementedError
+
+    def ack(self, user_id, ids=None, up_to=None):
+        raise NotImplementedError
+
+    def pending_count(self, user_id=None):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return self.pending_count()
+
+
+class SQLiteNotificationQueue(NotificationQueueBackend):
+    """Backend SQLite (WAL): compartido por todos los workers de la máquina y persistente"""
+
+    def __init__(self, db_path=NOTIFICATION_QUEUE_DB, max_attempts=NOTIFICATION_MAX_ATTEMPTS,
+                 ttl=NOTIFICATION_QUEUE_TTL):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.ttl = ttl
+        self._last_purge = 0
+        super().__init__()
+        self._init_db()
+
+    def _connect(self):
+        # isolation_level=None: las transacciones se abren explícitamente con BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS notification_queue
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL DEFAULT 'admin',
+                         payload TEXT NOT NULL, created_at REAL NOT NULL,
+                         visible_at REAL NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0)''')
+        # Colas creadas antes del enrutamiento por usuario
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(notification_queue)')}
+        if 'user_id' not in columns:
+            conn.execute("ALTER TABLE notification_queue ADD COLUMN user_id TEXT NOT NULL DEFAULT 'admin'")
+            conn.execute('ALTER TABLE notification_queue ADD COLUMN visible_at REAL NOT NULL DEFAULT 0')
+            conn.execute('ALTER TABLE notification_queue ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_notification_queue_user
+                        ON notification_queue (user_id, visible_at, id)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_notification_queue_created
+                        ON notification_queue (created_at)''')
+        conn.close()
+
+    def _purge(self, conn, now):
+        """Eliminar notificaciones vencidas o que agotaron sus entregas (con throttling)"""
+        if now - self._last_purge < NOTIFICATION_PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        conn.execute('DELETE FROM notification_queue WHERE created_at < ? OR attempts >= ?',
+                     (now - self.ttl, self.max_attempts))
+
+    def enqueue(self, notification, user_id=None):
+        """Agregar una notificación a la cola del usuario; retorna la notificación con su id"""
+        payload = {k: v for k, v in notification.items() if k != 'id'}
+        user_id = str(user_id or payload.get('user_id') or DEFAULT_USER_ID)
+        payload['user_id'] = user_id
+        conn = self._connect()
+        try:
+            # El id lo asigna SQLite (AUTOINCREMENT), único entre workers
+            cursor = conn.execute('INSERT INTO notification_queue (user_id, payload, created_at) VALUES (?, ?, ?)',
+                                  (user_id, json.dumps(payload), time.time()))
+            notification = dict(payload, id=cursor.lastrowid)
+        finally:
+            conn.close()
+        self._notify()
+        return notification
+
+    def enqueue_many(self, notification, user_ids):
+        """Encolar la misma notificación para varios usuarios en una sola transacción"""
+        payload = {k: v for k, v in notification.items() if k not in ('id', 'user_id')}
+        now = time.time()
+        rows = []
+        for user_id in user_ids:
+            user_id = str(user_id)
+            rows.append((user_id, json.dumps(dict(payload, user_id=user_id)), now))
+        if not rows:
+            return 0
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT INTO notification_queue (user_id, payload, created_at) VALUES (?, ?, ?)', rows)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        self._notify()
+        return len(rows)
+
+    def reserve(self, user_id, max_items=1, visibility_timeout=None):
+        """Entregar hasta max_items notificaciones del usuario, de la más antigua a la más nueva"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE: dos workers nunca reservan la misma notificación
+            conn.execute('BEGIN IMMEDIATE')
+            self._purge(conn, now)
+            rows = conn.execute('''SELECT id, payload, attempts FROM notification_queue
+                                   WHERE user_id = ? AND visible_at <= ? AND attempts < ? AND created_at >= ?
+                                   ORDER BY id LIMIT ?''',
+                                (str(user_id), now, self.max_attempts, now - self.ttl, max_items)).fetchall()
+            ids = [row['id'] for row in rows]
+            if ids:
+                marks = ','.join('?' * len(ids))
+                if visibility_timeout is None:
+                    conn.execute(f'DELETE FROM notification_queue WHERE id IN ({marks})', ids)
+                else:
+                    conn.execute(f'''UPDATE notification_queue SET visible_at = ?, attempts = attempts + 1
+                                     WHERE id IN ({marks})''', [now + visibility_timeout] + ids)
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return [dict(json.loads(row['payload']), id=row['id'], delivery_attempt=row['attempts'] + 1)
+                for row in rows]
+
+    def ack(self, user_id, ids=None, up_to=None):
+        """Confirmar notificaciones del usuario por id y/o todas con id <= up_to; retorna cuántas"""
+        conn = self._connect()
+        try:
+            removed = 0
+            if ids:
+                ids = [int(i) for i in ids]
+                marks = ','.join('?' * len(ids))
+                removed += conn.execute(f'DELETE FROM notification_queue WHERE user_id = ? AND id IN ({marks})',
+                                        [str(user_id)] + ids).rowcount
+            if up_to is not None:
+                removed += conn.execute('DELETE FROM notification_queue WHERE user_id = ? AND id <= ?',
+                                        (str(user_id), int(up_to))).rowcount
+            return removed
+        finally:
+            conn.close()
+
+    def has_pending(self, user_id):
+        """¿Hay alguna notificación visible para el usuario? (sin bloquear escrituras)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute('''SELECT 1 FROM notification_queue
+                                  WHERE user_id = ? AND visible_at <= ? AND attempts < ? AND created_at >= ?
+                                  LIMIT 1''',
+                               (str(user_id), now, self.max_attempts, now - self.ttl)).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def pending_count(self, user_id=None):
+        """Notificaciones sin confirmar (de un usuario o de todos)"""
+        conn = self._connect()
+        try:
+            if user_id is None:
+                return conn.execute('SELECT COUNT(*) FROM notification_queue WHERE attempts < ?',
+                                    (self.max_attempts,)).fetchone()[0]
+            return conn.execute('SELECT COUNT(*) FROM notification_queue WHERE user_id = ? AND attempts < ?',
+                                (str(user_id), self.max_attempts)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def stats(self):
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute('''SELECT COUNT(*) AS total,
+                                         SUM(CASE WHEN visible_at > ? THEN 1 ELSE 0 END) AS in_flight,
+                                         COUNT(DISTINCT user_id) AS users
+                                  FROM notification_queue WHERE attempts < ?''',
+                               (now, self.max_attempts)).fetchone()
+        finally:
+            conn.close()
+        return {
+            'backend': 'sqlite',
+            'pending': row['total'],
+            'in_flight': row['in_flight'] or 0,
+            'users': row['users']
+        }
+
+
+class WaiterSlot:
+    """Cupo reservado por una conexión en espera; release() es idempotente"""
+
+    def __init__(self, slots):
+        self._slots = slots
+        self._released = False
+
+    def release(self):
+        self._slots._release(self)
+
+
+class WaiterSlots:
+    """Límite de conexiones en espera del proceso (sin bloquear: sin cupo retorna None)
+
+    Evita que los clientes de SSE/long-poll inactivos ocupen todos los hilos
+    del worker y dejen en cola al resto de peticiones.
+    """
+
+    def __init__(self, limit=NOTIFICATION_MAX_WAITERS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit:
+                self.rejected += 1
+                return None
+            self.active += 1
+        return WaiterSlot(self)
+
+    def _release(self, slot):
+        with self._lock:
+            if not slot._released:
+                slot._released = True
+                self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'limit': self.limit, 'active': self.active, 'rejected': self.rejected}
+
+
+# Backends disponibles; otros (Redis, Postgres...) se registran con register_backend
+NOTIFICATION_QUEUE_BACKENDS = {
+    'sqlite': SQLiteNotificationQueue
+}
+
+
+def register_backend(name, backend_class):
+    NOTIFICATION_QUEUE_BACKENDS[name] = backend_class
+
+
+def create_notification_queue(backend=NOTIFICATION_QUEUE_BACKEND):
+    """Crear la cola configurada en NOTIFICATION_QUEUE_BACKEND"""
+    if backend not in NOTIFICATION_QUEUE_BACKENDS:
+        raise ValueError(f'Backend de cola desconocido: {backend}')
+    return NOTIFICATION_QUEUE_BACKENDS[backend]()
+
+
+# Instancias compartidas del proceso
+notification_queue = create_notification_queue()
+notification_waiters = WaiterSlots()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📒 PAYMENT LEDGER - REGISTRO LOCAL DE PAGOS
+⚡ El historial se sirve desde SQLite indexado; Square solo se consulta para conciliar
+"""
+
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+from http_client import env_int
+
+PAYMENT_LEDGER_DB = os.environ.get('PAYMENT_LEDGER_DB', 'payment_ledger.db')
+PAYMENT_HISTORY_PAGE_SIZE = env_int('PAYMENT_HISTORY_PAGE_SIZE', 50)
+PAYMENT_HISTORY_MAX_PAGE = env_int('PAYMENT_HISTORY_MAX_PAGE', 200)
+
+# Estados de Square en los que el reembolso ya cuenta
+REFUND_SETTLED = ('COMPLETED', 'PENDING')
+
+
+def utc_now_iso():
+    """Timestamp ISO en UTC con milisegundos, mismo formato que Square (ordenable como texto)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def money_amount(money):
+    """amount_money de Square (centavos) a dólares"""
+    return ((money or {}).get('amount') or 0) / 100
+
+
+def encode_cursor(row):
+    return '{}|{}'.format(row['created_at'], row['id'])
+
+
+def decode_cursor(cursor):
+    """Cursor 'created_at|id' de la página anterior; ValueError si es inválido"""
+    created_at, _, row_id = cursor.rpartition('|')
+    if not created_at:
+        raise ValueError('cursor inválido')
+    return created_at, int(row_id)
+
+
+class PaymentLedger:
+    """Pagos y reembolsos en SQLite (WAL), compartidos por todos los workers
+
+    - Los pagos se registran al crearlos en /api/payments/process (el enlace de
+      pago se identifica por su order_id hasta que Square asigna el payment_id).
+    - Los webhooks actualizan estado e importe; los eventos de Square se aplican
+      solo si son más recientes que lo guardado (updated_at de Square).
+    - reconcile() recorre el listado de Square para completar lo que falte.
+    """
+
+    def __init__(self, db_path=PAYMENT_LEDGER_DB):
+        self.db_path = db_path
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS payments
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, payment_id TEXT UNIQUE, link_id TEXT,
+                         order_id TEXT, user_id TEXT, email TEXT, amount REAL NOT NULL DEFAULT 0,
+                         refunded_amount REAL NOT NULL DEFAULT 0, currency TEXT, status TEXT NOT NULL,
+                         method TEXT, description TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL,
+                         square_updated_at TEXT)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id, created_at, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status, created_at, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_created ON payments (created_at, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS payment_refunds
+                        (refund_id TEXT PRIMARY KEY, payment_id TEXT NOT NULL, amount REAL NOT NULL DEFAULT 0,
+                         currency TEXT, status TEXT, reason TEXT, created_at TEXT NOT NULL, updated_at TEXT NOT NULL)''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_payment_refunds_payment ON payment_refunds (payment_id)')
+        conn.close()
+
+    # ===== ESCRITURA =====
+
+    def record_payment(self, user_id=None, amount=0, status='PENDING', payment_id=None, link_id=None,
+                       order_id=None, currency='USD', method=None, description=None, email=None):
+        """Registrar un pago recién creado por /api/payments/process"""
+        now = utc_now_iso()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            existing = self._find(conn, payment_id, order_id)
+            if existing is None:
+                conn.execute('''INSERT INTO payments (payment_id, link_id, order_id, user_id, email, amount, currency,
+                                status, method, description, created_at, updated_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             (payment_id, link_id, order_id, user_id, email, amount, currency, status, method,
+                              description, now, now))
+            else:
+                # El webhook llegó antes que la respuesta: completar los datos propios de la app
+                conn.execute('''UPDATE payments SET user_id = COALESCE(user_id, ?), email = COALESCE(email, ?),
+                                link_id = COALESCE(link_id, ?), method = COALESCE(method, ?),
+                                description = COALESCE(description, ?) WHERE id = ?''',
+                             (user_id, email, link_id, method, description, existing['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _find(self, conn, payment_id=None, order_id=None):
+        row = None
+        if payment_id:
+            row = conn.execute('SELECT * FROM payments WHERE payment_id = ?', (payment_id,)).fetchone()
+        if row is None and order_id:
+            row = conn.execute('SELECT * FROM payments WHERE order_id = ? ORDER BY id LIMIT 1', (order_id,)).fetchone()
+        return row
+
+    def apply_square_payment(self, payment):
+        """Aplicar un objeto 'payment' de Square (webhook o conciliación); True si cambió algo"""
+        payment_id = payment.get('id')
+        if not payment_id:
+            return False
+        square_updated_at = payment.get('updated_at') or utc_now_iso()
+        money = payment.get('amount_money') or {}
+        now = utc_now_iso()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = self._find(conn, payment_id, payment.get('order_id'))
+            if row is None:
+                conn.execute('''INSERT INTO payments (payment_id, order_id, email, amount, currency, status, method,
+                                description, created_at, updated_at, square_updated_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             (payment_id, payment.get('order_id'), payment.get('buyer_email_address'),
+                              money_amount(money), money.get('currency'), payment.get('status') or 'PENDING',
+                              payment.get('source_type'), payment.get('note'),
+                              payment.get('created_at') or now, now, square_updated_at))
+                changed = True
+            elif row['square_updated_at'] and row['square_updated_at'] > square_updated_at:
+                # Evento más viejo que lo que ya tenemos (reentrega tardía o conciliación)
+                changed = False
+            else:
+                status = payment.get('status') or row['status']
+                amount = money_amount(money) if money else row['amount']
+                changed = (row['payment_id'] != payment_id or row['status'] != status or row['amount'] != amount)
+                conn.execute('''UPDATE payments SET payment_id = ?, status = ?, amount = ?,
+                                currency = COALESCE(?, currency), email = COALESCE(email, ?),
+                                method = COALESCE(method, ?), updated_at = ?, square_updated_at = ?
+                                WHERE id = ?''',
+                             (payment_id, status, amount, money.get('currency'),
+                              payment.get('buyer_email_address'), payment.get('source_type'),
+                              now, square_updated_at, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return changed
+
+    def update_status(self, payment_id, status, amount=None):
+        """Actualizar estado (e importe) de un pago conocido; False si no existe"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''UPDATE payments SET status = ?, amount = COALESCE(?, amount), updated_at = ?
+                                     WHERE payment_id = ?''', (status, amount, utc_now_iso(), payment_id))
+        finally:
+            conn.close()
+        return cursor.rowcount > 0
+
+    def apply_square_refund(self, refund):
+        """Registrar/actualizar un reembolso de Square y recalcular lo reembolsado del pago"""
+        refund_id = refund.get('id')
+        payment_id = refund.get('payment_id')
+        if not refund_id or not payment_id:
+            return
+        money = refund.get('amount_money') or {}
+        now = utc_now_iso()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''INSERT INTO payment_refunds (refund_id, payment_id, amount, currency, status, reason,
+                            created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ON CONFLICT(refund_id) DO UPDATE SET status = excluded.status,
+                            amount = excluded.amount, updated_at = excluded.updated_at''',
+                         (refund_id, payment_id, money_amount(money), money.get('currency'), refund.get('status'),
+                          refund.get('reason'), refund.get('created_at') or now, now))
+            conn.execute('''UPDATE payments SET refunded_amount =
+                                (SELECT COALESCE(SUM(amount), 0) FROM payment_refunds
+                                 WHERE payment_id = ? AND status IN (?, ?)),
+                            updated_at = ? WHERE payment_id = ?''',
+                         (payment_id, REFUND_SETTLED[0], REFUND_SETTLED[1], now, payment_id))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def update_refund_status(self, refund_id, status):
+        """Actualizar el estado de un reembolso conocido; False si no existe"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM payment_refunds WHERE refund_id = ?', (refund_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return False
+        self.apply_square_refund({
+            'id': refund_id,
+            'payment_id': row['payment_id'],
+            'status': status,
+            'amount_money': {'amount': round(row['amount'] * 100), 'currency': row['currency']}
+        })
+        return True
+
+    # ===== LECTURA =====
+
+    def history(self, user_id=None, status=None, start_date=None, end_date=None,
+                limit=PAYMENT_HISTORY_PAGE_SIZE, cursor=None):
+        """Página del historial (más recientes primero) con filtros y cursor
+
+        Retorna 'transactions', 'total_count' (con los filtros, sin el cursor)
+        y 'next_cursor' (None en la última página).
+        """
+        limit = max(1, min(int(limit), PAYMENT_HISTORY_MAX_PAGE))
+        where, params = [], []
+        if user_id:
+            where.append('user_id = ?')
+            params.append(user_id)
+        if status:
+            statuses = [s.strip().upper() for s in status.split(',') if s.strip()]
+            where.append('status IN ({})'.format(','.join('?' * len(statuses))))
+            params.extend(statuses)
+        if start_date:
+            where.append('created_at >= ?')
+            params.append(start_date)
+        if end_date:
+            # Una fecha sola (YYYY-MM-DD) incluye todo ese día
+            where.append('created_at <= ?')
+            params.append(end_date + 'T23:59:59.999Z' if len(end_date) == 10 else end_date)
+
+        page_where, page_params = list(where), list(params)
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            page_where.append('(created_at < ? OR (created_at = ? AND id < ?))')
+            page_params.extend([created_at, created_at, row_id])
+
+        def clause(conditions):
+            return ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT * FROM payments {} ORDER BY created_at DESC, id DESC LIMIT ?'.format(
+                clause(page_where)), page_params + [limit + 1]).fetchall()
+            total = conn.execute('SELECT COUNT(*) FROM payments {}'.format(clause(where)), params).fetchone()[0]
+        finally:
+            conn.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'transactions': [self._to_transaction(row) for row in rows],
+            'total_count': total,
+            'next_cursor': encode_cursor(rows[-1]) if has_more else None
+        }
+
+    def _to_transaction(self, row):
+        return {
+            'id': row['payment_id'] or row['link_id'],
+            'payment_id': row['payment_id'],
+            'order_id': row['order_id'],
+            'user_id': row['user_id'],
+            'status': row['status'],
+            'amount': row['amount'],
+            'refunded_amount': row['refunded_amount'],
+            'currency': row['currency'],
+            'method': row['method'],
+            'description': row['description'],
+            'buyer_email': row['email'],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at']
+        }
+
+    # ===== CONCILIACIÓN =====
+
+    def reconcile(self, square_client, start_date=None, end_date=None):
+        """Completar el ledger con el listado de pagos de Square; retorna el resumen"""
+        result = square_client.get_transaction_history(start_date, end_date)
+        if not result['success']:
+            return result
+        updated = 0
+        for transaction in result['transactions']:
+            payment = {
+                'id': transaction['id'],
+                'status': transaction['status'],
+                'order_id': transaction.get('order_id'),
+                'buyer_email_address': transaction.get('buyer_email'),
+                'note': transaction.get('note'),
+                'created_at': transaction.get('created_at'),
+                'updated_at': transaction.get('updated_at')
+            }
+            if transaction.get('amount') is not None:
+                payment['amount_money'] = {'amount': round(transaction['amount'] * 100),
+                                           'currency': transaction.get('currency')}
+            if self.apply_square_payment(payment):
+                updated += 1
+        print(f"📒 Conciliación con Square: {result['total_count']} pagos revisados, {updated} actualizados")
+        return {'success': True, 'checked': result['total_count'], 'updated': updated}
+
+
+# Ledger compartido del proceso
+payment_ledger = PaymentLedger()
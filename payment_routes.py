@@ -4,8 +4,11 @@
 Rutas de pagos para Cubalink23 con integración Square
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from square_service import square_service
+from idempotency import idempotent
+from payment_ledger import payment_ledger, PAYMENT_HISTORY_PAGE_SIZE
+from auth_routes import require_auth
 import uuid
 from datetime import datetime
 import json
@@ -13,6 +16,7 @@ import json
 payment_bp = Blueprint('payment', __name__, url_prefix='/api/payments')
 
 @payment_bp.route('/process', methods=['POST'])
+@idempotent('payments.process')
 def process_payment():
     """Procesar pago con Square API - Soporta tanto Payment Links como Nonce"""
     try:
@@ -50,12 +54,22 @@ def _process_payment_with_nonce(data):
             'nonce': data['nonce'],
             'amount': float(data['amount']),
             'description': data.get('description', 'Recarga Cubalink23'),
-            'location_id': data['location_id']
+            'location_id': data['location_id'],
+            'idempotency_key': g.idempotency_key
         }
         
         result = square_service.process_payment_with_nonce(payment_data)
         
         if result['success']:
+            payment_ledger.record_payment(
+                user_id=data.get('user_id'),
+                amount=payment_data['amount'],
+                status=result['status'],
+                payment_id=result['transaction_id'],
+                method='CARD',
+                description=payment_data['description'],
+                email=data.get('email')
+            )
             return jsonify({
                 'success': True,
                 'transaction_id': result['transaction_id'],
@@ -92,12 +106,24 @@ def _process_payment_with_links(data):
         payment_data = {
             'amount': float(data['amount']),
             'description': f'Recarga Cubalink23 - ${data["amount"]}',
-            'email': data['email']
+            'email': data['email'],
+            'idempotency_key': g.idempotency_key
         }
         
         result = square_service.process_real_payment(payment_data)
         
         if result['success']:
+            # El payment_id llega después por webhook; hasta entonces se enlaza por order_id
+            payment_ledger.record_payment(
+                user_id=data.get('user_id'),
+                amount=payment_data['amount'],
+                status=result['status'],
+                link_id=result['transaction_id'],
+                order_id=result.get('order_id'),
+                method='PAYMENT_LINK',
+                description=payment_data['description'],
+                email=data['email']
+            )
             return jsonify({
                 'success': True,
                 'transaction_id': result['transaction_id'],
@@ -170,6 +196,13 @@ def refund_payment():
         result = square_service.refund_payment(payment_id, amount, reason)
         
         if result['success']:
+            payment_ledger.apply_square_refund({
+                'id': result['refund_id'],
+                'payment_id': payment_id,
+                'status': result['status'],
+                'reason': result['reason'],
+                'amount_money': {'amount': round(result['amount'] * 100), 'currency': result['currency']}
+            })
             return jsonify({
                 'success': True,
                 'refund_id': result['refund_id'],
@@ -195,33 +228,57 @@ def refund_payment():
 
 @payment_bp.route('/history', methods=['GET'])
 def get_payment_history():
-    """Obtener historial de pagos"""
+    """Obtener historial de pagos desde el ledger local
+
+    Filtros: user_id, status (lista separada por comas), start_date, end_date.
+    Paginación: limit y cursor (next_cursor de la página anterior).
+    """
     try:
-        user_id = request.args.get('user_id')
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
+        try:
+            result = payment_ledger.history(
+                user_id=request.args.get('user_id'),
+                status=request.args.get('status'),
+                start_date=request.args.get('start_date'),
+                end_date=request.args.get('end_date'),
+                limit=request.args.get('limit', PAYMENT_HISTORY_PAGE_SIZE, type=int),
+                cursor=request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': f'Parámetros inválidos: {e}'
+            }), 400
         
-        # Obtener historial de transacciones
-        result = square_service.get_transaction_history(start_date, end_date)
+        return jsonify({
+            'success': True,
+            'transactions': result['transactions'],
+            'total_count': result['total_count'],
+            'next_cursor': result['next_cursor']
+        })
+            
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Error interno del servidor',
+            'details': str(e)
+        }), 500
+
+@payment_bp.route('/reconcile', methods=['POST'])
+@require_auth
+def reconcile_payments():
+    """Conciliar el ledger local con el listado de pagos de Square"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = payment_ledger.reconcile(square_service, data.get('start_date'), data.get('end_date'))
         
         if result['success']:
-            # Filtrar por usuario si se especifica
-            transactions = result['transactions']
-            if user_id:
-                # En un sistema real, filtrarías por user_id desde la base de datos
-                pass
-            
-            return jsonify({
-                'success': True,
-                'transactions': transactions,
-                'total_count': result['total_count']
-            })
+            return jsonify(result)
         else:
             return jsonify({
                 'success': False,
-                'error': 'Error obteniendo historial',
+                'error': 'Error conciliando con Square',
                 'details': result.get('error', 'Error desconocido')
-            }), 500
+            }), 502
             
     except Exception as e:
         return jsonify({
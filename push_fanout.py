@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📣 PUSH FANOUT - DIFUSIÓN DE NOTIFICACIONES PUSH
+🧵 Expande un broadcast en lotes de usuarios y los envía con un pool de hilos acotado
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from http_client import env_int
+from notification_queue import notification_queue
+
+PUSH_PROVIDER = os.environ.get('PUSH_PROVIDER', 'queue')
+PUSH_FANOUT_DB = os.environ.get('PUSH_FANOUT_DB', 'push_fanout.db')
+PUSH_FANOUT_WORKERS = env_int('PUSH_FANOUT_WORKERS', 8)
+# Usuarios por lote (también es el tamaño de página al leer la tabla users)
+PUSH_FANOUT_CHUNK_SIZE = env_int('PUSH_FANOUT_CHUNK_SIZE', 500)
+# Historial de broadcasts que se conserva (segundos)
+PUSH_BROADCAST_TTL = env_int('PUSH_BROADCAST_TTL', 7 * 24 * 3600)
+# Un broadcast 'running' sin avances en este tiempo se da por interrumpido
+PUSH_BROADCAST_STALE_TIMEOUT = env_int('PUSH_BROADCAST_STALE_TIMEOUT', 300)
+# Reintentos al leer una página de users antes de marcar el broadcast como error
+PUSH_FANOUT_PAGE_RETRIES = env_int('PUSH_FANOUT_PAGE_RETRIES', 3)
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETE = 'complete'
+STATUS_ERROR = 'error'
+
+# Audiencia que expande el broadcast a toda la tabla users
+BROADCAST_ALL = 'all'
+
+
+class PushProvider:
+    """Interfaz de los proveedores de envío
+
+    send_batch(notification, user_ids) entrega la notificación a un lote de
+    usuarios y retorna (enviadas, fallidas).
+    """
+
+    name = 'base'
+
+    def send_batch(self, notification, user_ids):
+        raise NotImplementedError
+
+
+class QueuePushProvider(PushProvider):
+    """Entrega por la cola de la app (long-poll / SSE / ?max=N)"""
+
+    name = 'queue'
+
+    def __init__(self, queue=None):
+        self.queue = queue or notification_queue
+
+    def send_batch(self, notification, user_ids):
+        sent = self.queue.enqueue_many(notification, user_ids)
+        return sent, len(user_ids) - sent
+
+
+class FakePushProvider(PushProvider):
+    """Proveedor local para pruebas: guarda los envíos en memoria
+
+    latency simula el tiempo de respuesta por lote y fail_user_ids los
+    usuarios cuyo envío debe fallar.
+    """
+
+    name = 'fake'
+
+    def __init__(self, latency=0.0, fail_user_ids=None):
+        self.latency = latency
+        self.fail_user_ids = {str(u) for u in (fail_user_ids or ())}
+        self.deliveries = []
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def send_batch(self, notification, user_ids):
+        if self.latency:
+            time.sleep(self.latency)
+        delivered = [str(u) for u in user_ids if str(u) not in self.fail_user_ids]
+        with self._lock:
+            self.batches += 1
+            self.deliveries.extend((user_id, notification.get('title')) for user_id in delivered)
+        return len(delivered), len(user_ids) - len(delivered)
+
+
+# Proveedores disponibles; FCM/OneSignal se registran con register_provider
+PUSH_PROVIDERS = {
+    'queue': QueuePushProvider,
+    'fake': FakePushProvider
+}
+
+
+def register_provider(name, provider_class):
+    PUSH_PROVIDERS[name] = provider_class
+
+
+def create_push_provider(name=PUSH_PROVIDER):
+    if name not in PUSH_PROVIDERS:
+        raise ValueError(f'Proveedor push desconocido: {name}')
+    return PUSH_PROVIDERS[name]()
+
+
+def get_target_user_ids(data):
+    """Destinatarios del body (user_ids o user_id); None significa todos los usuarios
+
+    Solo se envía a todos con type='all' o target='all' explícitos: un body sin
+    destinatarios ni audiencia lanza ValueError en vez de convertirse en broadcast.
+    """
+    if data.get('user_ids'):
+        return [str(user_id) for user_id in data['user_ids']]
+    if data.get('user_id'):
+        return [str(data['user_id'])]
+    if data.get('type') == BROADCAST_ALL or data.get('target') == BROADCAST_ALL:
+        return None
+    raise ValueError("Se requiere user_id o user_ids (o type/target 'all' para enviar a todos los usuarios)")
+
+
+def iter_user_id_chunks(chunk_size=PUSH_FANOUT_CHUNK_SIZE, retries=PUSH_FANOUT_PAGE_RETRIES):
+    """Recorrer la tabla users por páginas (cursor por id) sin cargarla entera
+
+    Un error de Supabase (throttling, 5xx, red) se reintenta con espera creciente;
+    si persiste se lanza para que el broadcast quede en error y no 'complete' a medias.
+    """
+    import requests
+    from supabase_service import supabase_service, SupabaseError
+
+    cursor = None
+    while True:
+        for attempt in range(retries + 1):
+            try:
+                page = supabase_service.get_page('users', select='id', order='id.asc', limit=chunk_size,
+                                                 cursor=cursor, raise_errors=True)
+                break
+            except (SupabaseError, requests.RequestException) as e:
+                permanent = isinstance(e, SupabaseError) and e.status_code not in (None, 429) and e.status_code < 500
+                if attempt == retries or permanent:
+                    raise
+                print(f"⚠️ Fan-out: error leyendo usuarios ({e}), reintento {attempt + 1}/{retries}")
+                time.sleep(2 ** attempt)
+        user_ids = [row['id'] for row in page['data'] if row.get('id') is not None]
+        if user_ids:
+            yield user_ids
+        cursor = page['next_cursor']
+        if cursor is None:
+            return
+
+
+class BroadcastEngine:
+    """Motor de difusión: un hilo planificador por broadcast que expande los
+    destinatarios por lotes y un pool acotado compartido que los envía.
+
+    El progreso (lotes, enviadas, fallidas, throughput) se guarda en SQLite para
+    que cualquier worker pueda responder al endpoint de estado.
+    """
+
+    def __init__(self, provider=None, db_path=PUSH_FANOUT_DB, max_workers=PUSH_FANOUT_WORKERS,
+                 chunk_size=PUSH_FANOUT_CHUNK_SIZE, recipient_chunks=iter_user_id_chunks):
+        self.provider = provider or create_push_provider()
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.recipient_chunks = recipient_chunks
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS push_broadcasts
+                        (id TEXT PRIMARY KEY, status TEXT NOT NULL, provider TEXT NOT NULL,
+                         notification TEXT NOT NULL, total_chunks INTEGER, done_chunks INTEGER NOT NULL DEFAULT 0,
+                         recipients INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0,
+                         failed INTEGER NOT NULL DEFAULT 0, error TEXT, created_at REAL NOT NULL,
+                         updated_at REAL NOT NULL, finished_at REAL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS push_broadcast_chunks
+                        (broadcast_id TEXT NOT NULL, chunk_index INTEGER NOT NULL, recipients INTEGER NOT NULL,
+                         sent INTEGER NOT NULL, failed INTEGER NOT NULL, duration_ms INTEGER NOT NULL,
+                         error TEXT, PRIMARY KEY (broadcast_id, chunk_index))''')
+        conn.commit()
+        conn.close()
+
+    @property
+    def executor(self):
+        # Cada proceso (worker WSGI) necesita su propio pool de hilos
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix='push-fanout')
+                    self._executor_pid = pid
+        return self._executor
+
+    def start(self, notification, user_ids=None):
+        """Registrar un broadcast y lanzarlo en segundo plano; retorna su id
+
+        Sin user_ids se envía a todos los usuarios de la tabla users.
+        """
+        broadcast_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute('DELETE FROM push_broadcast_chunks WHERE broadcast_id IN '
+                     '(SELECT id FROM push_broadcasts WHERE created_at < ?)', (now - PUSH_BROADCAST_TTL,))
+        conn.execute('DELETE FROM push_broadcasts WHERE created_at < ?', (now - PUSH_BROADCAST_TTL,))
+        conn.execute('''INSERT INTO push_broadcasts (id, status, provider, notification, created_at, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     (broadcast_id, STATUS_PENDING, self.provider.name, json.dumps(notification), now, now))
+        conn.commit()
+        conn.close()
+
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            chunks = (user_ids[i:i + self.chunk_size] for i in range(0, len(user_ids), self.chunk_size))
+        else:
+            chunks = self.recipient_chunks(self.chunk_size)
+        threading.Thread(target=self._run, args=(broadcast_id, notification, chunks),
+                         name=f'push-broadcast-{broadcast_id[:8]}', daemon=True).start()
+        return broadcast_id
+
+    def _run(self, broadcast_id, notification, chunks):
+        self._update(broadcast_id, status=STATUS_RUNNING)
+        # Como mucho 2 lotes por hilo en espera: la expansión no se adelanta al envío
+        slots = threading.Semaphore(self.max_workers * 2)
+        futures = []
+        chunk_index = 0
+        try:
+            for user_ids in chunks:
+                slots.acquire()
+                future = self.executor.submit(self._send_chunk, broadcast_id, chunk_index, notification, user_ids)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+                chunk_index += 1
+            self._update(broadcast_id, total_chunks=chunk_index)
+            wait(futures)
+            self._update(broadcast_id, status=STATUS_COMPLETE, finished_at=time.time())
+            print(f"📣 Broadcast {broadcast_id} completado: {chunk_index} lotes")
+        except Exception as e:
+            print(f"❌ Error en broadcast {broadcast_id}: {e}")
+            wait(futures)
+            self._update(broadcast_id, status=STATUS_ERROR, error=str(e), total_chunks=chunk_index,
+                         finished_at=time.time())
+
+    def _send_chunk(self, broadcast_id, chunk_index, notification, user_ids):
+        started = time.monotonic()
+        error = None
+        try:
+            sent, failed = self.provider.send_batch(notification, user_ids)
+        except Exception as e:
+            print(f"⚠️ Broadcast {broadcast_id}: lote {chunk_index} falló: {e}")
+            sent, failed, error = 0, len(user_ids), str(e)
+        duration_ms = int((time.monotonic() - started) * 1000)
+
+        conn = self._connect()
+        conn.execute('''INSERT OR REPLACE INTO push_broadcast_chunks
+                        (broadcast_id, chunk_index, recipients, sent, failed, duration_ms, error)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     (broadcast_id, chunk_index, len(user_ids), sent, failed, duration_ms, error))
+        conn.execute('''UPDATE push_broadcasts SET done_chunks = done_chunks + 1, recipients = recipients + ?,
+                        sent = sent + ?, failed = failed + ?, updated_at = ? WHERE id = ?''',
+                     (len(user_ids), sent, failed, time.time(), broadcast_id))
+        conn.commit()
+        conn.close()
+
+    def _update(self, broadcast_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{column} = ?' for column in fields)
+        conn = self._connect()
+        conn.execute(f'UPDATE push_broadcasts SET {assignments} WHERE id = ?', list(fields.values()) + [broadcast_id])
+        conn.commit()
+        conn.close()
+
+    def get(self, broadcast_id, include_chunks=False):
+        """Estado y progreso de un broadcast (None si no existe)"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM push_broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        chunks = []
+        if row is not None and include_chunks:
+            chunks = [dict(c) for c in conn.execute('''SELECT chunk_index, recipients, sent, failed, duration_ms, error
+                                                       FROM push_broadcast_chunks WHERE broadcast_id = ?
+                                                       ORDER BY chunk_index''', (broadcast_id,))]
+        conn.close()
+        if row is None:
+            return None
+
+        status = row['status']
+        error = row['error']
+        if status in (STATUS_PENDING, STATUS_RUNNING) and \
+                row['updated_at'] < time.time() - PUSH_BROADCAST_STALE_TIMEOUT:
+            status, error = STATUS_ERROR, 'El broadcast se interrumpió'
+        elapsed = (row['finished_at'] or time.time()) - row['created_at']
+        result = {
+            'broadcast_id': row['id'],
+            'status': status,
+            'provider': row['provider'],
+            'notification': json.loads(row['notification']),
+            'total_chunks': row['total_chunks'],
+            'done_chunks': row['done_chunks'],
+            'recipients': row['recipients'],
+            'sent': row['sent'],
+            'failed': row['failed'],
+            'error': error,
+            'elapsed_seconds': round(elapsed, 3),
+            'recipients_per_second': round(row['recipients'] / elapsed, 1) if elapsed > 0 else None,
+            'created_at': row['created_at'],
+            'finished_at': row['finished_at']
+        }
+        if include_chunks:
+            result['chunks'] = chunks
+        return result
+
+
+# Instancia compartida del proceso
+broadcast_engine = BroadcastEngine()
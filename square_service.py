@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+💳 SQUARE SERVICE - CLIENTE DE LA API DE SQUARE
+🔗 Configuración, headers y sesión HTTP se preparan una sola vez al arrancar
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import uuid
+
+from http_client import create_pooled_session, env_int, env_float, SharedSession
+
+SQUARE_ACCESS_TOKEN = os.environ.get('SQUARE_ACCESS_TOKEN')
+SQUARE_APPLICATION_ID = os.environ.get('SQUARE_APPLICATION_ID')
+SQUARE_LOCATION_ID = os.environ.get('SQUARE_LOCATION_ID')
+SQUARE_ENVIRONMENT = os.environ.get('SQUARE_ENVIRONMENT', 'sandbox')
+SQUARE_VERSION = os.environ.get('SQUARE_VERSION', '2023-10-18')
+SQUARE_CURRENCY = os.environ.get('SQUARE_CURRENCY', 'USD')
+SQUARE_WEBHOOK_SECRET = os.environ.get('SQUARE_WEBHOOK_SECRET', '')
+# URL pública registrada en Square para el webhook (detrás de un proxy request.url puede no coincidir)
+SQUARE_WEBHOOK_URL = os.environ.get('SQUARE_WEBHOOK_URL')
+
+SQUARE_POOL_CONNECTIONS = env_int('SQUARE_POOL_CONNECTIONS', 4)
+SQUARE_POOL_MAXSIZE = env_int('SQUARE_POOL_MAXSIZE', 10)
+SQUARE_CONNECT_TIMEOUT = env_float('SQUARE_CONNECT_TIMEOUT', 5)
+SQUARE_READ_TIMEOUT = env_float('SQUARE_READ_TIMEOUT', 20)
+# Solo se reintentan los GET; los POST llevan idempotency_key y los reintenta el cliente
+SQUARE_RETRIES = env_int('SQUARE_RETRIES', 2)
+# Páginas máximas al listar pagos (100 pagos por página)
+SQUARE_HISTORY_MAX_PAGES = env_int('SQUARE_HISTORY_MAX_PAGES', 10)
+
+SQUARE_URLS = {
+    'production': 'https://connect.squareup.com',
+    'sandbox': 'https://connect.squareupsandbox.com'
+}
+
+PAYMENT_METHODS = [
+    {'id': 'card', 'name': 'Tarjeta de crédito/débito', 'enabled': True},
+    {'id': 'apple_pay', 'name': 'Apple Pay', 'enabled': True},
+    {'id': 'google_pay', 'name': 'Google Pay', 'enabled': True}
+]
+
+_shared_session = SharedSession(lambda: create_pooled_session(
+    pool_connections=SQUARE_POOL_CONNECTIONS,
+    pool_maxsize=SQUARE_POOL_MAXSIZE,
+    connect_timeout=SQUARE_CONNECT_TIMEOUT,
+    read_timeout=SQUARE_READ_TIMEOUT,
+    retries=SQUARE_RETRIES
+))
+
+
+def to_cents(amount):
+    """Convertir un monto en dólares a centavos (entero)"""
+    return int(round(float(amount) * 100))
+
+
+def square_error(response):
+    """Mensaje legible a partir de la respuesta de error de Square"""
+    try:
+        errors = response.json().get('errors') or []
+    except ValueError:
+        errors = []
+    if errors:
+        return '; '.join('{}: {}'.format(e.get('code'), e.get('detail')) for e in errors)
+    return f'HTTP {response.status_code}: {response.text[:200]}'
+
+
+class SquareService:
+    def __init__(self):
+        self.access_token = SQUARE_ACCESS_TOKEN
+        self.application_id = SQUARE_APPLICATION_ID
+        self.location_id = SQUARE_LOCATION_ID
+        self.environment = SQUARE_ENVIRONMENT if SQUARE_ENVIRONMENT in SQUARE_URLS else 'sandbox'
+        self.base_url = SQUARE_URLS[self.environment]
+        self.webhook_secret = SQUARE_WEBHOOK_SECRET
+        self.headers = {
+            'Square-Version': SQUARE_VERSION,
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+        print(f"💳 Square Service inicializado: {self.environment} ({'✅ Configurado' if self.is_available() else '❌ No configurado'})")
+
+    @property
+    def session(self):
+        """Sesión HTTP con keep-alive compartida por todo el proceso"""
+        return _shared_session.get()
+
+    def is_available(self):
+        """Credenciales completas (no hace llamadas a la API)"""
+        return all([self.access_token, self.application_id, self.location_id])
+
+    def _result_error(self, response):
+        return {'success': False, 'error': square_error(response), 'status_code': response.status_code}
+
+    def process_real_payment(self, payment_data):
+        """Crear un Payment Link (checkout alojado por Square)"""
+        if not self.is_available():
+            return {'success': False, 'error': 'Square API no está configurado correctamente'}
+        body = {
+            'idempotency_key': payment_data.get('idempotency_key') or uuid.uuid4().hex,
+            'order': {
+                'location_id': self.location_id,
+                'line_items': [{
+                    'name': payment_data.get('description') or 'Recarga de Saldo',
+                    'quantity': '1',
+                    'item_type': 'ITEM',
+                    'base_price_money': {
+                        'amount': to_cents(payment_data['amount']),
+                        'currency': SQUARE_CURRENCY
+                    }
+                }]
+            }
+        }
+        if payment_data.get('email'):
+            body['pre_populated_data'] = {'buyer_email': payment_data['email']}
+
+        response = self.session.post(f'{self.base_url}/v2/online-checkout/payment-links',
+                                     headers=self.headers, json=body)
+        if response.status_code != 200:
+            return self._result_error(response)
+        payment_link = response.json().get('payment_link', {})
+        return {
+            'success': True,
+            'transaction_id': payment_link.get('id'),
+            'order_id': payment_link.get('order_id'),
+            'checkout_url': payment_link.get('url') or payment_link.get('long_url'),
+            'status': 'PENDING',
+            'message': 'Payment Link creado exitosamente'
+        }
+
+    def process_payment_with_nonce(self, payment_data):
+        """Cobrar con el nonce (source_id) generado por el SDK de Square"""
+        if not self.is_available():
+            return {'success': False, 'error': 'Square API no está configurado correctamente'}
+        body = {
+            'source_id': payment_data['nonce'],
+            'idempotency_key': payment_data.get('idempotency_key') or uuid.uuid4().hex,
+            'amount_money': {'amount': to_cents(payment_data['amount']), 'currency': SQUARE_CURRENCY},
+            'location_id': payment_data.get('location_id') or self.location_id,
+            'note': payment_data.get('description', 'Recarga Cubalink23')
+        }
+        response = self.session.post(f'{self.base_url}/v2/payments', headers=self.headers, json=body)
+        if response.status_code != 200:
+            return self._result_error(response)
+        payment = response.json().get('payment', {})
+        return {
+            'success': True,
+            'transaction_id': payment.get('id'),
+            'status': payment.get('status'),
+            'message': 'Pago procesado exitosamente'
+        }
+
+    def get_payment_status(self, payment_id):
+        """Estado actual de un pago"""
+        response = self.session.get(f'{self.base_url}/v2/payments/{payment_id}', headers=self.headers)
+        if response.status_code != 200:
+            return self._result_error(response)
+        payment = response.json().get('payment', {})
+        money = payment.get('amount_money') or {}
+        return {
+            'success': True,
+            'payment_id': payment.get('id'),
+            'status': payment.get('status'),
+            'amount': (money.get('amount') or 0) / 100,
+            'currency': money.get('currency'),
+            'created_at': payment.get('created_at'),
+            'updated_at': payment.get('updated_at')
+        }
+
+    def refund_payment(self, payment_id, amount=None, reason='Customer request', idempotency_key=None):
+        """Reembolsar un pago completo o parcial"""
+        if amount is None:
+            status = self.get_payment_status(payment_id)
+            if not status['success']:
+                return status
+            amount = status['amount']
+        body = {
+            'idempotency_key': idempotency_key or uuid.uuid4().hex,
+            'payment_id': payment_id,
+            'amount_money': {'amount': to_cents(amount), 'currency': SQUARE_CURRENCY},
+            'reason': reason
+        }
+        response = self.session.post(f'{self.base_url}/v2/refunds', headers=self.headers, json=body)
+        if response.status_code != 200:
+            return self._result_error(response)
+        refund = response.json().get('refund', {})
+        money = refund.get('amount_money') or {}
+        return {
+            'success': True,
+            'refund_id': refund.get('id'),
+            'status': refund.get('status'),
+            'amount': (money.get('amount') or 0) / 100,
+            'currency': money.get('currency'),
+            'reason': refund.get('reason', reason)
+        }
+
+    def get_transaction_history(self, start_date=None, end_date=None):
+        """Listar pagos de la location (siguiendo el cursor hasta SQUARE_HISTORY_MAX_PAGES)"""
+        params = {'location_id': self.location_id, 'sort_order': 'DESC', 'limit': 100}
+        if start_date:
+            params['begin_time'] = start_date
+        if end_date:
+            params['end_time'] = end_date
+
+        transactions = []
+        for _ in range(SQUARE_HISTORY_MAX_PAGES):
+            response = self.session.get(f'{self.base_url}/v2/payments', headers=self.headers, params=params)
+            if response.status_code != 200:
+                return self._result_error(response)
+            data = response.json()
+            for payment in data.get('payments', []):
+                money = payment.get('amount_money') or {}
+                transactions.append({
+                    'id': payment.get('id'),
+                    'status': payment.get('status'),
+                    'amount': (money.get('amount') or 0) / 100,
+                    'currency': money.get('currency'),
+                    'created_at': payment.get('created_at'),
+                    'updated_at': payment.get('updated_at'),
+                    'order_id': payment.get('order_id'),
+                    'buyer_email': payment.get('buyer_email_address'),
+                    'note': payment.get('note')
+                })
+            if not data.get('cursor'):
+                break
+            params['cursor'] = data['cursor']
+        return {'success': True, 'transactions': transactions, 'total_count': len(transactions)}
+
+    def get_payment_methods(self):
+        return PAYMENT_METHODS
+
+    def verify_webhook_signature(self, body, url, signature, sha256_signature=None):
+        """Verificar la firma de un webhook (HMAC en base64 sobre url + body)
+
+        Square envía x-square-hmacsha256-signature (SHA-256) y, en suscripciones
+        antiguas, X-Square-Signature (SHA-1).
+        """
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        message = ((SQUARE_WEBHOOK_URL or url) + body).encode('utf-8')
+        key = self.webhook_secret.encode('utf-8')
+        if sha256_signature:
+            expected = base64.b64encode(hmac.new(key, message, hashlib.sha256).digest()).decode('ascii')
+            return hmac.compare_digest(sha256_signature, expected)
+        if signature:
+            expected = base64.b64encode(hmac.new(key, message, hashlib.sha1).digest()).decode('ascii')
+            return hmac.compare_digest(signature, expected)
+        return False
+
+
+# Cliente compartido por admin_server, payment_routes y webhook_routes
+square_service = SquareService()
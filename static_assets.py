@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📦 STATIC ASSETS - ARCHIVOS SUBIDOS CON URL POR CONTENIDO
+♾️ /assets/<hash>/<archivo> nunca cambia de contenido: caché de un año e immutable,
+   con ETag y Range (send_from_directory condicional)
+"""
+
+import os
+import re
+
+from flask import abort, send_from_directory
+
+from http_client import env_int
+from image_pipeline import IMAGE_UPLOAD_DIR, IMAGE_URL_PREFIX
+
+ASSET_MAX_AGE = env_int('ASSET_MAX_AGE', 365 * 24 * 3600)
+
+_DIGEST_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def init_static_assets(app, directory=IMAGE_UPLOAD_DIR, url_prefix=IMAGE_URL_PREFIX):
+    """Registrar la ruta de assets direccionados por contenido en la app Flask"""
+    directory = os.path.abspath(directory)
+
+    @app.route(f'{url_prefix.rstrip("/")}/<digest>/<path:filename>')
+    def hashed_asset(digest, filename):
+        if not _DIGEST_RE.match(digest):
+            abort(404)
+        response = send_from_directory(os.path.join(directory, digest), filename,
+                                       max_age=ASSET_MAX_AGE, conditional=True, etag=True)
+        # La URL cambia si cambia el contenido: el cliente no necesita revalidar nunca
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    return app
@@ -5,10 +5,128 @@
 🌐 Servicio para conectar con Supabase desde el panel de administración
 """
 
+import base64
+import json
 import os
-import requests
+import re
 from datetime import datetime
 
+from http_client import create_pooled_session, env_int, env_float, SharedSession
+
+# Configuración del pool HTTP hacia Supabase (compartido por todas las instancias)
+SUPABASE_POOL_CONNECTIONS = env_int('SUPABASE_POOL_CONNECTIONS', 10)
+SUPABASE_POOL_MAXSIZE = env_int('SUPABASE_POOL_MAXSIZE', 20)
+SUPABASE_CONNECT_TIMEOUT = env_float('SUPABASE_CONNECT_TIMEOUT', 5)
+SUPABASE_READ_TIMEOUT = env_float('SUPABASE_READ_TIMEOUT', 20)
+SUPABASE_RETRIES = env_int('SUPABASE_RETRIES', 2)
+
+# Paginación de listados (PostgREST)
+SUPABASE_MAX_PAGE_SIZE = env_int('SUPABASE_MAX_PAGE_SIZE', 1000)
+SUPABASE_COUNT_MODE = os.getenv('SUPABASE_COUNT_MODE', 'exact')  # exact | planned | estimated
+
+_COLUMN_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_ORDER_RE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*)(?:\.(asc|desc))?(?:\.(nullsfirst|nullslast))?$')
+
+
+def parse_select(select):
+    """Validar una proyección de columnas 'col1,col2' para PostgREST"""
+    if not select or select == '*':
+        return None
+    columns = [c.strip() for c in select.split(',') if c.strip()]
+    for column in columns:
+        if not _COLUMN_RE.match(column):
+            raise ValueError(f'Columna inválida en select: {column}')
+    return columns
+
+
+def parse_order(order):
+    """Validar un orden 'columna.asc|desc' y retornar (columna, dirección, sufijo)"""
+    match = _ORDER_RE.match(order or '')
+    if not match:
+        raise ValueError(f'Orden inválido: {order}')
+    column, direction, nulls = match.groups()
+    return column, direction or 'asc', nulls
+
+
+def parse_content_range(value):
+    """Extraer el total de un header Content-Range de PostgREST ('0-49/1234')"""
+    if not value or '/' not in value:
+        return None
+    total = value.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
+
+class SupabaseError(Exception):
+    """Respuesta de error de Supabase (PostgREST)"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def encode_cursor(value, row_id):
+    """Cursor opaco (valor de la columna de orden, id) para paginar sin perder empates"""
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor; retorna (valor, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError(f'Cursor inválido: {cursor}')
+    if row_id is None:
+        raise ValueError(f'Cursor inválido: {cursor}')
+    return value, row_id
+
+
+def _filter_value(value):
+    """Valor entre comillas para los filtros anidados de or=(...) de PostgREST"""
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def keyset_filter(column, direction, nulls, value, row_id):
+    """Filtro or=(...) con las filas posteriores a (value, row_id) en el orden 'column, id'
+
+    El id desempata las filas con el mismo valor en la columna de orden y los
+    NULL se ubican como en Postgres (últimos en asc, primeros en desc, o según nulls).
+    """
+    op = 'lt' if direction == 'desc' else 'gt'
+    nulls_first = nulls == 'nullsfirst' or (nulls is None and direction == 'desc')
+    tie = f'id.{op}.{_filter_value(row_id)}'
+    if value is None:
+        conditions = [f'and({column}.is.null,{tie})']
+        if nulls_first:
+            conditions.append(f'{column}.not.is.null')
+    else:
+        quoted = _filter_value(value)
+        conditions = [f'{column}.{op}.{quoted}', f'and({column}.eq.{quoted},{tie})']
+        if not nulls_first:
+            conditions.append(f'{column}.is.null')
+    return '({})'.format(','.join(conditions))
+
+def parse_timestamp(value):
+    """Convertir un timestamp ISO 8601 de Supabase ('...Z' o '+00:00') a datetime"""
+    value = str(value).strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Timestamp inválido: {value}')
+
+_shared_session = SharedSession(lambda: create_pooled_session(
+    pool_connections=SUPABASE_POOL_CONNECTIONS,
+    pool_maxsize=SUPABASE_POOL_MAXSIZE,
+    connect_timeout=SUPABASE_CONNECT_TIMEOUT,
+    read_timeout=SUPABASE_READ_TIMEOUT,
+    retries=SUPABASE_RETRIES
+))
+
 class SupabaseService:
     def __init__(self):
         self.supabase_url = os.getenv('SUPABASE_URL', 'https://zgqrhzuhrwudckwesybg.supabase.co')
@@ -20,10 +138,89 @@ class SupabaseService:
         }
         print(f"✅ Supabase Service inicializado: {self.supabase_url}")
 
-    def get_orders(self):
-        """Obtener todas las órdenes"""
+    @property
+    def session(self):
+        """Sesión HTTP con keep-alive compartida por todo el proceso"""
+        return _shared_session.get()
+
+    def get_page(self, table, select=None, order='id.asc', limit=100, offset=0, cursor=None, filters=None,
+                 raise_errors=False):
+        """Obtener una página de una tabla con proyección, orden, límite/offset o cursor
+
+        Retorna un dict con 'data', 'total', 'offset', 'limit' y 'next_cursor'.
+        Con cursor se usa paginación por clave (keyset), que no degrada con el
+        tamaño de la tabla como lo hace offset. Ordenando por id el cursor es el
+        id; con otra columna se desempata por id y el cursor es opaco (encode_cursor).
+        Si Supabase responde con error retorna una página vacía, o lanza
+        SupabaseError con raise_errors=True (recorridos que no deben cortarse en silencio).
+        """
+        columns = parse_select(select)
+        order_column, direction, nulls = parse_order(order)
+        limit = max(1, min(int(limit), SUPABASE_MAX_PAGE_SIZE))
+        offset = max(0, int(offset or 0))
+
+        # Columna de orden e id deben venir en la respuesta para calcular el siguiente cursor
+        if columns:
+            for column in (order_column, 'id'):
+                if column not in columns:
+                    columns.append(column)
+
+        order_param = '.'.join(p for p in (order_column, direction, nulls) if p)
+        if order_column != 'id':
+            order_param += f',id.{direction}'
+        params = {
+            'select': ','.join(columns) if columns else '*',
+            'order': order_param,
+            'limit': limit
+        }
+        for column, expression in (filters or {}).items():
+            params[column] = expression
+        if cursor not in (None, ''):
+            if order_column == 'id':
+                params['id'] = '{}.{}'.format('lt' if direction == 'desc' else 'gt', cursor)
+            else:
+                if 'or' in params:
+                    raise ValueError('No se puede combinar un filtro or con paginación por cursor')
+                value, row_id = decode_cursor(cursor)
+                params['or'] = keyset_filter(order_column, direction, nulls, value, row_id)
+            offset = 0
+        elif offset:
+            params['offset'] = offset
+
+        headers = dict(self.headers)
+        if SUPABASE_COUNT_MODE:
+            headers['Prefer'] = f'count={SUPABASE_COUNT_MODE}'
+
+        response = self.session.get(
+            f'{self.supabase_url}/rest/v1/{table}',
+            headers=headers,
+            params=params
+        )
+        if response.status_code not in [200, 206]:
+            print(f"Error getting {table} page: {response.status_code}")
+            if raise_errors:
+                raise SupabaseError(f'Error obteniendo página de {table}', response.status_code)
+            return {'data': [], 'total': None, 'offset': offset, 'limit': limit, 'next_cursor': None}
+
+        rows = response.json()
+        next_cursor = None
+        if len(rows) == limit and rows[-1].get('id') is not None:
+            last = rows[-1]
+            next_cursor = last['id'] if order_column == 'id' else encode_cursor(last.get(order_column), last['id'])
+        return {
+            'data': rows,
+            'total': parse_content_range(response.headers.get('Content-Range')),
+            'offset': offset,
+            'limit': limit,
+            'next_cursor': next_cursor
+        }
+
+    def get_orders(self, **page_args):
+        """Obtener órdenes (todas, o una página si se pasan argumentos de paginación)"""
+        if page_args:
+            return self.get_page('orders', **page_args)['data']
         try:
-            response = requests.get(
+            response = self.session.get(
                 f'{self.supabase_url}/rest/v1/orders',
                 headers=self.headers
             )
@@ -32,10 +229,12 @@ class SupabaseService:
             print(f"Error getting orders: {e}")
             return []
 
-    def get_users(self):
-        """Obtener todos los usuarios"""
+    def get_users(self, **page_args):
+        """Obtener usuarios (todos, o una página si se pasan argumentos de paginación)"""
+        if page_args:
+            return self.get_page('users', **page_args)['data']
         try:
-            response = requests.get(
+            response = self.session.get(
                 f'{self.supabase_url}/rest/v1/users',
                 headers=self.headers
             )
@@ -44,10 +243,12 @@ class SupabaseService:
             print(f"Error getting users: {e}")
             return []
 
-    def get_products(self):
-        """Obtener todos los productos"""
+    def get_products(self, **page_args):
+        """Obtener productos (todos, o una página si se pasan argumentos de paginación)"""
+        if page_args:
+            return self.get_page('products', **page_args)['data']
         try:
-            response = requests.get(
+            response = self.session.get(
                 f'{self.supabase_url}/rest/v1/products',
                 headers=self.headers
             )
@@ -56,10 +257,12 @@ class SupabaseService:
             print(f"Error getting products: {e}")
             return []
 
-    def get_banners(self):
-        """Obtener todos los banners"""
+    def get_banners(self, **page_args):
+        """Obtener banners (todos, o una página si se pasan argumentos de paginación)"""
+        if page_args:
+            return self.get_page('banners', **page_args)['data']
         try:
-            response = requests.get(
+            response = self.session.get(
                 f'{self.supabase_url}/rest/v1/banners',
                 headers=self.headers
             )
@@ -68,12 +271,74 @@ class SupabaseService:
             print(f"Error getting banners: {e}")
             return []
 
+    def get_active_banners(self):
+        """Obtener solo los banners activos (None si Supabase falla)"""
+        try:
+            response = self.session.get(
+                f'{self.supabase_url}/rest/v1/banners',
+                headers=self.headers,
+                params={'is_active': 'eq.true', 'order': 'id.asc'}
+            )
+            return response.json() if response.status_code == 200 else None
+        except Exception as e:
+            print(f"Error getting active banners: {e}")
+            return None
+
+    def get_notification_history(self, since=None, limit=50, cursor=None):
+        """Historial de notificaciones con sincronización incremental y paginación
+
+        Sin since: las más recientes primero; 'next_cursor' pide la página
+        siguiente (más antiguas). Con since (id numérico, cursor 'next_since' o
+        timestamp ISO de created_at): solo las posteriores, en orden ascendente
+        por (created_at, id), para que el cliente las agregue a lo que ya tiene.
+        Un timestamp suelto incluye las filas de ese mismo instante (el cliente
+        deduplica por id). 'next_since' es el valor a enviar en la siguiente
+        sincronización y 'has_more' indica que quedan filas.
+        """
+        since = str(since).strip() if since not in (None, '') else None
+        if since is None:
+            page = self.get_page('notifications', order='created_at.desc', limit=limit, cursor=cursor)
+            newest = page['data'][0] if page['data'] and cursor in (None, '') else None
+        elif since.isdigit():
+            page = self.get_page('notifications', order='id.asc', limit=limit, cursor=since)
+            newest = page['data'][-1] if page['data'] else None
+        else:
+            try:
+                parse_timestamp(since)
+                since_cursor = encode_cursor(since, 0)
+            except ValueError:
+                decode_cursor(since)
+                since_cursor = since
+            page = self.get_page('notifications', order='created_at.asc', limit=limit, cursor=since_cursor)
+            newest = page['data'][-1] if page['data'] else None
+
+        if newest is None:
+            next_since = since
+        elif since is not None and since.isdigit():
+            next_since = str(newest.get('id'))
+        else:
+            next_since = encode_cursor(newest.get('created_at'), newest.get('id'))
+        return {
+            'data': page['data'],
+            'total': page['total'],
+            'has_more': page['next_cursor'] is not None,
+            'next_cursor': page['next_cursor'],
+            'next_since': next_since,
+            'last_modified': newest.get('created_at') if newest else None
+        }
+
+    def _representation_headers(self):
+        """Headers para inserts: sin 'return=representation' PostgREST responde 201 sin cuerpo"""
+        headers = dict(self.headers)
+        headers['Prefer'] = 'return=representation'
+        return headers
+
     def create_product(self, product_data):
-        """Crear un nuevo producto"""
+        """Crear un nuevo producto; retorna la fila creada (lista de PostgREST) o None"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f'{self.supabase_url}/rest/v1/products',
-                headers=self.headers,
+                headers=self._representation_headers(),
                 json=product_data
             )
             return response.json() if response.status_code in [200, 201] else None
@@ -84,7 +349,7 @@ class SupabaseService:
     def update_product(self, product_id, product_data):
         """Actualizar un producto"""
         try:
-            response = requests.patch(
+            response = self.session.patch(
                 f'{self.supabase_url}/rest/v1/products?id=eq.{product_id}',
                 headers=self.headers,
                 json=product_data
@@ -97,7 +362,7 @@ class SupabaseService:
     def delete_product(self, product_id):
         """Eliminar un producto"""
         try:
-            response = requests.delete(
+            response = self.session.delete(
                 f'{self.supabase_url}/rest/v1/products?id=eq.{product_id}',
                 headers=self.headers
             )
@@ -107,11 +372,11 @@ class SupabaseService:
             return False
 
     def create_banner(self, banner_data):
-        """Crear un nuevo banner"""
+        """Crear un nuevo banner; retorna la fila creada (lista de PostgREST) o None"""
         try:
-            response = requests.post(
+            response = self.session.post(
                 f'{self.supabase_url}/rest/v1/banners',
-                headers=self.headers,
+                headers=self._representation_headers(),
                 json=banner_data
             )
             return response.json() if response.status_code in [200, 201] else None
@@ -122,7 +387,7 @@ class SupabaseService:
     def update_banner(self, banner_id, banner_data):
         """Actualizar un banner"""
         try:
-            response = requests.patch(
+            response = self.session.patch(
                 f'{self.supabase_url}/rest/v1/banners?id=eq.{banner_id}',
                 headers=self.headers,
                 json=banner_data
@@ -135,7 +400,7 @@ class SupabaseService:
     def delete_banner(self, banner_id):
         """Eliminar un banner"""
         try:
-            response = requests.delete(
+            response = self.session.delete(
                 f'{self.supabase_url}/rest/v1/banners?id=eq.{banner_id}',
                 headers=self.headers
             )
@@ -143,3 +408,57 @@ class SupabaseService:
         except Exception as e:
             print(f"Error deleting banner: {e}")
             return False
+
+    def get_vehicles(self):
+        """Obtener vehículos"""
+        try:
+            response = self.session.get(
+                f'{self.supabase_url}/rest/v1/vehicles',
+                headers=self.headers,
+                params={'order': 'id.asc'}
+            )
+            return response.json() if response.status_code == 200 else []
+        except Exception as e:
+            print(f"Error getting vehicles: {e}")
+            return []
+
+    def add_vehicle(self, vehicle_data):
+        """Crear un vehículo; retorna la fila creada (lista de PostgREST) o None"""
+        try:
+            response = self.session.post(
+                f'{self.supabase_url}/rest/v1/vehicles',
+                headers=self._representation_headers(),
+                json=vehicle_data
+            )
+            return response.json() if response.status_code in [200, 201] else None
+        except Exception as e:
+            print(f"Error creating vehicle: {e}")
+            return None
+
+    def update_vehicle(self, vehicle_id, vehicle_data):
+        """Actualizar un vehículo"""
+        try:
+            response = self.session.patch(
+                f'{self.supabase_url}/rest/v1/vehicles?id=eq.{vehicle_id}',
+                headers=self.headers,
+                json=vehicle_data
+            )
+            return response.json() if response.status_code == 200 else None
+        except Exception as e:
+            print(f"Error updating vehicle: {e}")
+            return None
+
+    def delete_vehicle(self, vehicle_id):
+        """Eliminar un vehículo"""
+        try:
+            response = self.session.delete(
+                f'{self.supabase_url}/rest/v1/vehicles?id=eq.{vehicle_id}',
+                headers=self.headers
+            )
+            return response.status_code in [200, 204]
+        except Exception as e:
+            print(f"Error deleting vehicle: {e}")
+            return False
+
+# Instancia compartida para blueprints que no necesitan su propia configuración
+supabase_service = SupabaseService()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# Los módulos del backend viven en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Las bases SQLite que los módulos crean al importarse van a un directorio temporal
+_db_dir = tempfile.mkdtemp(prefix='backend-tests-')
+for _name in ('CHARTER_REGISTRY_DB', 'DEDUPE_DB', 'FLIGHT_SEARCH_DB', 'IDEMPOTENCY_DB', 'IMAGE_PIPELINE_DB',
+              'NOTIFICATION_QUEUE_DB', 'PAYMENT_LEDGER_DB', 'PUSH_FANOUT_DB', 'WEBHOOK_INBOX_DB'):
+    os.environ.setdefault(_name, os.path.join(_db_dir, _name.lower() + '.db'))
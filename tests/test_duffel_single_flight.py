@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧪 Búsquedas Duffel idénticas y concurrentes comparten una sola petición
+"""
+
+import threading
+import time
+
+from duffel_service import DuffelService, normalize_search
+
+SEARCH = normalize_search({'origin': 'MIA', 'destination': 'HAV', 'departure_date': '2030-01-15'})
+PAGES = [[{'id': 'off_1'}, {'id': 'off_2'}], [{'id': 'off_3'}]]
+
+
+def make_service(monkeypatch):
+    """Servicio cuyo 'Duffel' emite la primera página y espera a release para la segunda"""
+    service = DuffelService()
+    upstream = {'calls': 0}
+    release = threading.Event()
+
+    def fake_fetch_offer_pages(search, limit=None):
+        upstream['calls'] += 1
+        yield PAGES[0], False
+        assert release.wait(5)
+        yield PAGES[1], True
+
+    monkeypatch.setattr(service, '_fetch_offer_pages', fake_fetch_offer_pages)
+    return service, upstream, release
+
+
+def wait_for_followers(service, count):
+    deadline = time.monotonic() + 5
+    while service.in_flight.stats()['coalesced'] < count:
+        assert time.monotonic() < deadline, 'las búsquedas no se agruparon'
+        time.sleep(0.01)
+
+
+def test_streamed_searches_share_one_upstream_call(monkeypatch):
+    service, upstream, release = make_service(monkeypatch)
+    clients = 8
+    results = [None] * clients
+
+    def consume(i):
+        results[i] = [offer['id'] for page in service.iter_offer_pages(SEARCH, 50) for offer in page]
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    wait_for_followers(service, clients - 1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert upstream['calls'] == 1
+    assert results == [['off_1', 'off_2', 'off_3']] * clients
+    # La búsqueda completa quedó en caché: la siguiente no va a Duffel
+    assert service.search_offers(SEARCH, 50) == [{'id': 'off_1'}, {'id': 'off_2'}, {'id': 'off_3'}]
+    assert upstream['calls'] == 1
+
+
+def test_sync_search_joins_streamed_search(monkeypatch):
+    service, upstream, release = make_service(monkeypatch)
+    leader = service.iter_offer_pages(SEARCH, 50)
+    assert next(leader) == PAGES[0]
+
+    result = {}
+    follower = threading.Thread(target=lambda: result.update(offers=service.search_offers(SEARCH, 50)))
+    follower.start()
+    wait_for_followers(service, 1)
+    release.set()
+    assert list(leader) == [PAGES[1]]
+    follower.join(5)
+
+    assert upstream['calls'] == 1
+    assert [offer['id'] for offer in result['offers']] == ['off_1', 'off_2', 'off_3']
+
+
+def test_followers_complete_when_leader_disconnects(monkeypatch):
+    service, upstream, release = make_service(monkeypatch)
+    leader = service.iter_offer_pages(SEARCH, 50)
+    assert next(leader) == PAGES[0]
+
+    result = {}
+    follower = threading.Thread(target=lambda: result.update(
+        pages=list(service.iter_offer_pages(SEARCH, 50))))
+    follower.start()
+    wait_for_followers(service, 1)
+    release.set()
+    # El cliente originador se desconecta: la petición se termina para quien espera
+    leader.close()
+    follower.join(5)
+
+    assert upstream['calls'] == 1
+    assert result['pages'] == PAGES
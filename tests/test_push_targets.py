@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧪 Un push sin destinatarios solo llega a todos con type/target 'all' explícitos
+"""
+
+from unittest import mock
+
+import pytest
+from flask import Flask
+
+import push_notifications_routes
+from push_fanout import get_target_user_ids
+
+
+@pytest.mark.parametrize('data, expected', [
+    ({'user_ids': [1, 2]}, ['1', '2']),
+    ({'user_id': 7, 'type': 'all'}, ['7']),
+    ({'type': 'all'}, None),
+    ({'target': 'all'}, None)
+])
+def test_target_user_ids(data, expected):
+    assert get_target_user_ids(data) == expected
+
+
+@pytest.mark.parametrize('data', [{}, {'type': 'promo'}, {'type': 'vendors'}, {'user_ids': []}])
+def test_missing_recipients_is_not_a_broadcast(data):
+    with pytest.raises(ValueError):
+        get_target_user_ids(data)
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.register_blueprint(push_notifications_routes.push_bp)
+    return app.test_client()
+
+
+def test_push_without_recipients_is_rejected(client):
+    with mock.patch.object(push_notifications_routes.broadcast_engine, 'start') as start:
+        response = client.post('/api/push-notifications', json={'title': 'Hola', 'message': 'Oferta', 'type': 'promo'})
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    start.assert_not_called()
+
+
+def test_push_to_all_requires_explicit_type(client):
+    with mock.patch.object(push_notifications_routes.broadcast_engine, 'start', return_value='b1') as start, \
+            mock.patch.object(type(push_notifications_routes.supabase_service), 'session', new_callable=mock.PropertyMock):
+        response = client.post('/api/push-notifications', json={'title': 'Hola', 'message': 'Oferta', 'type': 'all'})
+    assert response.status_code == 200
+    assert start.call_args.kwargs['user_ids'] is None
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🛡️ UPLOAD VALIDATION - LÍMITES Y VALIDACIÓN DE ARCHIVOS SUBIDOS
+📏 Límite de tamaño por ruta aplicado mientras se recibe el body y tipo
+   detectado por los primeros bytes (no por la extensión del nombre)
+"""
+
+import re
+from functools import wraps
+
+from flask import Request, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from http_client import env_int
+
+MB = 1024 * 1024
+
+# Tope global para cualquier request (las rutas de subida fijan el suyo)
+UPLOAD_MAX_REQUEST_SIZE = env_int('UPLOAD_MAX_REQUEST_SIZE', 64 * MB)
+# Tope por imagen en productos, banners y vehículos
+UPLOAD_MAX_IMAGE_SIZE = env_int('UPLOAD_MAX_IMAGE_SIZE', 10 * MB)
+# Partes (campos + archivos) admitidas en un formulario multipart
+UPLOAD_MAX_FORM_PARTS = env_int('UPLOAD_MAX_FORM_PARTS', 200)
+
+# Clave del environ WSGI con el límite de la ruta actual
+_LIMIT_ENVIRON_KEY = 'cubalink.max_content_length'
+
+SNIFF_BYTES = 512
+SCAN_CHUNK_SIZE = 64 * 1024
+
+IMAGE_TYPES = {'png', 'jpeg', 'gif', 'webp'}
+LOGO_TYPES = {'png', 'jpeg', 'svg'}
+
+# Extensión con la que se guarda cada tipo detectado
+TYPE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'gif': 'gif', 'webp': 'webp', 'svg': 'svg'}
+
+_SVG_RE = re.compile(rb'^\s*(<\?xml[^>]*>\s*)?(<!--.*?-->\s*)*(<!DOCTYPE[^>]*>\s*)?<svg[\s>]', re.IGNORECASE | re.DOTALL)
+# Contenido activo en SVG: se sirve desde nuestro dominio, así que no se acepta
+_SVG_ACTIVE_RE = re.compile(rb'<script|javascript:|\son[a-z]+\s*=|<foreignObject', re.IGNORECASE)
+
+
+class UploadRejected(Exception):
+    """Archivo rechazado; status_code es 413 (tamaño) o 415 (tipo)"""
+
+    def __init__(self, message, status_code=415):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class UploadLimitedRequest(Request):
+    """Request cuyo max_content_length puede fijarlo cada ruta (ver upload_limit)"""
+
+    max_form_parts = UPLOAD_MAX_FORM_PARTS
+
+    @property
+    def max_content_length(self):
+        limit = self.environ.get(_LIMIT_ENVIRON_KEY)
+        if limit is not None:
+            return limit
+        return super().max_content_length
+
+
+def init_upload_limits(app):
+    """Instalar el request con límites por ruta y el tope global"""
+    app.request_class = UploadLimitedRequest
+    app.config.setdefault('MAX_CONTENT_LENGTH', UPLOAD_MAX_REQUEST_SIZE)
+    if app.config['MAX_CONTENT_LENGTH'] is None:
+        app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_SIZE
+
+
+def sniff_type(head):
+    """Tipo de imagen según los primeros bytes, o None"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if _SVG_RE.match(head.lstrip(b'\xef\xbb\xbf')):
+        return 'svg'
+    return None
+
+
+def _file_size(stream):
+    """Tamaño del archivo ya recibido (werkzeug lo vuelca a disco por encima de 500 KB)"""
+    position = stream.tell()
+    stream.seek(0, 2)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+
+def _scan_svg(stream):
+    """Buscar contenido activo en un SVG leyendo por bloques"""
+    tail = b''
+    while True:
+        chunk = stream.read(SCAN_CHUNK_SIZE)
+        if not chunk:
+            return
+        if _SVG_ACTIVE_RE.search(tail + chunk):
+            raise UploadRejected('El SVG contiene scripts o contenido activo')
+        tail = chunk[-32:]
+
+
+def validate_upload(file, allowed_types=IMAGE_TYPES, max_bytes=UPLOAD_MAX_IMAGE_SIZE):
+    """Validar un FileStorage sin cargarlo en memoria; retorna el tipo detectado
+
+    Anota el tipo en file.detected_type y deja el stream al inicio.
+    Lanza UploadRejected si es muy grande o el contenido no es de un tipo permitido.
+    """
+    stream = file.stream
+    if max_bytes is not None and _file_size(stream) > max_bytes:
+        raise UploadRejected(
+            f'El archivo {file.filename} supera el máximo de {max_bytes // MB} MB', status_code=413)
+
+    stream.seek(0)
+    detected = sniff_type(stream.read(SNIFF_BYTES))
+    stream.seek(0)
+    if detected not in allowed_types:
+        raise UploadRejected(f'El archivo {file.filename} no es un formato permitido '
+                             f'({", ".join(sorted(allowed_types))})')
+    if detected == 'svg':
+        _scan_svg(stream)
+        stream.seek(0)
+    file.detected_type = detected
+    return detected
+
+
+def detected_extension(file):
+    """Extensión según el contenido validado (o la del nombre si no se validó)"""
+    detected = getattr(file, 'detected_type', None)
+    if detected:
+        return TYPE_EXTENSIONS[detected]
+    return (file.filename or '').rsplit('.', 1)[-1].lower() if '.' in (file.filename or '') else 'bin'
+
+
+def _rejected(message, status_code):
+    return jsonify({'success': False, 'error': message, 'message': message}), status_code
+
+
+def upload_limit(max_request_bytes, allowed_types=IMAGE_TYPES, max_file_bytes=UPLOAD_MAX_IMAGE_SIZE):
+    """Decorador: límite de tamaño del request y validación de todos sus archivos
+
+    - Content-Length por encima del límite: 413 sin leer el body.
+    - Sin Content-Length (chunked) werkzeug corta al superar el límite: 413.
+    - Cada archivo se valida con validate_upload antes de entrar a la vista.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.content_length is not None and request.content_length > max_request_bytes:
+                return _rejected(f'La subida supera el máximo de {max_request_bytes // MB} MB', 413)
+            request.environ[_LIMIT_ENVIRON_KEY] = max_request_bytes
+            try:
+                files = request.files
+            except RequestEntityTooLarge:
+                return _rejected(f'La subida supera el máximo de {max_request_bytes // MB} MB', 413)
+            try:
+                for _, file in files.items(multi=True):
+                    if file and file.filename:
+                        validate_upload(file, allowed_types, max_file_bytes)
+            except UploadRejected as e:
+                return _rejected(e.message, e.status_code)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📥 WEBHOOK INBOX - BANDEJA DURABLE DE EVENTOS DE SQUARE
+🧵 El webhook solo guarda el evento; un pool de hilos lo procesa con reintentos,
+   orden por pago y tabla de eventos muertos (dead-letter)
+"""
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from http_client import env_int, env_float
+
+WEBHOOK_INBOX_DB = os.environ.get('WEBHOOK_INBOX_DB', 'webhook_inbox.db')
+WEBHOOK_WORKERS = env_int('WEBHOOK_WORKERS', 4)
+WEBHOOK_MAX_ATTEMPTS = env_int('WEBHOOK_MAX_ATTEMPTS', 8)
+# Backoff exponencial entre reintentos: base * 2^intento, con tope (segundos)
+WEBHOOK_RETRY_BASE = env_float('WEBHOOK_RETRY_BASE', 2)
+WEBHOOK_RETRY_MAX = env_float('WEBHOOK_RETRY_MAX', 600)
+# Un evento 'processing' más viejo que esto se devuelve a la cola (worker caído)
+WEBHOOK_LOCK_TIMEOUT = env_int('WEBHOOK_LOCK_TIMEOUT', 300)
+WEBHOOK_POLL_INTERVAL = env_float('WEBHOOK_POLL_INTERVAL', 1.0)
+# Eventos procesados que se conservan en la bandeja (segundos)
+WEBHOOK_RETENTION = env_int('WEBHOOK_RETENTION', 7 * 24 * 3600)
+
+STATUS_PENDING = 'pending'
+STATUS_PROCESSING = 'processing'
+STATUS_DONE = 'done'
+STATUS_DEAD = 'dead'
+
+
+def retry_delay(attempts):
+    """Segundos hasta el siguiente intento (exponencial con jitter)"""
+    delay = min(WEBHOOK_RETRY_BASE * (2 ** max(0, attempts - 1)), WEBHOOK_RETRY_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+class WebhookInbox:
+    """Bandeja de eventos en SQLite (WAL) con workers en segundo plano
+
+    - add() guarda el evento crudo y retorna enseguida (deduplica por event_id).
+    - Los workers toman el evento pendiente más antiguo cuyo ordering_key (id de
+      pago) no tenga eventos anteriores sin terminar: los eventos de un mismo
+      pago se procesan en orden y los de pagos distintos en paralelo.
+    - Si el handler lanza una excepción se reintenta con backoff; al agotar
+      WEBHOOK_MAX_ATTEMPTS el evento pasa a webhook_dead_letters.
+    """
+
+    def __init__(self, db_path=WEBHOOK_INBOX_DB, workers=WEBHOOK_WORKERS, max_attempts=WEBHOOK_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.handler = None
+        self._started_pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._last_purge = 0
+        self._init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS webhook_events
+                        (id INTEGER PRIMARY KEY AUTOINCREMENT, event_id TEXT UNIQUE, event_type TEXT,
+                         ordering_key TEXT, payload TEXT NOT NULL, status TEXT NOT NULL,
+                         attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL,
+                         locked_at REAL, last_error TEXT, received_at REAL NOT NULL, processed_at REAL)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_webhook_events_status
+                        ON webhook_events (status, next_attempt_at, id)''')
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_webhook_events_ordering
+                        ON webhook_events (ordering_key, status, id)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS webhook_dead_letters
+                        (id INTEGER PRIMARY KEY, event_id TEXT, event_type TEXT, ordering_key TEXT,
+                         payload TEXT NOT NULL, attempts INTEGER NOT NULL, last_error TEXT,
+                         received_at REAL NOT NULL, failed_at REAL NOT NULL)''')
+        conn.close()
+
+    # ===== INGESTA =====
+
+    def add(self, payload, event_id=None, event_type=None, ordering_key=None):
+        """Guardar un evento crudo; retorna (id, duplicado)"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''INSERT OR IGNORE INTO webhook_events
+                                     (event_id, event_type, ordering_key, payload, status, next_attempt_at, received_at)
+                                     VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                  (event_id, event_type, ordering_key, payload, STATUS_PENDING, now, now))
+            if cursor.rowcount == 0:
+                row = conn.execute('SELECT id FROM webhook_events WHERE event_id = ?', (event_id,)).fetchone()
+                return (row['id'] if row else None), True
+            row_id = cursor.lastrowid
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return row_id, False
+
+    # ===== PROCESAMIENTO =====
+
+    def start(self, handler):
+        """Arrancar los workers del proceso actual (idempotente; se relanzan tras un fork)"""
+        self.handler = handler
+        pid = os.getpid()
+        with self._lock:
+            if self._started_pid == pid:
+                return
+            self._started_pid = pid
+            self._wakeup = threading.Event()
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f'webhook-worker-{i}', daemon=True).start()
+        print(f"📥 Webhook inbox: {self.workers} workers procesando eventos")
+
+    def _worker_loop(self):
+        while True:
+            try:
+                if not self.process_next():
+                    self._wakeup.wait(WEBHOOK_POLL_INTERVAL)
+                    self._wakeup.clear()
+            except Exception as e:
+                print(f"❌ Webhook inbox: error en worker: {e}")
+                time.sleep(WEBHOOK_POLL_INTERVAL)
+
+    def _claim(self):
+        """Reservar el siguiente evento procesable respetando el orden por ordering_key"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''UPDATE webhook_events SET status = ?, locked_at = NULL
+                            WHERE status = ? AND locked_at < ?''',
+                         (STATUS_PENDING, STATUS_PROCESSING, now - WEBHOOK_LOCK_TIMEOUT))
+            row = conn.execute('''SELECT * FROM webhook_events e
+                                  WHERE e.status = ? AND e.next_attempt_at <= ?
+                                    AND NOT EXISTS (SELECT 1 FROM webhook_events p
+                                                    WHERE p.ordering_key = e.ordering_key AND p.id < e.id
+                                                      AND p.status IN (?, ?))
+                                  ORDER BY e.id LIMIT 1''',
+                               (STATUS_PENDING, now, STATUS_PENDING, STATUS_PROCESSING)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE webhook_events SET status = ?, locked_at = ?, attempts = attempts + 1 WHERE id = ?',
+                             (STATUS_PROCESSING, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return row
+
+    def process_next(self):
+        """Procesar un evento; False si no había ninguno disponible"""
+        row = self._claim()
+        if row is None:
+            self._purge()
+            return False
+
+        attempts = row['attempts'] + 1
+        try:
+            self.handler(json.loads(row['payload']))
+        except Exception as e:
+            self._fail(row, attempts, str(e))
+            return True
+
+        conn = self._connect()
+        conn.execute('UPDATE webhook_events SET status = ?, processed_at = ?, last_error = NULL WHERE id = ?',
+                     (STATUS_DONE, time.time(), row['id']))
+        conn.close()
+        # Puede haber eventos del mismo pago esperando a este
+        self._wakeup.set()
+        return True
+
+    def _fail(self, row, attempts, error):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            if attempts >= self.max_attempts:
+                print(f"☠️ Webhook {row['event_id']} ({row['event_type']}) enviado a dead-letter: {error}")
+                conn.execute('''INSERT OR REPLACE INTO webhook_dead_letters
+                                (id, event_id, event_type, ordering_key, payload, attempts, last_error,
+                                 received_at, failed_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                             (row['id'], row['event_id'], row['event_type'], row['ordering_key'], row['payload'],
+                              attempts, error, row['received_at'], now))
+                conn.execute('UPDATE webhook_events SET status = ?, last_error = ?, locked_at = NULL WHERE id = ?',
+                             (STATUS_DEAD, error, row['id']))
+            else:
+                delay = retry_delay(attempts)
+                print(f"⚠️ Webhook {row['event_id']} falló (intento {attempts}), reintento en {delay:.0f}s: {error}")
+                conn.execute('''UPDATE webhook_events SET status = ?, last_error = ?, locked_at = NULL,
+                                next_attempt_at = ? WHERE id = ?''',
+                             (STATUS_PENDING, error, now + delay, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def _purge(self):
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        conn = self._connect()
+        conn.execute('DELETE FROM webhook_events WHERE status = ? AND processed_at < ?',
+                     (STATUS_DONE, now - WEBHOOK_RETENTION))
+        conn.close()
+
+    # ===== OPERACIÓN =====
+
+    def retry_dead_letter(self, event_row_id):
+        """Devolver un evento de dead-letter a la cola; False si no existe"""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT id FROM webhook_dead_letters WHERE id = ?', (event_row_id,)).fetchone()
+            if row is not None:
+                conn.execute('''UPDATE webhook_events SET status = ?, attempts = 0, next_attempt_at = ?,
+                                last_error = NULL WHERE id = ?''', (STATUS_PENDING, time.time(), event_row_id))
+                conn.execute('DELETE FROM webhook_dead_letters WHERE id = ?', (event_row_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        if row is not None:
+            self._wakeup.set()
+        return row is not None
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counts = {row['status']: row['total'] for row in conn.execute(
+                'SELECT status, COUNT(*) AS total FROM webhook_events GROUP BY status')}
+            dead_letters = [dict(row) for row in conn.execute(
+                '''SELECT id, event_id, event_type, ordering_key, attempts, last_error, failed_at
+                   FROM webhook_dead_letters ORDER BY failed_at DESC LIMIT 20''')]
+        finally:
+            conn.close()
+        return {
+            'workers': self.workers,
+            'pending': counts.get(STATUS_PENDING, 0),
+            'processing': counts.get(STATUS_PROCESSING, 0),
+            'done': counts.get(STATUS_DONE, 0),
+            'dead': counts.get(STATUS_DEAD, 0),
+            'dead_letters': dead_letters
+        }
+
+
+# Bandeja compartida del proceso
+webhook_inbox = WebhookInbox()
@@ -6,169 +6,169 @@ Maneja notificaciones automáticas de Square sobre cambios en pagos
 """
 
 from flask import Blueprint, request, jsonify
+from auth_routes import require_auth
+from webhook_inbox import webhook_inbox
+from dedupe_index import DedupeIndex, extract_event_id
+from square_service import square_service
+from payment_ledger import payment_ledger
 import json
-import hmac
-import hashlib
-import os
 from datetime import datetime
 
 webhook_bp = Blueprint('webhook', __name__, url_prefix='/webhooks')
 
-# Clave secreta del webhook (configurar en Square Dashboard)
-WEBHOOK_SECRET = os.environ.get('SQUARE_WEBHOOK_SECRET', '')
+# Eventos ya recibidos: las reentregas de Square se descartan sin parsear el body
+webhook_dedupe = DedupeIndex('square_webhooks')
 
 @webhook_bp.route('/square', methods=['POST'])
 def handle_square_webhook():
-    """Manejar webhooks de Square"""
+    """Recibir webhooks de Square: verificar, guardar en la bandeja y responder enseguida
+
+    El procesamiento ocurre en segundo plano (webhook_inbox.py); así Square
+    recibe su 200 en milisegundos y no reintenta por acks lentos.
+    """
     try:
+        # Reentrega de un evento ya recibido: responder sin parsear ni procesar nada
+        event_id = extract_event_id(request.get_data())
+        if event_id and webhook_dedupe.seen(event_id):
+            return jsonify({'status': 'duplicate'}), 200
+        
         # Verificar la firma del webhook
         if not verify_webhook_signature(request):
             return jsonify({'error': 'Signature verification failed'}), 401
         
-        # Obtener datos del webhook
-        webhook_data = request.get_json()
+        webhook_data = request.get_json(silent=True)
+        if not isinstance(webhook_data, dict):
+            return jsonify({'error': 'Payload inválido'}), 400
         event_type = webhook_data.get('type')
-        
-        print(f"🔔 Webhook recibido: {event_type}")
-        print(f"📝 Datos: {webhook_data}")
-        
-        # Procesar según el tipo de evento
-        if event_type == 'payment.created':
-            return handle_payment_created(webhook_data)
-        elif event_type == 'payment.updated':
-            return handle_payment_updated(webhook_data)
-        elif event_type == 'refund.created':
-            return handle_refund_created(webhook_data)
-        elif event_type == 'refund.updated':
-            return handle_refund_updated(webhook_data)
-        else:
-            print(f"⚠️ Evento no manejado: {event_type}")
-            return jsonify({'status': 'ignored'}), 200
+        event_id = webhook_data.get('event_id') or event_id
+        
+        webhook_inbox.start(process_square_event)
+        row_id, duplicate = webhook_inbox.add(
+            request.get_data(as_text=True),
+            event_id=event_id,
+            event_type=event_type,
+            ordering_key=get_ordering_key(webhook_data)
+        )
+        if event_id:
+            webhook_dedupe.add(event_id)
+        print(f"🔔 Webhook {'duplicado' if duplicate else 'encolado'}: {event_type} ({event_id})")
+        return jsonify({'status': 'duplicate' if duplicate else 'queued'}), 200
             
     except Exception as e:
-        print(f"❌ Error procesando webhook: {e}")
+        print(f"❌ Error recibiendo webhook: {e}")
         return jsonify({'error': str(e)}), 500
 
+@webhook_bp.route('/square/stats', methods=['GET'])
+@require_auth
+def webhook_stats():
+    """Estado de la bandeja de webhooks (pendientes, procesados, dead-letter) y duplicados descartados"""
+    return jsonify({'success': True, 'stats': webhook_inbox.stats(), 'dedupe': webhook_dedupe.stats()})
+
+@webhook_bp.route('/square/dead-letters/<int:event_row_id>/retry', methods=['POST'])
+@require_auth
+def retry_dead_letter(event_row_id):
+    """Reencolar un evento que agotó sus reintentos"""
+    if not webhook_inbox.retry_dead_letter(event_row_id):
+        return jsonify({'success': False, 'error': 'Evento no encontrado'}), 404
+    return jsonify({'success': True})
+
+def get_ordering_key(webhook_data):
+    """Id del pago al que pertenece el evento: sus eventos se procesan en orden"""
+    obj = (webhook_data.get('data') or {}).get('object') or {}
+    if 'payment' in obj:
+        return obj['payment'].get('id')
+    if 'refund' in obj:
+        return obj['refund'].get('payment_id')
+    return (webhook_data.get('data') or {}).get('id')
+
+def process_square_event(webhook_data):
+    """Procesar un evento de la bandeja (en un worker); lanza excepción para reintentar"""
+    event_type = webhook_data.get('type')
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler is None:
+        print(f"⚠️ Evento no manejado: {event_type}")
+        return
+    handler(webhook_data)
+
 def verify_webhook_signature(request):
-    """Verificar la firma del webhook de Square"""
-    if not WEBHOOK_SECRET:
+    """Verificar la firma del webhook de Square (con la clave del cliente compartido)"""
+    if not square_service.webhook_secret:
         print("⚠️ SQUARE_WEBHOOK_SECRET no configurado, saltando verificación")
         return True
     
     try:
-        # Obtener la firma del header
-        signature = request.headers.get('X-Square-Signature')
-        if not signature:
-            return False
-        
-        # Construir el payload para verificación
-        body = request.get_data()
-        url = request.url
-        
-        # Crear el string a verificar
-        string_to_sign = url + body.decode('utf-8')
-        
-        # Calcular la firma esperada
-        expected_signature = hmac.new(
-            WEBHOOK_SECRET.encode('utf-8'),
-            string_to_sign.encode('utf-8'),
-            hashlib.sha256
-        ).digest()
-        
-        # Comparar firmas
-        return hmac.compare_digest(signature.encode('utf-8'), expected_signature)
-        
+        return square_service.verify_webhook_signature(
+            request.get_data(),
+            request.url,
+            request.headers.get('X-Square-Signature'),
+            sha256_signature=request.headers.get('X-Square-HmacSha256-Signature')
+        )
     except Exception as e:
         print(f"❌ Error verificando firma: {e}")
         return False
 
 def handle_payment_created(webhook_data):
     """Manejar evento de pago creado"""
-    try:
-        payment = webhook_data.get('data', {}).get('object', {}).get('payment', {})
-        payment_id = payment.get('id')
-        amount = payment.get('amount_money', {}).get('amount', 0) / 100
-        status = payment.get('status')
-        
-        print(f"💰 Pago creado: {payment_id} - ${amount} - {status}")
-        
-        # Aquí podrías actualizar tu base de datos local
-        # update_payment_status(payment_id, status, amount)
-        
-        return jsonify({'status': 'processed'}), 200
-        
-    except Exception as e:
-        print(f"❌ Error procesando payment.created: {e}")
-        return jsonify({'error': str(e)}), 500
+    payment = webhook_data.get('data', {}).get('object', {}).get('payment', {})
+    payment_id = payment.get('id')
+    amount = payment.get('amount_money', {}).get('amount', 0) / 100
+    status = payment.get('status')
+    
+    print(f"💰 Pago creado: {payment_id} - ${amount} - {status}")
+    
+    payment_ledger.apply_square_payment(payment)
 
 def handle_payment_updated(webhook_data):
     """Manejar evento de pago actualizado"""
-    try:
-        payment = webhook_data.get('data', {}).get('object', {}).get('payment', {})
-        payment_id = payment.get('id')
-        status = payment.get('status')
-        
-        print(f"🔄 Pago actualizado: {payment_id} - {status}")
-        
-        # Actualizar estado en base de datos
-        # update_payment_status(payment_id, status)
-        
-        # Si el pago fue completado, procesar lógica de negocio
-        if status == 'COMPLETED':
-            print(f"✅ Pago completado: {payment_id}")
-            # process_completed_payment(payment_id)
-        elif status == 'FAILED':
-            print(f"❌ Pago falló: {payment_id}")
-            # process_failed_payment(payment_id)
-        
-        return jsonify({'status': 'processed'}), 200
-        
-    except Exception as e:
-        print(f"❌ Error procesando payment.updated: {e}")
-        return jsonify({'error': str(e)}), 500
+    payment = webhook_data.get('data', {}).get('object', {}).get('payment', {})
+    payment_id = payment.get('id')
+    status = payment.get('status')
+    
+    print(f"🔄 Pago actualizado: {payment_id} - {status}")
+    
+    payment_ledger.apply_square_payment(payment)
+    
+    # Si el pago fue completado, procesar lógica de negocio
+    if status == 'COMPLETED':
+        print(f"✅ Pago completado: {payment_id}")
+        # process_completed_payment(payment_id)
+    elif status == 'FAILED':
+        print(f"❌ Pago falló: {payment_id}")
+        # process_failed_payment(payment_id)
 
 def handle_refund_created(webhook_data):
     """Manejar evento de reembolso creado"""
-    try:
-        refund = webhook_data.get('data', {}).get('object', {}).get('refund', {})
-        refund_id = refund.get('id')
-        payment_id = refund.get('payment_id')
-        amount = refund.get('amount_money', {}).get('amount', 0) / 100
-        
-        print(f"💸 Reembolso creado: {refund_id} para pago {payment_id} - ${amount}")
-        
-        # Actualizar base de datos con información del reembolso
-        # create_refund_record(refund_id, payment_id, amount)
-        
-        return jsonify({'status': 'processed'}), 200
-        
-    except Exception as e:
-        print(f"❌ Error procesando refund.created: {e}")
-        return jsonify({'error': str(e)}), 500
+    refund = webhook_data.get('data', {}).get('object', {}).get('refund', {})
+    refund_id = refund.get('id')
+    payment_id = refund.get('payment_id')
+    amount = refund.get('amount_money', {}).get('amount', 0) / 100
+    
+    print(f"💸 Reembolso creado: {refund_id} para pago {payment_id} - ${amount}")
+    
+    payment_ledger.apply_square_refund(refund)
 
 def handle_refund_updated(webhook_data):
     """Manejar evento de reembolso actualizado"""
-    try:
-        refund = webhook_data.get('data', {}).get('object', {}).get('refund', {})
-        refund_id = refund.get('id')
-        status = refund.get('status')
-        
-        print(f"🔄 Reembolso actualizado: {refund_id} - {status}")
-        
-        # Actualizar estado del reembolso
-        # update_refund_status(refund_id, status)
-        
-        return jsonify({'status': 'processed'}), 200
-        
-    except Exception as e:
-        print(f"❌ Error procesando refund.updated: {e}")
-        return jsonify({'error': str(e)}), 500
+    refund = webhook_data.get('data', {}).get('object', {}).get('refund', {})
+    refund_id = refund.get('id')
+    status = refund.get('status')
+    
+    print(f"🔄 Reembolso actualizado: {refund_id} - {status}")
+    
+    payment_ledger.apply_square_refund(refund)
+
+# Handlers por tipo de evento (ejecutados por los workers de webhook_inbox)
+EVENT_HANDLERS = {
+    'payment.created': handle_payment_created,
+    'payment.updated': handle_payment_updated,
+    'refund.created': handle_refund_created,
+    'refund.updated': handle_refund_updated
+}
 
-# Funciones helper para base de datos (implementar según tu sistema)
+# Funciones helper de negocio (el estado de pagos y reembolsos vive en payment_ledger)
 def update_payment_status(payment_id, status, amount=None):
-    """Actualizar estado de pago en base de datos"""
-    # TODO: Implementar según tu sistema de base de datos
-    pass
+    """Actualizar estado de pago en el ledger local"""
+    return payment_ledger.update_status(payment_id, status, amount)
 
 def process_completed_payment(payment_id):
     """Procesar lógica cuando un pago se completa"""
@@ -186,15 +186,17 @@ def process_failed_payment(payment_id):
     pass
 
 def create_refund_record(refund_id, payment_id, amount):
-    """Crear registro de reembolso en base de datos"""
-    # TODO: Implementar según tu sistema
-    pass
+    """Crear registro de reembolso en el ledger local"""
+    payment_ledger.apply_square_refund({
+        'id': refund_id,
+        'payment_id': payment_id,
+        'status': 'PENDING',
+        'amount_money': {'amount': round(amount * 100)}
+    })
 
 def update_refund_status(refund_id, status):
-    """Actualizar estado de reembolso"""
-    # TODO: Implementar según tu sistema
-    pass
-
-
-
+    """Actualizar estado de reembolso en el ledger local"""
+    return payment_ledger.update_refund_status(refund_id, status)
 
+# Procesar lo que haya quedado pendiente en la bandeja (p.ej. tras un reinicio)
+webhook_inbox.start(process_square_event)
@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🏭 WSGI - PUNTO DE ENTRADA DE PRODUCCIÓN
+🚀 gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+# La app se configura al importar el módulo (rutas, blueprints y extensiones)
+from admin_server import app  # noqa: F401